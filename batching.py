@@ -0,0 +1,338 @@
+"""Micro-batching of index writes for live updates.
+
+Instead of one find_one plus one insert_one per message per subscriber,
+documents are buffered and written with a single bulk write when the buffer
+reaches a size limit or a short time window expires. Upserting on
+(user_id, file_hash) with $setOnInsert keeps the old "skip if already indexed"
+behaviour without the extra round trip. Edits and deletions are queued as
+update operations in the same buffer so they apply in arrival order.
+
+Operations are kept as plain dicts until they are written, so a batch that
+can't reach MongoDB can be handed to the write-ahead spool (see spool.py)
+and replayed later instead of being dropped. Backfilled history is written
+through the same breaker and spool with write_documents. Sync marks are
+spooled along with their operations and reported once the replay has
+written them.
+"""
+import time
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import UpdateOne, UpdateMany
+
+import metrics
+from scheduler import LIVE
+
+logger = logging.getLogger(__name__)
+
+# A buffered write. mark is an optional (chat, message_id) reported once the write is stored.
+PendingWrite = namedtuple('PendingWrite', 'operation event_time queued_at is_insert mark')
+
+
+def build_operation(spec):
+    """Turn an operation dict ({'op', 'filter', 'update', 'upsert'}) into a pymongo write."""
+    if spec['op'] == 'update_one':
+        return UpdateOne(spec['filter'], spec['update'], upsert=spec.get('upsert', False))
+    if spec['op'] == 'update_many':
+        return UpdateMany(spec['filter'], spec['update'], upsert=spec.get('upsert', False))
+    raise ValueError(f"Unknown operation {spec['op']!r}")
+
+
+def insert_operation(document):
+    """Operation dict that indexes a document unless (user_id, file_hash) already exists."""
+    return {
+        'op': 'update_one',
+        'filter': {'user_id': document['user_id'], 'file_hash': document['file_hash']},
+        'update': {'$setOnInsert': document},
+        'upsert': True,
+    }
+
+
+class IndexBatcher:
+    """Buffers documents and flushes them as bulk upserts by size or time."""
+
+    def __init__(self, collection, max_batch=100, max_delay=0.5, on_flushed=None, spool=None, breaker=None,
+                 scheduler=None):
+        self.collection = collection
+        # Flushes take a LIVE slot, so they queue with downloads and backfill for MongoDB
+        self.scheduler = scheduler
+        self.on_flushed = on_flushed
+        self.spool = spool
+        self.breaker = breaker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._buffer = []
+        self._timer = None
+        self._lock = asyncio.Lock()
+        self._pending = set()
+
+    def ensure_indexes(self):
+        self.collection.create_index([("user_id", pymongo.ASCENDING), ("file_hash", pymongo.ASCENDING)])
+
+    def add(self, document, event_time=None, mark=None):
+        """Queue a document for the next flush.
+
+        Args:
+            document: The document to index (must contain user_id and file_hash)
+            event_time: When the message was posted, used for latency metrics
+            mark: Passed to on_flushed once the document has been written
+        """
+        self._queue(PendingWrite(insert_operation(document), event_time, time.monotonic(), True, mark))
+
+    def add_update(self, filter, update, many=True):
+        """Queue an update (e.g. an edit or a tombstone) for the next flush."""
+        operation = {'op': 'update_many' if many else 'update_one', 'filter': filter, 'update': update}
+        self._queue(PendingWrite(operation, None, time.monotonic(), False, None))
+
+    def _queue(self, pending):
+        self._buffer.append(pending)
+        metrics.gauge("indexing.buffered", len(self._buffer))
+
+        # Schedule once when the buffer fills up, flush() takes care of any overflow
+        if len(self._buffer) == self.max_batch:
+            self._schedule_flush()
+        elif self._timer is None and len(self._buffer) < self.max_batch:
+            loop = asyncio.get_event_loop()
+            self._timer = loop.call_later(self.max_delay, self._schedule_flush)
+
+    def add_many(self, documents, event_time=None, marks=None):
+        """Queue several documents (e.g. an album) next to each other in the buffer."""
+        marks = marks or [None] * len(documents)
+        for document, mark in zip(documents, marks):
+            self.add(document, event_time, mark)
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self):
+        """Write up to max_batch buffered operations with one bulk write."""
+        if self.scheduler is None:
+            return await self._flush()
+        async with self.scheduler.slot(LIVE):
+            return await self._flush()
+
+    async def _flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+            metrics.gauge("indexing.buffered", len(self._buffer))
+
+            # Documents that arrived while this flush was waiting go in the next one
+            if len(self._buffer) >= self.max_batch:
+                self._schedule_flush()
+            elif self._buffer and self._timer is None:
+                self._timer = asyncio.get_event_loop().call_later(self.max_delay, self._schedule_flush)
+
+            operations = [pending.operation for pending in batch]
+
+            # Inserts alone can be applied in any order, updates must follow their inserts
+            ordered = not all(pending.is_insert for pending in batch)
+
+            loop = asyncio.get_event_loop()
+            try:
+                result = await self._store(loop, batch, operations, ordered)
+            except Exception:
+                # Logged and counted by _store, the batch is lost
+                return 0
+            if result is None:
+                return 0
+            return result.upserted_count
+
+    async def write_documents(self, documents, mark=None):
+        """Index documents right away (e.g. a page of backfilled history).
+
+        Goes through the same circuit breaker and write-ahead spool as
+        flushes, after anything buffered or spooled before it.
+
+        Args:
+            documents: The documents to index
+            mark: Passed to on_flushed once the documents have been written,
+                which is after the replay if they were spooled
+
+        Returns:
+            The number of new documents, or None if they were spooled until
+            the database is back
+
+        Raises whatever the write raised if the documents could neither be
+        written nor spooled.
+        """
+        now = time.monotonic()
+        batch = [PendingWrite(insert_operation(document), None, now, True, None) for document in documents]
+        if batch and mark is not None:
+            batch[-1] = batch[-1]._replace(mark=mark)
+        async with self._lock:
+            result = await self._store(asyncio.get_event_loop(), batch, [pending.operation for pending in batch], False)
+        return None if result is None else result.upserted_count
+
+    async def _store(self, loop, batch, operations, ordered):
+        """Write a batch, or spool it while the database is unavailable.
+
+        Returns the bulk write result, or None if the batch was spooled.
+        Raises if the batch could neither be written nor spooled.
+        """
+        if self._should_spool():
+            # Database known to be down (or older writes still spooled): keep the order
+            await self._spool(loop, batch, operations)
+            return None
+
+        try:
+            # Run the blocking driver call off the event loop
+            result = await loop.run_in_executor(None, self._write, operations, ordered)
+        except Exception as e:
+            logger.error(f"Bulk index write of {len(batch)} documents failed: {e}")
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            if self.spool is None:
+                metrics.incr("indexing.failed_documents", len(batch))
+                raise
+            await self._spool(loop, batch, operations)
+            return None
+
+        if self.breaker is not None:
+            self.breaker.record_success()
+        self._record(batch, result.upserted_count)
+        # Marks only move once their documents are in MongoDB
+        await loop.run_in_executor(None, self._report, [pending.mark for pending in batch])
+        return result
+
+    def _report(self, marks):
+        """Hand the marks of written operations to on_flushed."""
+        marks = [tuple(mark) for mark in marks if mark is not None]
+        if not marks or self.on_flushed is None:
+            return
+        try:
+            self.on_flushed(marks)
+        except Exception as e:
+            logger.error(f"Error in flush callback: {e}")
+
+    def _should_spool(self):
+        if self.spool is None:
+            return False
+        if len(self.spool):
+            return True
+        return self.breaker is not None and not self.breaker.allow()
+
+    async def _spool(self, loop, batch, operations):
+        """Append a batch to the write-ahead spool instead of dropping it."""
+        # The mark rides along with its operation and is reported by the replay
+        operations = [
+            operation if pending.mark is None else dict(operation, mark=list(pending.mark))
+            for pending, operation in zip(batch, operations)
+        ]
+        try:
+            await loop.run_in_executor(None, self.spool.append, operations)
+        except Exception as e:
+            logger.error(f"Spooling {len(batch)} operations failed: {e}")
+            metrics.incr("indexing.failed_documents", len(batch))
+            raise
+        logger.warning(f"Spooled {len(batch)} operations ({len(self.spool)} waiting for the database)")
+
+    def _write(self, operations, ordered=False):
+        return self.collection.bulk_write([build_operation(spec) for spec in operations], ordered=ordered)
+
+    async def replay_spool(self):
+        """Write spooled operations to the collection in order.
+
+        Flushes wait until the replay is done, so nothing overtakes the
+        spooled writes. The marks spooled with the operations are reported
+        to on_flushed as each replayed batch is written. Returns the number
+        of replayed operations; raises if the database fails again (whatever
+        wasn't written stays spooled).
+        """
+        if self.spool is None or not len(self.spool):
+            return 0
+
+        def write(operations):
+            self._write(operations, ordered=True)
+            self._report([operation.get('mark') for operation in operations])
+
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self.spool.replay, write)
+
+    def _record(self, batch, inserted):
+        now = time.monotonic()
+        now_utc = datetime.now(timezone.utc)
+
+        inserts = sum(1 for pending in batch if pending.is_insert)
+
+        metrics.incr("indexing.flushes")
+        metrics.incr("indexing.documents", inserted)
+        metrics.incr("indexing.duplicates", inserts - inserted)
+        metrics.incr("indexing.updates", len(batch) - inserts)
+        metrics.observe("indexing.batch_size", len(batch))
+
+        for pending in batch:
+            event_time = pending.event_time
+            metrics.observe("indexing.buffer_delay", now - pending.queued_at)
+            if event_time is not None:
+                if event_time.tzinfo is None:
+                    event_time = event_time.replace(tzinfo=timezone.utc)
+                metrics.observe("indexing.event_to_searchable", (now_utc - event_time).total_seconds())
+
+        logger.info(f"Flushed {len(batch)} operations ({inserted} new documents)")
+
+    async def stop(self):
+        """Flush anything left in the buffer (call on shutdown)."""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        while self._buffer:
+            await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class AlbumBuffer:
+    """Collects the messages of an album (same grouped_id) before indexing them.
+
+    Telegram delivers an album as separate updates that arrive within a few
+    hundred milliseconds of each other. Each new item restarts a short timer;
+    when it expires the whole group is handed to on_album in one call.
+    """
+
+    def __init__(self, on_album, delay=0.5):
+        self.on_album = on_album
+        self.delay = delay
+        self._albums = {}
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, grouped_id, item):
+        self._albums.setdefault(grouped_id, []).append(item)
+
+        timer = self._timers.pop(grouped_id, None)
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_event_loop()
+        self._timers[grouped_id] = loop.call_later(self.delay, self._release, grouped_id)
+
+    def _release(self, grouped_id):
+        self._timers.pop(grouped_id, None)
+        items = self._albums.pop(grouped_id, [])
+        if not items:
+            return
+        metrics.observe("indexing.album_size", len(items))
+        try:
+            self.on_album(items)
+        except Exception as e:
+            logger.error(f"Error indexing album {grouped_id}: {e}", exc_info=True)
+
+    def release_all(self):
+        """Hand over every pending album immediately (call on shutdown)."""
+        for grouped_id in list(self._albums):
+            timer = self._timers.get(grouped_id)
+            if timer is not None:
+                timer.cancel()
+            self._release(grouped_id)
@@ -0,0 +1,207 @@
+"""Bloom filter over indexed (user_id, file_hash) pairs.
+
+Reindexing a source mostly meets files that are already indexed, and used to
+pay one find_one per message to find that out. The filter answers "definitely
+not indexed" from memory; only the (few) possible duplicates of a batch are
+checked against MongoDB, with a single $in query. The filter is persisted to
+disk and on startup only documents inserted since it was saved are added, so
+the full collection is scanned only the first time.
+"""
+import os
+import math
+import time
+import struct
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOOM_FILE = os.getenv(
+    'BLOOM_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'file_hashes.bloom')
+)
+
+# Header: magic, bit count, hash count, items added, capacity, error rate, saved at
+_HEADER = struct.Struct('<4sQIQQdd')
+_MAGIC = b'BLM1'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one BLAKE2b digest."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def size_bytes(self):
+        return len(self.bits)
+
+    def estimated_fp_rate(self):
+        """False-positive probability for the number of items added so far."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def save(self, path, saved_at=None):
+        """Write the filter atomically (temp file + rename)."""
+        header = _HEADER.pack(
+            _MAGIC, self.num_bits, self.num_hashes, self.count,
+            self.capacity, self.error_rate, saved_at or time.time()
+        )
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return (filter, saved_at) read from path."""
+        with open(path, 'rb') as f:
+            magic, num_bits, num_hashes, count, capacity, error_rate, saved_at = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            bloom = cls.__new__(cls)
+            bloom.capacity = capacity
+            bloom.error_rate = error_rate
+            bloom.num_bits = num_bits
+            bloom.num_hashes = num_hashes
+            bloom.count = count
+            bloom.bits = bytearray(f.read())
+        if len(bloom.bits) != (num_bits + 7) // 8:
+            raise ValueError(f"{path} is truncated")
+        return bloom, saved_at
+
+
+def file_key(user_id, file_hash):
+    return f"{user_id}:{file_hash}"
+
+
+class FileHashFilter:
+    """Bloom filter over the documents collection, kept on disk between runs.
+
+    Until load() has finished every key is reported as possibly present, so
+    callers fall back to checking MongoDB.
+    """
+
+    def __init__(self, collection, path=BLOOM_FILE, capacity=1000000, error_rate=0.001):
+        self.collection = collection
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None
+        self._lock = threading.Lock()
+        metrics.gauge("bloom.items", lambda: self.bloom.count if self.bloom else 0)
+        metrics.gauge("bloom.size_bytes", lambda: self.bloom.size_bytes if self.bloom else 0)
+        metrics.gauge("bloom.fp_rate", lambda: round(self.bloom.estimated_fp_rate(), 6) if self.bloom else 1.0)
+
+    @property
+    def ready(self):
+        return self.bloom is not None
+
+    def load(self):
+        """Load the saved filter and add newer documents, or rebuild from scratch (blocking)."""
+        started = time.time()
+        try:
+            bloom, saved_at = BloomFilter.load(self.path)
+        except FileNotFoundError:
+            self.rebuild()
+            return
+        except Exception as e:
+            logger.warning(f"Could not load Bloom filter ({e}), rebuilding")
+            self.rebuild()
+            return
+
+        # ObjectIds carry their creation time; a margin covers clock skew and slow writes
+        since = ObjectId.from_datetime(datetime.utcfromtimestamp(saved_at) - timedelta(minutes=5))
+        added = self._fill(bloom, {'_id': {'$gte': since}})
+        with self._lock:
+            self.bloom = bloom
+        logger.info(f"Loaded Bloom filter with {bloom.count} items (+{added} new) in {time.time() - started:.1f}s")
+
+        if bloom.estimated_fp_rate() > self.error_rate * 2:
+            # Grown past its capacity, resize
+            self.rebuild()
+
+    def rebuild(self):
+        """Build a new filter from every document in the collection (blocking)."""
+        started = time.time()
+        total = self.collection.estimated_document_count()
+        bloom = BloomFilter(max(self.capacity, total * 2), self.error_rate)
+        self._fill(bloom, {})
+        with self._lock:
+            self.bloom = bloom
+        self.save()
+        logger.info(
+            f"Rebuilt Bloom filter: {bloom.count} items, {bloom.size_bytes / 1024 / 1024:.1f} MB, "
+            f"estimated false-positive rate {bloom.estimated_fp_rate():.5f} in {time.time() - started:.1f}s"
+        )
+
+    def _fill(self, bloom, query):
+        added = 0
+        for doc in self.collection.find(query, {'user_id': 1, 'file_hash': 1, '_id': 0}):
+            bloom.add(file_key(doc.get('user_id'), doc.get('file_hash')))
+            added += 1
+        return added
+
+    def save(self):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.save(self.path)
+
+    def add(self, user_id, file_hash):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(file_key(user_id, file_hash))
+
+    def might_contain(self, user_id, file_hash):
+        if self.bloom is None:
+            return True
+        if file_key(user_id, file_hash) in self.bloom:
+            metrics.incr("bloom.positives")
+            return True
+        metrics.incr("bloom.negatives")
+        return False
+
+    def existing_hashes(self, user_id, file_hashes):
+        """Return the subset of file_hashes already indexed for user_id.
+
+        Hashes the filter rules out never reach MongoDB; the rest are checked
+        with one query.
+        """
+        candidates = [file_hash for file_hash in file_hashes if self.might_contain(user_id, file_hash)]
+        if not candidates:
+            return set()
+
+        existing = {
+            doc['file_hash'] for doc in self.collection.find(
+                {'user_id': user_id, 'file_hash': {'$in': candidates}},
+                {'file_hash': 1, '_id': 0}
+            )
+        }
+        if self.bloom is not None:
+            metrics.incr("bloom.false_positives", len(candidates) - len(existing))
+        return existing
@@ -7,22 +7,41 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.constants import ParseMode
 from telethon import TelegramClient
-from telethon.tl.types import InputPeerChannel, InputPeerChat
+from telethon.tl.types import InputPeerChannel, InputPeerChat, PeerChannel
 from telethon.tl.functions.messages import GetHistoryRequest
-from telethon.errors import ChannelPrivateError, ChatAdminRequiredError, PhoneNumberInvalidError, PhoneCodeInvalidError, SessionPasswordNeededError, PasswordHashInvalidError, PhoneCodeExpiredError, FloodWaitError, PhoneNumberBannedError
+from telethon.errors import ChannelPrivateError, ChatAdminRequiredError, PhoneNumberInvalidError, PhoneCodeInvalidError, SessionPasswordNeededError, PasswordHashInvalidError, PhoneCodeExpiredError, FloodWaitError, PhoneNumberBannedError, FileReferenceExpiredError
 import pymongo
 from fuzzywuzzy import fuzz
 from telethon import events
 import re
 import time
 import asyncio
+import threading
 from telethon.sessions import StringSession
 import html
 from telegram.error import BadRequest
 from telethon import types
+from telethon import utils
 import uuid
 from bson import ObjectId
-from FastTelethonhelper import fast_download
+import metrics
+from rate_limiter import RateLimiter, RateLimitedClient, HISTORY_PAGE_SIZE
+from entity_cache import EntityCache, INVALID_PEER_ERRORS
+from routing import RoutingTable
+from batching import IndexBatcher, AlbumBuffer
+from gap_recovery import SyncState, recover_gaps
+from jobs import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from client_pool import ClientPool
+from file_locations import media_location, is_fresh, download_location, stale_message_ids, refresh_locations, REFRESH_BATCH_SIZE
+from bloom import FileHashFilter
+from spool import WriteSpool, CircuitBreaker, OPEN as BREAKER_OPEN
+from scheduler import WorkScheduler, INTERACTIVE, LIVE, CONNECT, BACKFILL
+from delivery import ReferenceDelivery, file_kind, send_file
+from file_id_cache import FileIdCache, document_key
+from download_manager import DownloadManager
+from media_cache import MediaCache
+from parallel_download import downloader
+from prefetch import Prefetcher, PREFETCH_TOP
 
 # Load environment variables
 load_dotenv()
@@ -46,78 +65,121 @@ logger = logging.getLogger(__name__)
 mongo_available = True
 logger.info("MongoDB support is enabled")
 
-# Initialize MongoDB collections
-if mongo_available:
-    max_retries = 3
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-            client.admin.command('ping')  # Check if MongoDB is running
-            db = client['telegram_search_bot']
-            documents_collection = db['documents']
-            users_collection = db['users']
-            sources_collection = db['sources']
-            
-            # Test a simple query to verify collections work
-            users_count = users_collection.count_documents({})
-            logger.info(f"MongoDB connection successful. Users found: {users_count}")
-            break
-        except Exception as e:
-            retry_count += 1
-            logger.error(f"MongoDB connection attempt {retry_count} failed: {e}")
-            if retry_count == max_retries:
-                logger.error("All MongoDB connection attempts failed. Running in limited mode.")
-                mongo_available = False
-            else:
-                # Wait before retrying
-                time.sleep(1)
+# The client connects lazily, so collections are usable even if the server is down right now
+client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+db = client['telegram_search_bot']
+documents_collection = db['documents']
+users_collection = db['users']
+sources_collection = db['sources']
+jobs_collection = db['jobs']
+file_ids_collection = db['file_ids']
+sync_state_collection = db['sync_state']
 
-# Create dummy collections if MongoDB is not available
-if not mongo_available:
-    logger.warning("MongoDB is not available. Running in limited mode without database support.")
-    class DummyCollection:
-        def __init__(self):
-            self.data = []
-        
-        def find(self, query=None):
-            return DummyResults([])
-        
-        def find_one(self, query=None):
-            return None
-        
-        def update_one(self, query, update, upsert=False):
-            return None
-        
-        def insert_one(self, document):
-            class DummyInsertResult:
-                def __init__(self):
-                    self.inserted_id = "dummy_id"
-            return DummyInsertResult()
-            
-        def count(self):
-            return 0
-    
-    class DummyResults:
-        def __init__(self, results):
-            self.results = results
-        
-        def sort(self, *args, **kwargs):
-            return self
-        
-        def limit(self, n):
-            return self
-        
-        def count(self):
-            return len(self.results)
+max_retries = 3
+retry_count = 0
+
+while retry_count < max_retries:
+    try:
+        client.admin.command('ping')  # Check if MongoDB is running
         
-        def __iter__(self):
-            return iter(self.results)
-    
-    documents_collection = DummyCollection()
-    users_collection = DummyCollection()
-    sources_collection = DummyCollection()
+        # Test a simple query to verify collections work
+        users_count = users_collection.count_documents({})
+        logger.info(f"MongoDB connection successful. Users found: {users_count}")
+        break
+    except Exception as e:
+        retry_count += 1
+        logger.error(f"MongoDB connection attempt {retry_count} failed: {e}")
+        if retry_count == max_retries:
+            logger.error("All MongoDB connection attempts failed. Running in limited mode.")
+            mongo_available = False
+        else:
+            # Wait before retrying
+            time.sleep(1)
+
+if not mongo_available:
+    logger.warning("MongoDB is not available. Index writes are spooled until it comes back.")
+
+def on_mongo_state_change(state):
+    """Circuit breaker callback: stop sending requests to MongoDB while it is down."""
+    global mongo_available
+    if state == BREAKER_OPEN:
+        mongo_available = False
+
+# Fails fast while MongoDB is down instead of waiting for server selection on every write
+mongo_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('MONGO_FAILURE_THRESHOLD', 3)),
+    reset_timeout=float(os.getenv('MONGO_RETRY_INTERVAL', 30)),
+    on_state_change=on_mongo_state_change
+)
+if not mongo_available:
+    mongo_breaker.trip()
+
+# Index writes that couldn't reach MongoDB, replayed in order once it is back
+write_spool = WriteSpool()
+
+# Set once indexes exist and the job queue runs (see start_database_services)
+database_services_started = False
+
+# Set in main when the user session receives live updates
+live_updates_enabled = False
+
+# Background indexing jobs (workers are started in post_init)
+job_queue = JobQueue(
+    jobs_collection,
+    workers=int(os.getenv('INDEX_WORKERS', 2)),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+)
+
+# Newest indexed message per monitored chat, used to recover gaps after downtime
+sync_state = SyncState(sync_state_collection)
+
+# Downloads go ahead of live updates, live updates ahead of new sources and reindex backfills
+work_scheduler = WorkScheduler(
+    slots=int(os.getenv('SCHEDULER_SLOTS', 4)),
+    aging=float(os.getenv('SCHEDULER_AGING', 30))
+)
+
+# Live updates are written in micro-batches; marks advance only after a write succeeds
+index_batcher = IndexBatcher(
+    documents_collection,
+    max_batch=int(os.getenv('INDEX_BATCH_SIZE', 100)),
+    max_delay=float(os.getenv('INDEX_BATCH_DELAY', 0.5)),
+    on_flushed=sync_state.advance,
+    spool=write_spool,
+    breaker=mongo_breaker,
+    scheduler=work_scheduler
+)
+
+# Indexed (user_id, file_hash) pairs, so reindexing skips known files without a query per message
+file_hash_filter = FileHashFilter(
+    documents_collection,
+    capacity=int(os.getenv('BLOOM_CAPACITY', 1000000)),
+    error_rate=float(os.getenv('BLOOM_ERROR_RATE', 0.001))
+)
+
+# Bot API file_ids of uploaded files, shared by every document of the same file
+file_id_cache = FileIdCache(file_ids_collection, documents_collection)
+
+# Copies original posts or resends known file_ids instead of downloading and uploading
+reference_delivery = ReferenceDelivery(file_id_cache)
+
+# Downloaded files, shared with the website and kept under MEDIA_CACHE_BYTES
+media_cache = MediaCache()
+
+# One download per file however many users ask for it at once
+download_manager = DownloadManager(cache=media_cache)
+
+# Top search results and viewed files are fetched into the media cache ahead of a download (PREFETCH=1)
+prefetcher = Prefetcher(download_manager, media_cache, work_scheduler)
+
+# Album items are held briefly so each album is indexed as one group
+album_buffer = AlbumBuffer(lambda messages: index_album(messages), delay=float(os.getenv('ALBUM_DELAY', 0.5)))
+
+# Set in post_init so Telethon event handlers can reach per-user bot data
+bot_application = None
+
+# Sources that still need a chat id lookup at startup (see main)
+unrouted_sources = []
 
 # Create directories for session files
 os.makedirs("sessions", exist_ok=True)
@@ -125,12 +187,42 @@ os.makedirs("clean_sessions", exist_ok=True)
 
 # Use the existing session file directly - exactly like the working auth_simple.py approach
 SESSION_PHONE = os.getenv('Phone_number', '')  # Use the phone number directly
-user_client = TelegramClient(
-    SESSION_PHONE,  # Phone number as session name
-    API_ID,
-    API_HASH
+
+# Name of the main account in the client pool (stored with file locations it indexed)
+PRIMARY_ACCOUNT = SESSION_PHONE or "primary"
+
+# Requests are throttled through buckets shared with the website process
+rate_limiter = RateLimiter()
+user_client = RateLimitedClient(
+    TelegramClient(
+        SESSION_PHONE,  # Phone number as session name
+        API_ID,
+        API_HASH
+    ),
+    rate_limiter
 )
 
+# Resolved channels/groups, shared with the website so lookups aren't repeated
+entity_cache = EntityCache(SESSION_PHONE)
+
+# Monitored chat id -> subscribed users, consulted before any other work for live updates
+routing_table = RoutingTable()
+
+# Backfill and downloads go to the least throttled account that can read the chat
+client_pool = ClientPool()
+
+
+# Extra authorized session files (comma separated) that share the indexing load
+EXTRA_SESSIONS = [name.strip() for name in os.getenv('EXTRA_SESSIONS', '').split(',') if name.strip()]
+for session_name in EXTRA_SESSIONS:
+    session_limiter = RateLimiter(namespace=session_name)
+    client_pool.add(
+        session_name,
+        RateLimitedClient(TelegramClient(session_name, API_ID, API_HASH), session_limiter),
+        session_limiter,
+        EntityCache(session_name)
+    )
+
 
 # Constants for user state
 AWAITING_SOURCE = "awaiting_source"
@@ -219,6 +311,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/search - Search for documents\n"
         "/recent - View recent documents\n"
         "/sources - List all connected sources\n"
+        "/jobs - Show your background indexing jobs\n"
+        "/stats - Show rate limiting and indexing statistics\n"
         "/help - Show this help message\n\n"
         "इस बॉट की मदद से आप टेलीग्राम चैनल और ग्रुप में दस्तावेज़ खोज सकते हैं।\n\n"
         "इस बॉट का प्रभावी ढंग से उपयोग करने के लिए:\n"
@@ -232,6 +326,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/search - दस्तावेज़ खोजें\n"
         "/recent - हाल के दस्तावेज़ देखें\n"
         "/sources - सभी जुड़े स्रोतों की सूची देखें\n"
+        "/jobs - अपने बैकग्राउंड इंडेक्सिंग जॉब देखें\n"
+        "/stats - रेट लिमिटिंग और इंडेक्सिंग के आंकड़े देखें\n"
         "/help - यह सहायता संदेश दिखाएं"
     )
     
@@ -344,7 +440,7 @@ async def recent_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Get recent documents
     recent_docs = documents_collection.find(
-        {'user_id': user_id}
+        {'user_id': user_id, 'deleted': {'$ne': True}}
     ).sort('date', -1).limit(50)  # Get the latest 50 documents
     
     recent_docs_list = list(recent_docs)
@@ -460,6 +556,7 @@ async def search_in_sources(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Find documents that match the query
         results = list(documents_collection.find({
             "user_id": user_id,
+            "deleted": {"$ne": True},
             "$or": [
                 {"text": regex_pattern},
                 {"content_searchable": regex_pattern},
@@ -503,6 +600,9 @@ async def search_in_sources(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if current_row:
             keyboard.append(current_row)
         
+        # Users mostly download one of the first few results
+        prefetch_documents(user_id, results[:PREFETCH_TOP])
+        
         # Add navigation buttons if needed
         if len(results) > 10:
             keyboard.append([
@@ -670,6 +770,9 @@ async def view_file(update: Update, context: ContextTypes.DEFAULT_TYPE, doc_id):
         if text:
             message_text += f"<b>Content:</b>\n<i>{text}</i>\n\n"
         
+        # Likely downloaded next; the other results' prefetches are cancelled
+        prefetch_documents(user_id, [doc])
+        
         # Create keyboard with download button and back button
         keyboard = [
             [InlineKeyboardButton("⬇️ Download File", callback_data=f"download_{doc_id}")],
@@ -735,6 +838,21 @@ async def download_file(update: Update, context: ContextTypes.DEFAULT_TYPE, doc_
             await query.answer("Document not found or access denied.")
             return
         
+        # The source message is gone, don't spend a round trip finding that out
+        if document.get('deleted'):
+            await query.answer("This file was deleted from its channel or group.")
+            return
+        
+        # Copy the original post or resend a known file_id: no bytes go through the bot
+        original = document.get('original_message', {})
+        if await reference_delivery.deliver(
+            context.bot, user_id, document,
+            bot_chat_id(original.get('chat_id')),
+            caption=f"File: {document.get('file_name', '')}"
+        ):
+            await query.answer("File sent.")
+            return
+        
         # Check if user_client is connected and authorized
         if not user_client or not user_client.is_connected():
             await query.answer("Not connected to Telegram. Please authenticate first with /auth.")
@@ -759,88 +877,53 @@ async def download_file(update: Update, context: ContextTypes.DEFAULT_TYPE, doc_
             )
             return
         
-        # Get the message from Telegram
-        message = await user_client.get_messages(chat_id, ids=message_id)
+        # Concurrent requests for the same file (from any user) share one download
+        key = document_key(document) or str(doc_id)
+        file_name = os.path.basename(document.get('file_name') or f"file_{message_id}")
+        target = cache_target(document)
+        prefetcher.claim(target)
         
-        if not message:
-            await query.message.reply_text(
-                "Error: Could not retrieve the message from Telegram. The message may have been deleted.\n\n"
-                "त्रुटि: टेलीग्राम से संदेश प्राप्त नहीं किया जा सका। संदेश हटा दिया गया हो सकता है।"
-            )
-            return
+        async def download(part_path):
+            # Downloads are interactive, they go ahead of live indexing and backfill
+            await download_document(document, part_path, INTERACTIVE, user_id)
         
-        # Check if message has media
-        if not message.media:
-            await query.message.reply_text(
-                "This message does not contain any file to download.\n\n"
-                "इस संदेश में डाउनलोड करने के लिए कोई फ़ाइल नहीं है।"
-            )
-            return
-        
-        # Download the file
-        if document.get('mime_type', '').startswith('image/'):
-            file_path = await user_client.download_media(message, file='downloads/')
-        else:
-            file_path = await fast_download(user_client, message, download_folder='downloads/')
-        
-        if not file_path:
-            await query.message.reply_text(
-                "Error: Failed to download the file. Please try again.\n\n"
-                "त्रुटि: फ़ाइल डाउनलोड करने में विफल। कृपया पुनः प्रयास करें।"
-            )
+        try:
+            file_path = await download_manager.fetch(key, target, download)
+        except MediaUnavailableError as e:
+            await query.message.reply_text(str(e))
             return
         
         # Send the file to the user
-        file_name = os.path.basename(file_path)
         mime_type = document.get('mime_type', '')
-        
-        # Send status message
-        status_message = await query.message.reply_text(
-            f"File downloaded. Sending to you now...\n\n"
-            f"फ़ाइल डाउनलोड की गई। अब आपको भेज रहे हैं..."
-        )
-        
-        # Send based on the file type
-        with open(file_path, 'rb') as file:
-            if mime_type and mime_type.startswith('image/'):
-                await context.bot.send_photo(
-                    chat_id=user_id,
-                    photo=file,
-                    caption=f"File: {file_name}"
-                )
-            elif mime_type and mime_type.startswith('video/'):
-                await context.bot.send_video(
-                    chat_id=user_id,
-                    video=file,
-                    caption=f"File: {file_name}"
-                )
-            elif mime_type and mime_type.startswith('audio/'):
-                await context.bot.send_audio(
-                    chat_id=user_id,
-                    audio=file,
-                    caption=f"File: {file_name}"
-                )
-            else:
-                # Send as document for all other types
-                await context.bot.send_document(
-                    chat_id=user_id,
-                    document=file,
-                    filename=file_name,
-                    caption=f"File: {file_name}"
+        try:
+            # Send status message
+            status_message = await query.message.reply_text(
+                f"File downloaded. Sending to you now...\n\n"
+                f"फ़ाइल डाउनलोड की गई। अब आपको भेज रहे हैं..."
+            )
+            
+            # Send based on the file type
+            with open(file_path, 'rb') as file:
+                sent = await send_file(
+                    context.bot, user_id, file, file_kind(mime_type),
+                    file_name=file_name, caption=f"File: {file_name}"
                 )
+            metrics.incr("delivery.upload")
+        finally:
+            # The file stays in the media cache for the next request and the website
+            download_manager.release(file_path)
+        
+        # Keep the file_id so the next request for this file (by any user) is sent by reference
+        try:
+            file_id_cache.store(document, sent)
+        except Exception as e:
+            logger.error(f"Could not store file_id for document {doc_id}: {e}")
         
         # Update status message
         await status_message.edit_text(
             f"✅ File sent successfully: {file_name}\n\n"
             f"✅ फ़ाइल सफलतापूर्वक भेजी गई: {file_name}"
         )
-        
-        # Clean up the file
-        try:
-            os.remove(file_path)
-            logger.info(f"Deleted temporary file: {file_path}")
-        except Exception as e:
-            logger.error(f"Error deleting temporary file {file_path}: {e}")
             
     except Exception as e:
         logger.error(f"Error downloading file: {e}")
@@ -849,6 +932,123 @@ async def download_file(update: Update, context: ContextTypes.DEFAULT_TYPE, doc_
             f"फ़ाइल डाउनलोड करने में त्रुटि: {str(e)}"
         )
 
+def cache_target(document):
+    """Path of a document's file in the media cache."""
+    key = document_key(document) or str(document['_id'])
+    return media_cache.path(key, document.get('file_type') or 'bin')
+
+def prefetch_documents(user_id, documents):
+    """Start speculative downloads of documents the user is likely to download next."""
+    if not prefetcher.enabled or not user_client or not user_client.is_connected():
+        return
+    candidates = []
+    for document in documents:
+        # Sent by reference or gone: nothing to download
+        if document.get('deleted') or document.get('file_id') or not document.get('original_message'):
+            continue
+        
+        target = cache_target(document)
+        
+        async def download(part_path, document=document, target=target):
+            # Speculative work only uses capacity nothing else is waiting for; tagged with
+            # the path, so prefetcher.claim can promote it once a user asks for the file
+            priority = INTERACTIVE if prefetcher.requested(target) else BACKFILL
+            await download_document(document, part_path, priority, user_id, tag=target)
+        
+        key = document_key(document) or str(document['_id'])
+        candidates.append((key, target, document.get('file_size'), download))
+    prefetcher.prefetch(user_id, candidates)
+
+class MediaUnavailableError(Exception):
+    """The indexed message, or its media, no longer exists on Telegram."""
+
+async def download_document(document, path, priority=INTERACTIVE, user_id=None, tag=None):
+    """Download the file of an indexed document to path.
+    
+    Starts straight from the stored file location when its reference is still
+    fresh, otherwise fetches the message (refreshing other stale locations from
+    the same chat in the same request) and downloads from its media.
+    
+    The download holds a scheduler slot of the given priority, and offers it
+    to more urgent work after every part, like backfill does between pages.
+    
+    Raises:
+        MediaUnavailableError: If the message or its media is gone
+    """
+    ticket = await work_scheduler.acquire(priority, user_id, tag)
+    # Parts arrive from several connections at once; one of them hands the slot over at a time
+    handover = asyncio.Lock()
+    
+    async def checkpoint(downloaded, size):
+        nonlocal ticket
+        async with handover:
+            ticket = await work_scheduler.checkpoint(ticket)
+    
+    try:
+        await _download_document(document, path, checkpoint)
+    finally:
+        work_scheduler.release(ticket)
+
+async def _download_document(document, path, progress_callback):
+    original_message = document['original_message']
+    chat_id = original_message['chat_id']
+    message_id = original_message['message_id']
+    
+    location = document.get('location')
+    account = client_pool.acquire_account(location['account']) if is_fresh(location) else None
+    if account is not None:
+        try:
+            await account.limiter.acquire('download')
+            await download_location(account.client.client, location, path, progress_callback)
+            return
+        except FileReferenceExpiredError:
+            logger.info(f"Stored file reference for document {document['_id']} expired, refreshing")
+            metrics.incr("downloads.reference_expired")
+        finally:
+            client_pool.release(account)
+    
+    # Get the message from Telegram through the least throttled account in the chat
+    account, entity = await client_pool.acquire(chat_id, 'download')
+    try:
+        # One request also refreshes other stale locations from this chat
+        message_ids = [message_id] + [
+            stale_id for stale_id in stale_message_ids(documents_collection, chat_id)
+            if stale_id != message_id
+        ][:REFRESH_BATCH_SIZE - 1]
+        try:
+            messages = await refresh_locations(account.client, documents_collection, entity, message_ids, account.name)
+        except INVALID_PEER_ERRORS:
+            entity = await account.entity_cache.resolve(account.client, chat_id, refresh=True)
+            messages = await refresh_locations(account.client, documents_collection, entity, message_ids, account.name)
+        
+        message = messages.get(message_id)
+        if not message:
+            raise MediaUnavailableError(
+                "Error: Could not retrieve the message from Telegram. The message may have been deleted.\n\n"
+                "त्रुटि: टेलीग्राम से संदेश प्राप्त नहीं किया जा सका। संदेश हटा दिया गया हो सकता है।"
+            )
+        
+        location = media_location(message, account.name)
+        if location is None:
+            raise MediaUnavailableError(
+                "This message does not contain any file to download.\n\n"
+                "इस संदेश में डाउनलोड करने के लिए कोई फ़ाइल नहीं है।"
+            )
+        
+        # Download with the same account (file references are per account)
+        await account.limiter.acquire('download')
+        await download_location(account.client.client, location, path, progress_callback)
+    finally:
+        client_pool.release(account)
+
+def bot_chat_id(chat_id):
+    """Bot API id of an indexed chat (original_message stores the bare id)."""
+    if not chat_id:
+        return None
+    if chat_id in routing_table.basic_group_ids():
+        return -chat_id
+    return utils.get_peer_id(PeerChannel(chat_id))
+
 async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button clicks from inline keyboards."""
     query = update.callback_query
@@ -1057,43 +1257,10 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         logger.error(f"Button click error: {e}")
         await query.answer(f"Error: {str(e)}")
 
-async def cleanup_downloads(max_age_hours=24):
-    """Clean up old downloaded files to free up space.
-    
-    Args:
-        max_age_hours: Maximum age of files in hours before they're deleted
-    """
+async def cleanup_downloads():
+    """Load the media cache index and evict downloads down to the cache budget."""
     try:
-        downloads_dir = "downloads"
-        if not os.path.exists(downloads_dir):
-            return
-            
-        current_time = datetime.now()
-        deleted_count = 0
-        
-        for filename in os.listdir(downloads_dir):
-            file_path = os.path.join(downloads_dir, filename)
-            
-            # Skip directories
-            if not os.path.isfile(file_path):
-                continue
-                
-            # Get file age
-            file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-            file_age = current_time - file_mtime
-            
-            # Delete files older than max_age_hours
-            if file_age.total_seconds() > max_age_hours * 3600:
-                try:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    logger.info(f"Deleted old file: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_path}: {e}")
-        
-        if deleted_count > 0:
-            logger.info(f"Cleanup: deleted {deleted_count} old files from downloads directory")
-        
+        media_cache.load()
     except Exception as e:
         logger.error(f"Error during downloads cleanup: {e}")
 
@@ -1162,21 +1329,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         'date_added': datetime.now()
                     }).inserted_id
                     
-                    connecting_message = await update.message.reply_text(
-                        f"Successfully connected to {source_name}!\n"
-                        f"Fetching existing messages and indexing them... This may take a while.\n\n"
-                        f"{source_name} से सफलतापूर्वक जुड़ गए!\n"
-                        f"मौजूदा संदेशों को फ़ेच और इंडेक्स किया जा रहा है... इसमें कुछ समय लग सकता है।"
+                    # Index existing messages in the background
+                    job_id = job_queue.enqueue(
+                        'index_source', user_id,
+                        {'source_id': str(source_id), 'source_name': source_name, 'limit': 300},
+                        description=f"Index {source_name}",
+                        priority=CONNECT
                     )
                     
-                    # Fetch and index existing messages
-                    indexed_count = await fetch_and_index_messages(user_id, source_name, source_id)
-                    
-                    await connecting_message.edit_text(
+                    await update.message.reply_text(
                         f"Successfully connected to {source_name}!\n"
-                        f"Indexed {indexed_count} messages from this source.\n\n"
+                        f"Existing messages are being indexed in the background (job {job_id}).\n"
+                        f"You will get a message when it is done. Use /jobs to check progress.\n\n"
                         f"{source_name} से सफलतापूर्वक जुड़ गए!\n"
-                        f"इस स्रोत से {indexed_count} संदेशों को इंडेक्स किया गया।"
+                        f"मौजूदा संदेशों को बैकग्राउंड में इंडेक्स किया जा रहा है (जॉब {job_id})।\n"
+                        f"पूरा होने पर आपको संदेश मिलेगा। प्रगति देखने के लिए /jobs का उपयोग करें।"
                     )
                     
                     # Reset user state
@@ -1230,7 +1397,107 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "/help - मदद प्राप्त करें"
         )
 
-async def fetch_and_index_messages(user_id, source_name, source_id, limit=300):
+def get_file_details(message):
+    """Return (file_name, file_type, file_size, mime_type) for a media message."""
+    file_name = "Unnamed file"
+    file_type = "unknown"
+    file_size = 0
+    mime_type = ""
+    
+    # Check message media type and extract details
+    if hasattr(message.media, 'document'):
+        # Document (file)
+        doc = message.media.document
+        file_size = doc.size
+        mime_type = doc.mime_type or ""
+        
+        # Get file type from mime type
+        if mime_type:
+            file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
+            
+        # Get filename from attributes
+        for attr in doc.attributes:
+            if hasattr(attr, 'file_name') and attr.file_name:
+                file_name = attr.file_name
+                if '.' in file_name and not file_type:
+                    file_type = file_name.split('.')[-1]
+                break
+                
+    elif hasattr(message.media, 'photo'):
+        # Photo
+        file_type = "photo"
+        mime_type = "image/jpeg"
+        file_name = f"photo_{message.id}.jpg"
+        # Determine file size from photo sizes
+        try:
+            file_size = max(getattr(s, 'size', 0) for s in message.media.photo.sizes)
+        except Exception:
+            file_size = 0
+        
+    elif hasattr(message.media, 'video'):
+        # Video
+        file_type = "video"
+        mime_type = "video/mp4"
+        file_name = f"video_{message.id}.mp4"
+        
+    elif hasattr(message.media, 'audio'):
+        # Audio
+        file_type = "audio"
+        mime_type = "audio/mp3"
+        file_name = f"audio_{message.id}.mp3"
+    
+    return file_name, file_type, file_size, mime_type
+
+def album_captions(messages):
+    """Map each album (grouped_id) in messages to the caption of whichever item has one."""
+    captions = {}
+    for message in messages:
+        if message.grouped_id and message.text and message.grouped_id not in captions:
+            captions[message.grouped_id] = message.text
+    return captions
+
+def build_document(message, chat_id, user_id, source_id, source_name, text=None, account=PRIMARY_ACCOUNT):
+    """Build the document stored in the index for a media message.
+    
+    Args:
+        message: The Telethon message with media
+        chat_id: Bare id of the chat the message was posted in
+        user_id: The user the document is indexed for
+        source_id: MongoDB ID of the user's source document
+        source_name: Display name of the channel or group
+        text: Caption to use when the message has none (album items)
+        account: Pool account the message was fetched with (owner of the file location)
+    """
+    file_name, file_type, file_size, mime_type = get_file_details(message)
+    
+    # Generate a file hash for deduplication
+    file_hash = hashlib.md5(f"{chat_id}_{message.id}_{file_name}".encode()).hexdigest()
+    
+    # Will stream on-demand via website; no local storage in indexer
+    
+    return {
+        'user_id': user_id,
+        'source_id': str(source_id),
+        'source_name': source_name,
+        'file_name': file_name,
+        'file_type': file_type,
+        'file_size': file_size,
+        'mime_type': mime_type,
+        'file_hash': file_hash,
+        'text': message.text or text or "",
+        'grouped_id': message.grouped_id,
+        'date': message.date,
+        # Store original message details for later retrieval
+        'original_message': {
+            'chat_id': chat_id,
+            'message_id': message.id
+        },
+        # Lets downloads start without fetching the message first
+        'location': media_location(message, account),
+        'indexed_at': datetime.now()
+    }
+
+async def fetch_and_index_messages(user_id, source_name, source_id, limit=300, priority=BACKFILL):
     """Fetch and index existing messages from a channel or group.
     
     Args:
@@ -1238,158 +1505,203 @@ async def fetch_and_index_messages(user_id, source_name, source_id, limit=300):
         source_name: The name/username of the channel or group
         source_id: MongoDB ID of the source document
         limit: Maximum number of messages to fetch (default: 300)
+        priority: Scheduler class (CONNECT for a new source, BACKFILL for reindexing)
         
     Returns:
-        The number of indexed messages
+        The number of indexed messages (including any spooled until MongoDB is back)
+    
+    Raises whatever kept the source from being indexed.
     """
     indexed_count = 0
     
+    # Held while talking to Telegram and MongoDB; handed over between history pages
+    ticket = await work_scheduler.acquire(priority, user_id)
     try:
-        # Verify client is connected and authorized
-        if not user_client.is_connected() or not await user_client.is_user_authorized():
-            logger.warning(f"Cannot fetch messages for {source_name}: client not connected or not authorized")
-            return 0
-        
-        # Try to resolve the entity
+        # Pick the least throttled connected account that can read this chat
+        # (the entity comes from that account's cache, so repeat indexing doesn't hit ResolveUsername)
         try:
-            entity = await user_client.get_entity(source_name)
+            account, entity = await client_pool.acquire(source_name, 'iter_messages')
         except Exception as e:
-            # Try with different formats
-            try:
-                if source_name.isdigit():
-                    entity = await user_client.get_entity(int(source_name))
-                else:
-                    # Try with @ prefix
-                    entity = await user_client.get_entity(f"@{source_name}")
-            except Exception as inner_e:
-                logger.error(f"Could not resolve entity {source_name}: {inner_e}")
-                return 0
+            logger.error(f"Could not resolve entity {source_name}: {e}")
+            raise
+        
+        # Start routing live updates from this chat to the user
+        remember_source_chat(user_id, source_id, entity)
         
         # Get messages
         messages = []
         
         try:
             # Fetch messages from the channel/group
-            async for message in user_client.iter_messages(entity, limit=limit):
-                # Check if message has media
-                if message.media:
-                    messages.append(message)
+            try:
+                count = 0
+                async for message in account.client.iter_messages(entity.input_peer, limit=limit):
+                    # Check if message has media
+                    if message.media:
+                        messages.append(message)
+                    count += 1
+                    if count % HISTORY_PAGE_SIZE == 0:
+                        # Let downloads and live updates in between pages
+                        ticket = await work_scheduler.checkpoint(ticket)
+            except INVALID_PEER_ERRORS as e:
+                # The cached access hash is stale, resolve again and retry once
+                logger.info(f"Cached entity for {source_name} rejected ({e}), refreshing")
+                entity = await account.entity_cache.resolve(account.client, source_name, refresh=True)
+                messages = []
+                count = 0
+                async for message in account.client.iter_messages(entity.input_peer, limit=limit):
+                    if message.media:
+                        messages.append(message)
+                    count += 1
+                    if count % HISTORY_PAGE_SIZE == 0:
+                        ticket = await work_scheduler.checkpoint(ticket)
         except Exception as e:
             logger.error(f"Error fetching messages from {source_name}: {e}")
-            return 0
+            raise
+        finally:
+            client_pool.release(account)
         
-        # Process each message
+        # Album items only carry the caption on one message, spread it to the others
+        captions = album_captions(messages)
+        
+        # Build the documents for this user
+        documents = []
         for message in messages:
             try:
-                # Skip messages without media
-                if not message.media:
-                    continue
-                
-                # Determine file details
-                file_name = "Unnamed file"
-                file_type = "unknown"
-                file_size = 0
-                mime_type = ""
-                text_content = message.text or message.caption or ""
-                
-                # Check message media type and extract details
-                if hasattr(message.media, 'document'):
-                    # Document (file)
-                    doc = message.media.document
-                    file_size = doc.size
-                    mime_type = doc.mime_type or ""
-                    
-                    # Get file type from mime type
-                    if mime_type:
-                        file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
-                        
-                    # Get filename from attributes
-                    for attr in doc.attributes:
-                        if hasattr(attr, 'file_name') and attr.file_name:
-                            file_name = attr.file_name
-                            if '.' in file_name and not file_type:
-                                file_type = file_name.split('.')[-1]
-                            break
-                            
-                elif hasattr(message.media, 'photo'):
-                    # Photo
-                    file_type = "photo"
-                    mime_type = "image/jpeg"
-                    file_name = f"photo_{message.id}.jpg"
-                    # Determine file size from photo sizes
-                    try:
-                        file_size = max(getattr(s, 'size', 0) for s in message.media.photo.sizes)
-                    except Exception:
-                        file_size = 0
-                    
-                elif hasattr(message.media, 'video'):
-                    # Video
-                    file_type = "video"
-                    mime_type = "video/mp4"
-                    file_name = f"video_{message.id}.mp4"
-                    
-                elif hasattr(message.media, 'audio'):
-                    # Audio
-                    file_type = "audio"
-                    mime_type = "audio/mp3"
-                    file_name = f"audio_{message.id}.mp3"
-                    
-                # Generate a file hash for deduplication
-                file_hash = hashlib.md5(f"{entity.id}_{message.id}_{file_name}".encode()).hexdigest()
-                
-                # Will stream on-demand via website; no local storage in indexer
-                
-                # Store original message details for later retrieval
-                original_message = {
-                    'chat_id': entity.id,
-                    'message_id': message.id
-                }
-                
-                # Skip if this file is already indexed for this user
-                existing_doc = documents_collection.find_one({
-                    'user_id': user_id,
-                    'file_hash': file_hash
-                })
-                
-                if existing_doc:
-                    logger.info(f"Document already exists for user {user_id}, skipping")
-                    continue
-                    
-                # Add document to database
-                document_data = {
-                    'user_id': user_id,
-                    'source_id': str(source_id),
-                    'source_name': getattr(entity, 'title', source_name),
-                    'file_name': file_name,
-                    'file_type': file_type,
-                    'file_size': file_size,
-                    'mime_type': mime_type,
-                    'file_hash': file_hash,
-                    'text': text_content,
-                    'date': message.date,
-                    'original_message': original_message,
-                    'indexed_at': datetime.now()
-                }
-                
-                # Insert document into database
-                documents_collection.insert_one(document_data)
-                indexed_count += 1
-                
+                documents.append(build_document(
+                    message, entity.id, user_id, source_id,
+                    entity.title or source_name,
+                    text=captions.get(message.grouped_id),
+                    account=account.name
+                ))
             except Exception as e:
                 logger.error(f"Error processing message {message.id}: {e}")
                 continue
         
+        # Skip files already indexed for this user: the Bloom filter rules out most
+        # new files in memory, possible duplicates are checked with one query
+        try:
+            existing = await asyncio.to_thread(
+                file_hash_filter.existing_hashes, user_id, [document['file_hash'] for document in documents]
+            )
+        except Exception as e:
+            # The upserts below still skip known files
+            logger.error(f"Could not check for already indexed documents: {e}")
+            mongo_breaker.record_failure()
+            existing = set()
+        new_documents = []
+        for document in documents:
+            if document['file_hash'] in existing:
+                continue
+            existing.add(document['file_hash'])
+            new_documents.append(document)
+        
+        if len(documents) > len(new_documents):
+            logger.info(f"{len(documents) - len(new_documents)} documents already indexed for user {user_id}, skipping")
+        
+        # Live updates and gap recovery continue from the newest message seen here
+        mark = (entity.peer_id, max(message.id for message in messages)) if messages else None
+        
+        if new_documents:
+            # Upserted (so a stale filter can never create duplicates) through the live
+            # batches' breaker and spool: an outage neither blocks the loop nor loses the page,
+            # and the mark moves once the documents are written (after the replay if spooled)
+            inserted = await index_batcher.write_documents(new_documents, mark=mark)
+            if inserted is None:
+                logger.warning(f"Spooled {len(new_documents)} documents from {source_name} until MongoDB is back")
+                indexed_count = len(new_documents)
+            else:
+                indexed_count = inserted
+            for document in new_documents:
+                file_hash_filter.add(user_id, document['file_hash'])
+        elif mark is not None and mongo_breaker.allow():
+            # Nothing new to write: only the mark moves
+            try:
+                await asyncio.to_thread(sync_state.advance, [mark])
+                mongo_breaker.record_success()
+            except Exception as e:
+                # Gap recovery starts from the previous mark instead
+                logger.error(f"Could not store the sync mark of {source_name}: {e}")
+                mongo_breaker.record_failure()
+        
         return indexed_count
         
     except Exception as e:
+        # Raised to the job worker, so the job is marked failed rather than done with nothing indexed
         logger.error(f"Error in fetch_and_index_messages: {e}")
-        return indexed_count
+        raise
+    finally:
+        work_scheduler.release(ticket)
+
+def remember_source_chat(user_id, source_id, entity):
+    """Store the resolved chat id on a source and add it to the routing table."""
+    try:
+        sources_collection.update_one(
+            {'_id': ObjectId(str(source_id))},
+            {'$set': {'chat_id': entity.peer_id, 'chat_title': entity.title}}
+        )
+    except Exception as e:
+        logger.error(f"Could not store chat id for source {source_id}: {e}")
+    routing_table.add(entity.peer_id, user_id, source_id, entity.title)
+
+async def resolve_unrouted_sources(sources):
+    """Resolve sources saved before chat ids were stored, so their updates get routed."""
+    for source in sources:
+        source_name = source.get('source_name', '')
+        try:
+            entity = await entity_cache.resolve(user_client, source_name)
+            remember_source_chat(source['user_id'], source['_id'], entity)
+        except Exception as e:
+            logger.error(f"Could not resolve source {source_name} for routing: {e}")
+
+def index_album(messages):
+    """Index all items of an album with one routing lookup and a shared caption."""
+    peer_id = utils.get_peer_id(messages[0].peer_id)
+    routes = routing_table.lookup(peer_id)
+    if routes:
+        index_live_messages(peer_id, routes, messages)
+
+def index_live_messages(peer_id, routes, messages):
+    """Queue documents for live messages from one chat for every subscribed user."""
+    # Bare chat id (as stored in original_message) and title from the routing table
+    chat_id, _ = utils.resolve_id(peer_id)
+    chat_title = routing_table.title(peer_id, str(chat_id))
+    captions = album_captions(messages)
+    
+    logger.info(f"Processing {len(messages)} new message(s) from {chat_title}")
+    
+    # Process for each user monitoring this channel
+    for user_id, source_id in routes.items():
+        documents = [
+            build_document(message, chat_id, user_id, source_id, chat_title, text=captions.get(message.grouped_id))
+            for message in messages
+        ]
+        
+        # Queue for the next bulk upsert (already indexed files are left untouched)
+        index_batcher.add_many(documents, messages[0].date, marks=[(peer_id, message.id) for message in messages])
+        for document in documents:
+            file_hash_filter.add(user_id, document['file_hash'])
+        
+        for document in documents:
+            logger.info(f"Queued new file: {document['file_name']} (type: {document['file_type']}) for user {user_id}")
+
+async def recover_missed_messages(unrouted):
+    """Startup task: finish the routing table, then index messages missed during downtime."""
+    if unrouted:
+        await resolve_unrouted_sources(unrouted)
+    
+    if os.getenv('GAP_RECOVERY', '1') == '0':
+        return
+    
+    started = time.time()
+    recovered = await recover_gaps(
+        user_client, entity_cache, routing_table, sync_state, index_live_messages,
+        limit=int(os.getenv('GAP_RECOVERY_LIMIT', 5000))
+    )
+    logger.info(f"Gap recovery finished: {recovered} messages in {time.time() - started:.1f}s")
 
 async def process_new_message(event):
     """Process new messages in channels/groups the bot is monitoring."""
-    if not mongo_available:
-        return
-        
     try:
         # Get the message
         message = event.message
@@ -1397,121 +1709,92 @@ async def process_new_message(event):
         # Check if message has no media, skip it
         if not message.media:
             return
-            
-        # Get the chat where the message was sent
-        chat = await event.get_chat()
-        
-        # Get chat info (username or ID)
-        chat_username = chat.username if hasattr(chat, 'username') else str(chat.id)
-        chat_title = getattr(chat, 'title', chat_username)
         
-        logger.info(f"Processing new message from {chat_username} ({chat_title})")
-        
-        # Find sources that match this chat
-        sources = list(sources_collection.find({'source_name': chat_username}))
+        # Find the users monitoring this chat (in memory, no network or DB call)
+        routes = routing_table.lookup(event.chat_id)
+        if not routes:
+            return
         
-        if not sources:
-            # This chat isn't being monitored by any user
-            logger.info(f"No users monitoring {chat_username}, skipping")
+        # Album items are coalesced and indexed together once the group is complete
+        if message.grouped_id:
+            album_buffer.add(message.grouped_id, message)
             return
+        
+        # Only queued here; the batcher's flush takes the LIVE slot for the write
+        index_live_messages(event.chat_id, routes, [message])
             
-        # Determine file details
-        file_name = "Unnamed file"
-        file_type = "unknown"
-        file_size = 0
-        mime_type = ""
-        text_content = message.text or message.caption or ""
-        
-        # Check message media type and extract details
-        if hasattr(message.media, 'document'):
-            # Document (file)
-            doc = message.media.document
-            file_size = doc.size
-            mime_type = doc.mime_type or ""
-            
-            # Get file type from mime type
-            if mime_type:
-                file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
-                
-            # Get filename from attributes
-            for attr in doc.attributes:
-                if hasattr(attr, 'file_name') and attr.file_name:
-                    file_name = attr.file_name
-                    if '.' in file_name and not file_type:
-                        file_type = file_name.split('.')[-1]
-                    break
-                    
-        elif hasattr(message.media, 'photo'):
-            # Photo
-            file_type = "photo"
-            mime_type = "image/jpeg"
-            file_name = f"photo_{message.id}.jpg"
-            # Determine file size from photo sizes
-            try:
-                file_size = max(getattr(s, 'size', 0) for s in message.media.photo.sizes)
-            except Exception:
-                file_size = 0
-            
-        elif hasattr(message.media, 'video'):
-            # Video
-            file_type = "video"
-            mime_type = "video/mp4"
-            file_name = f"video_{message.id}.mp4"
-            
-        elif hasattr(message.media, 'audio'):
-            # Audio
-            file_type = "audio"
-            mime_type = "audio/mp3"
-            file_name = f"audio_{message.id}.mp3"
-            
-        # Generate a file hash for deduplication
-        file_hash = hashlib.md5(f"{chat.id}_{message.id}_{file_name}".encode()).hexdigest()
+    except Exception as e:
+        logger.error(f"Error processing new message: {str(e)}", exc_info=True)
+
+async def process_edited_message(event):
+    """Apply caption edits in monitored chats to the indexed documents."""
+    try:
+        message = event.message
+        if not message.media or not routing_table.lookup(event.chat_id):
+            return
         
-        # Will stream on-demand via website; no local storage in indexer
+        chat_id, _ = utils.resolve_id(event.chat_id)
         
-        # Store original message details for later retrieval
-        original_message = {
-            'chat_id': chat.id,
-            'message_id': message.id
-        }
+        # Album items share the caption, so an edit updates the whole group
+        if message.grouped_id:
+            target = {'original_message.chat_id': chat_id, 'grouped_id': message.grouped_id}
+        else:
+            target = {'original_message.chat_id': chat_id, 'original_message.message_id': message.id}
         
-        # Process for each user monitoring this channel
-        for source in sources:
-            user_id = source['user_id']
-            
-            # Skip if this file is already indexed for this user
-            existing_doc = documents_collection.find_one({
-                'user_id': user_id,
-                'file_hash': file_hash
-            })
-            
-            if existing_doc:
-                logger.info(f"Document already exists for user {user_id}, skipping")
-                continue
-                
-            # Add document to database
-            document_data = {
-                'user_id': user_id,
-                'source_id': str(source.get('_id', 'unknown')),
-                'source_name': chat_title,
-                'file_name': file_name,
-                'file_type': file_type,
-                'file_size': file_size,
-                'mime_type': mime_type,
-                'file_hash': file_hash,
-                'text': text_content,
-                'date': message.date,
-                'original_message': original_message,
-                'indexed_at': datetime.now()
-            }
-            
-            # Insert document into database
-            result = documents_collection.insert_one(document_data)
-            
-            logger.info(f"Indexed new file: {file_name} (type: {file_type}) for user {user_id}")
-            
+        index_batcher.add_update(target, {'$set': {'text': message.text or "", 'edited_at': datetime.now()}})
+        invalidate_cached_results(chat_id, [message.id], grouped_id=message.grouped_id)
+        
+        logger.info(f"Queued caption update for message {message.id} in chat {chat_id}")
     except Exception as e:
-        logger.error(f"Error processing new message: {str(e)}", exc_info=True)
+        logger.error(f"Error processing edited message: {str(e)}", exc_info=True)
+
+async def process_deleted_messages(event):
+    """Tombstone indexed documents whose messages were deleted."""
+    try:
+        tombstone = {'$set': {'deleted': True, 'deleted_at': datetime.now()}}
+        
+        if event.chat_id is not None:
+            # Channels and supergroups report which chat the messages were deleted from
+            if not routing_table.lookup(event.chat_id):
+                return
+            chat_id, _ = utils.resolve_id(event.chat_id)
+            index_batcher.add_update(
+                {'original_message.chat_id': chat_id, 'original_message.message_id': {'$in': event.deleted_ids}},
+                tombstone
+            )
+            invalidate_cached_results(chat_id, event.deleted_ids)
+        else:
+            # Basic groups only send message ids, which are unique per account across those groups
+            group_ids = routing_table.basic_group_ids()
+            if not group_ids:
+                return
+            index_batcher.add_update(
+                {'original_message.chat_id': {'$in': group_ids}, 'original_message.message_id': {'$in': event.deleted_ids}},
+                tombstone
+            )
+            for chat_id in group_ids:
+                invalidate_cached_results(chat_id, event.deleted_ids)
+        
+        logger.info(f"Queued tombstones for {len(event.deleted_ids)} deleted message(s)")
+    except Exception as e:
+        logger.error(f"Error processing deleted messages: {str(e)}", exc_info=True)
+
+def invalidate_cached_results(chat_id, message_ids, grouped_id=None):
+    """Drop cached search results that contain any of the affected messages."""
+    if bot_application is None:
+        return
+    
+    message_ids = set(message_ids)
+    for user_data in bot_application.user_data.values():
+        for doc in user_data.get("search_results") or []:
+            original = doc.get('original_message', {})
+            if original.get('chat_id') != chat_id:
+                continue
+            if original.get('message_id') in message_ids or (grouped_id and doc.get('grouped_id') == grouped_id):
+                user_data.pop("search_results", None)
+                user_data.pop("search_query", None)
+                metrics.incr("indexing.invalidated_result_caches")
+                break
 
 async def reindex_source(update: Update, context: ContextTypes.DEFAULT_TYPE, source_id: str) -> None:
     """Reindex messages from an existing source."""
@@ -1547,22 +1830,20 @@ async def reindex_source(update: Update, context: ContextTypes.DEFAULT_TYPE, sou
             
         source_name = source.get('source_name', 'Unknown source')
         
-        # Update the message to show progress
-        await query.answer()
-        status_message = await query.edit_message_text(
-            f"Starting to reindex messages from {source_name}... This may take a while.\n\n"
-            f"{source_name} से संदेशों को फिर से इंडेक्स करना शुरू कर रहा है... इसमें कुछ समय लग सकता है।"
+        # Queue the reindex (using a larger limit for reindexing)
+        job_id = job_queue.enqueue(
+            'index_source', user_id,
+            {'source_id': str(source_id_obj), 'source_name': source_name, 'limit': 500},
+            description=f"Reindex {source_name}",
+            priority=BACKFILL
         )
         
-        # Fetch and index messages (using a larger limit for reindexing)
-        indexed_count = await fetch_and_index_messages(user_id, source_name, source_id_obj, limit=500)
-        
-        # Update the message with results
-        await status_message.edit_text(
-            f"Successfully reindexed {source_name}!\n"
-            f"Indexed {indexed_count} messages from this source.\n\n"
-            f"{source_name} को सफलतापूर्वक फिर से इंडेक्स किया गया!\n"
-            f"इस स्रोत से {indexed_count} संदेशों को इंडेक्स किया गया।"
+        await query.answer()
+        await query.edit_message_text(
+            f"Reindexing of {source_name} has been queued (job {job_id}).\n"
+            f"You will get a message when it is done. Use /jobs to check progress.\n\n"
+            f"{source_name} को फिर से इंडेक्स करने का काम कतार में है (जॉब {job_id})।\n"
+            f"पूरा होने पर आपको संदेश मिलेगा। प्रगति देखने के लिए /jobs का उपयोग करें।"
         )
         
     except Exception as e:
@@ -1673,52 +1954,234 @@ async def reindex_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         return
 
-    # Acknowledge the callback and show starting message
+    # Acknowledge the callback
     await query.answer()
-    status_message = await query.edit_message_text(
-        "Starting to reindex all sources... This may take a while.\n\n"
-        "सभी स्रोतों को फिर से इंडेक्स करना शुरू हो रहा है... इसमें कुछ समय लग सकता है।"
-    )
 
     # Retrieve all sources for the user
     raw_sources = list(sources_collection.find({"user_id": user_id}))
     if not raw_sources:
-        await status_message.edit_text(
+        await query.edit_message_text(
             "You have no sources to reindex.\n\n"
             "आपके पास कोई स्रोत नहीं है जिन्हें इंडेक्स किया जा सके।"
         )
         return
 
-    total_indexed = 0
+    # Queue one job per source so sources are indexed independently
     for src in raw_sources:
-        source_id_obj = src["_id"]
         source_name = src.get("source_name", "Unknown source")
+        job_queue.enqueue(
+            'index_source', user_id,
+            {'source_id': str(src["_id"]), 'source_name': source_name, 'limit': 500},
+            description=f"Reindex {source_name}",
+            priority=BACKFILL
+        )
+
+    await query.edit_message_text(
+        f"Reindexing of {len(raw_sources)} sources has been queued.\n"
+        f"You will get a message as each one finishes. Use /jobs to check progress.\n\n"
+        f"{len(raw_sources)} स्रोतों को फिर से इंडेक्स करने का काम कतार में है।\n"
+        f"हर एक के पूरा होने पर आपको संदेश मिलेगा। प्रगति देखने के लिए /jobs का उपयोग करें।"
+    )
+
+async def run_index_job(job):
+    """Job handler that indexes a source in the background."""
+    payload = job['payload']
+    indexed_count = await fetch_and_index_messages(
+        job['user_id'],
+        payload['source_name'],
+        payload['source_id'],
+        limit=payload.get('limit', 300),
+        priority=job.get('priority', BACKFILL)
+    )
+    
+    # Persist the filter so the next start only has to catch up on newer documents
+    await asyncio.to_thread(file_hash_filter.save)
+    return {'indexed_count': indexed_count}
+
+async def notify_job_finished(bot, job):
+    """Tell the user that one of their background jobs has finished."""
+    description = job.get('description', job['kind'])
+    
+    if job['status'] == JOB_DONE:
+        indexed_count = (job.get('result') or {}).get('indexed_count', 0)
+        text = (
+            f"✅ {description} finished. Indexed {indexed_count} messages.\n\n"
+            f"✅ {description} पूरा हुआ। {indexed_count} संदेशों को इंडेक्स किया गया।"
+        )
+    else:
+        text = (
+            f"❌ {description} failed: {job.get('error', 'unknown error')}\n\n"
+            f"❌ {description} विफल रहा: {job.get('error', 'unknown error')}"
+        )
+    
+    try:
+        await bot.send_message(chat_id=job['user_id'], text=text)
+    except Exception as e:
+        logger.error(f"Could not notify user {job['user_id']} about job {job['_id']}: {e}")
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the status of the user's recent background jobs."""
+    user_id = update.effective_user.id
+    
+    if not mongo_available:
+        await update.message.reply_text(
+            "MongoDB is not available. Please try again later.\n\n"
+            "MongoDB उपलब्ध नहीं है। कृपया बाद में पुनः प्रयास करें।"
+        )
+        return
+    
+    user_jobs = job_queue.list_jobs(user_id)
+    if not user_jobs:
+        await update.message.reply_text(
+            "You have no background jobs.\n\n"
+            "आपका कोई बैकग्राउंड जॉब नहीं है।"
+        )
+        return
+    
+    status_icons = {JOB_QUEUED: "⏳", JOB_RUNNING: "🔄", JOB_DONE: "✅", JOB_FAILED: "❌"}
+    
+    jobs_text = "Your recent jobs:\n\n"
+    for job in user_jobs:
+        icon = status_icons.get(job['status'], "❔")
+        created = job['created_at'].strftime("%Y-%m-%d %H:%M")
+        jobs_text += f"{icon} {job.get('description', job['kind'])} - {job['status']} ({created})\n"
+        
+        if job['status'] == JOB_DONE:
+            indexed_count = (job.get('result') or {}).get('indexed_count', 0)
+            jobs_text += f"   Indexed {indexed_count} messages\n"
+        elif job['status'] == JOB_FAILED:
+            jobs_text += f"   Error: {job.get('error', 'unknown error')}\n"
+    
+    await update.message.reply_text(jobs_text)
+
+def load_routing():
+    """Fill the routing table and sync marks from MongoDB and follow source changes."""
+    global unrouted_sources
+    unrouted_sources = routing_table.load(sources_collection.find({}), entity_cache)
+    sync_state.load()
+    threading.Thread(target=routing_table.watch, args=(sources_collection,), daemon=True).start()
+
+def log_filter_load(future):
+    """Done callback of the background file hash filter load."""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Could not load the file hash filter: {future.exception()}")
+
+async def start_database_services():
+    """Create indexes, start the job queue and recover missed messages (once per process)."""
+    global database_services_started
+    if database_services_started:
+        return
+    database_services_started = True
+    
+    index_batcher.ensure_indexes()
+    file_id_cache.ensure_indexes()
+    documents_collection.create_index([
+        ("original_message.chat_id", pymongo.ASCENDING),
+        ("original_message.message_id", pymongo.ASCENDING)
+    ])
+    
+    # Loaded off the event loop; until it's ready (or if it fails) every file is checked in MongoDB
+    asyncio.ensure_future(asyncio.to_thread(file_hash_filter.load)).add_done_callback(log_filter_load)
+    
+    await job_queue.start()
+    
+    # Resolve unrouted sources, then fetch whatever was posted while the bot was down
+    if user_client.is_connected():
+        asyncio.ensure_future(recover_missed_messages(unrouted_sources))
+
+async def monitor_database():
+    """Background task: probe MongoDB while it is down and replay spooled writes when it's back."""
+    global mongo_available
+    loop = asyncio.get_event_loop()
+    interval = float(os.getenv('MONGO_HEALTH_INTERVAL', 5))
+    
+    while True:
+        await asyncio.sleep(interval)
+        
+        # Nothing to do while healthy, and no probes while the breaker is open
+        if mongo_available and not len(write_spool):
+            continue
+        if not mongo_breaker.allow():
+            continue
+        
         try:
-            count = await fetch_and_index_messages(user_id, source_name, source_id_obj, limit=500)
-            total_indexed += count
+            await loop.run_in_executor(None, client.admin.command, 'ping')
+            replayed = await index_batcher.replay_spool()
         except Exception as e:
-            logger.error(f"Error reindexing {source_name}: {e}")
+            logger.warning(f"MongoDB still unavailable: {e}")
+            mongo_breaker.record_failure()
+            continue
+        
+        mongo_breaker.record_success()
+        if not mongo_available:
+            logger.info("MongoDB is available again")
+        mongo_available = True
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled index writes")
+        
+        if not database_services_started:
+            try:
+                # MongoDB was down at startup, so live routing was never loaded
+                if live_updates_enabled:
+                    await loop.run_in_executor(None, load_routing)
+                await start_database_services()
+            except Exception as e:
+                logger.error(f"Error starting database services: {e}")
 
-    await status_message.edit_text(
-        f"Reindexed {len(raw_sources)} sources.\n"
-        f"Total messages indexed: {total_indexed}.\n\n"
-        f"{len(raw_sources)} स्रोतों को फिर से इंडेक्स किया गया।\n"
-        f"कुल {total_indexed} संदेशों को इंडेक्स किया गया।"
-    )
+async def post_init(application: Application) -> None:
+    """Start background workers once the bot's event loop is running."""
+    async def notify(job):
+        await notify_job_finished(application.bot, job)
+    
+    global bot_application
+    bot_application = application
+    
+    job_queue.register('index_source', run_index_job)
+    job_queue.on_complete(notify)
+    
+    # Connects the extra sessions and keeps every account reconnecting on its own
+    await client_pool.start()
+    
+    if mongo_available:
+        await start_database_services()
+    
+    # Replays the write spool and finishes startup if MongoDB was down
+    asyncio.ensure_future(monitor_database())
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show runtime metrics (rate limiter delays, indexing counters)."""
+    report = metrics.format_report()
+    
+    # Telegram messages are limited to 4096 characters
+    if len(report) > 4000:
+        report = report[:4000] + "\n..."
+    
+    await update.message.reply_text(f"Bot statistics:\n\n{report}")
+
+async def post_shutdown(application: Application) -> None:
+    """Write out buffered documents before the process exits."""
+    # Whatever can't reach MongoDB ends up in the spool for the next run
+    album_buffer.release_all()
+    await index_batcher.stop()
+    try:
+        file_hash_filter.save()
+    except Exception as e:
+        logger.error(f"Could not save Bloom filter: {e}")
+    await downloader.close()
 
 def main() -> None:
     """Start the bot."""
-    global user_client
+    global user_client, live_updates_enabled
     
     # Create directories if they don't exist
     os.makedirs("downloads", exist_ok=True)
     os.makedirs("sessions", exist_ok=True)
     
-    # Cleanup old downloads on startup
+    # Index the media cache and trim it to budget on startup
     asyncio.get_event_loop().run_until_complete(cleanup_downloads())
     
     # Create the Application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -1728,6 +2191,8 @@ def main() -> None:
     application.add_handler(CommandHandler("recent", recent_command))
     application.add_handler(CommandHandler("sources", sources_command))
     application.add_handler(CommandHandler("auth", auth_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("jobs", jobs_command))
     
     # Add callback query handler
     application.add_handler(CallbackQueryHandler(button_click))
@@ -1749,6 +2214,7 @@ def main() -> None:
     
     if is_authorized:
         logger.info("User already authorized, using existing session")
+        client_pool.add(PRIMARY_ACCOUNT, user_client, rate_limiter, entity_cache, connected=True)
         # Also update the database to reflect the authorized status
         if mongo_available:
             users_collection.update_one(
@@ -1757,9 +2223,16 @@ def main() -> None:
                 upsert=True
             )
         
+        # Load the routing table before live updates start arriving
+        if mongo_available:
+            load_routing()
+        
         # Add event handler for new messages in channels/groups
         user_client.add_event_handler(process_new_message, events.NewMessage)
-        logger.info("Added event handler for new messages")
+        user_client.add_event_handler(process_edited_message, events.MessageEdited)
+        user_client.add_event_handler(process_deleted_messages, events.MessageDeleted)
+        live_updates_enabled = True
+        logger.info("Added event handlers for new, edited and deleted messages")
     else:
         logger.info("User not authorized, starting with bot token")
         user_client.start(bot_token=BOT_TOKEN)
@@ -0,0 +1,164 @@
+"""Pool of authorized Telegram accounts used to spread out history fetching.
+
+One account's flood limits cap how fast it can page through history or
+download files. The pool holds several authorized sessions, each with its own
+rate limiter buckets and entity cache (access hashes differ per account).
+Work on a chat goes to the least throttled connected account that can access
+it. Each account reconnects on its own with backoff, so one dropped
+connection doesn't stall the others.
+"""
+import time
+import asyncio
+import logging
+
+import metrics
+from entity_cache import INVALID_PEER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class PooledAccount:
+    """One session in the pool with its limiter, entity cache and load."""
+
+    def __init__(self, name, client, limiter, entity_cache):
+        self.name = name
+        self.client = client
+        self.limiter = limiter
+        self.entity_cache = entity_cache
+        self.connected = False
+        self.active = 0
+        # Chats this account couldn't access -> when that was noticed
+        self._no_access = {}
+
+    def can_access(self, key, ttl):
+        noticed = self._no_access.get(str(key))
+        return noticed is None or time.monotonic() - noticed > ttl
+
+    def load(self, method):
+        """Sort key: estimated throttle delay first, then leases in progress."""
+        return (self.limiter.estimate(method), self.active)
+
+
+class ClientPool:
+    """Hands out the least throttled account that can access a chat."""
+
+    def __init__(self, no_access_ttl=3600, reconnect_delay=5, max_reconnect_delay=300):
+        self.no_access_ttl = no_access_ttl
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.accounts = []
+        self._supervisors = []
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def add(self, name, client, limiter, entity_cache, connected=False):
+        account = PooledAccount(name, client, limiter, entity_cache)
+        account.connected = connected
+        self.accounts.append(account)
+        return account
+
+    async def start(self):
+        """Connect every account and keep each one connected in the background."""
+        for account in self.accounts:
+            if not account.connected:
+                await self._connect(account)
+            self._supervisors.append(asyncio.ensure_future(self._supervise(account)))
+        metrics.gauge("pool.connected_accounts", lambda: sum(1 for a in self.accounts if a.connected))
+        logger.info(f"Client pool started: {sum(1 for a in self.accounts if a.connected)}/{len(self)} accounts connected")
+
+    async def stop(self):
+        for task in self._supervisors:
+            task.cancel()
+        self._supervisors = []
+
+    async def _connect(self, account):
+        try:
+            await account.client.connect()
+            if not await account.client.is_user_authorized():
+                logger.warning(f"Session {account.name} is not authorized, leaving it out of the pool")
+                account.connected = False
+                return False
+        except Exception as e:
+            logger.error(f"Could not connect session {account.name}: {e}")
+            account.connected = False
+            return False
+        account.connected = True
+        return True
+
+    async def _supervise(self, account):
+        """Wait for the account to disconnect, then reconnect it with exponential backoff."""
+        delay = self.reconnect_delay
+        while True:
+            if account.connected:
+                try:
+                    await account.client.disconnected
+                except Exception as e:
+                    logger.warning(f"Session {account.name} disconnected: {e}")
+                account.connected = False
+                metrics.incr(f"pool.{account.name}.disconnects")
+                delay = self.reconnect_delay
+
+            await asyncio.sleep(delay)
+            if await self._connect(account):
+                metrics.incr(f"pool.{account.name}.reconnects")
+                logger.info(f"Session {account.name} reconnected")
+            else:
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def candidates(self, key, method):
+        """Connected accounts that may access key, least throttled first."""
+        accounts = [
+            account for account in self.accounts
+            if account.connected and account.can_access(key, self.no_access_ttl)
+        ]
+        return sorted(accounts, key=lambda account: account.load(method))
+
+    async def acquire(self, key, method):
+        """Lease the best account for a chat and resolve the chat through it.
+
+        Args:
+            key: Username, link or id of the chat
+            method: Rate limited method the work will mostly use ('iter_messages', 'download')
+
+        Returns:
+            (account, entity) - call release(account) when done
+
+        Raises:
+            ValueError: If no connected account can access the chat
+        """
+        last_error = None
+        # Reads every account's buckets from SQLite
+        for account in await asyncio.to_thread(self.candidates, key, method):
+            try:
+                entity = await account.entity_cache.resolve(account.client, key)
+            except INVALID_PEER_ERRORS as e:
+                # Not a member (or banned): skip this account for a while
+                account._no_access[str(key)] = time.monotonic()
+                last_error = e
+                continue
+            except Exception as e:
+                logger.warning(f"Session {account.name} could not resolve {key}: {e}")
+                last_error = e
+                continue
+
+            account.active += 1
+            metrics.incr(f"pool.{account.name}.leases")
+            return account, entity
+
+        raise ValueError(f"No connected account can access {key}: {last_error}")
+
+    def acquire_account(self, name):
+        """Lease a specific account (e.g. the one a stored file location belongs to).
+
+        Returns None if that account isn't connected.
+        """
+        for account in self.accounts:
+            if account.name == name and account.connected:
+                account.active += 1
+                metrics.incr(f"pool.{account.name}.leases")
+                return account
+        return None
+
+    def release(self, account):
+        account.active = max(0, account.active - 1)
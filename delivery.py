@@ -0,0 +1,171 @@
+"""Delivering indexed files to users without moving their bytes through the bot.
+
+Sending a file used to mean downloading it with the user client and uploading
+it again with the bot: every byte crossed the wire twice and anything above
+the Bot API upload limit couldn't be sent at all. Delivery now tries, in
+order:
+
+1. copy_message of the original post, when the bot can read the source chat
+   and the chat allows copying (no protected content),
+2. a Bot API file_id from an earlier upload of the same file (see
+   file_id_cache.py),
+3. the old download + upload, whose returned file_id is kept for next time.
+
+Both by-reference steps complete in one Bot API call regardless of file size.
+"""
+import time
+import logging
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Message attribute holding the file for each kind of upload, in sending order
+FILE_KINDS = ('photo', 'video', 'audio', 'document')
+
+# Bot API errors (lowercased) meaning nothing can be copied from the chat at all
+CHAT_COPY_ERRORS = ('chat not found', 'not a member', 'not enough rights', 'have no rights',
+                    'protected', "can't be forwarded")
+
+
+def refuses_copies(error):
+    """Whether a copy_message error applies to the whole source chat, not just the message."""
+    if isinstance(error, (Forbidden, ChatMigrated)):
+        return True
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in CHAT_COPY_ERRORS)
+
+
+def file_kind(mime_type):
+    """Which send_* method is used for a MIME type."""
+    mime_type = mime_type or ''
+    for prefix, kind in (('image/', 'photo'), ('video/', 'video'), ('audio/', 'audio')):
+        if mime_type.startswith(prefix):
+            return kind
+    return 'document'
+
+
+def sent_file_id(message):
+    """Return (file_id, kind) of the file in a sent Bot API message, or (None, None)."""
+    if message is None:
+        return None, None
+    for kind in FILE_KINDS:
+        attachment = getattr(message, kind, None)
+        if not attachment:
+            continue
+        if kind == 'photo':
+            # Photos come as a list of sizes, largest last
+            attachment = attachment[-1]
+        return attachment.file_id, kind
+    return None, None
+
+
+async def send_file(bot, chat_id, file, kind, file_name=None, caption=None):
+    """Send a file object or a file_id with the send_* method for kind."""
+    if kind == 'photo':
+        return await bot.send_photo(chat_id=chat_id, photo=file, caption=caption)
+    if kind == 'video':
+        return await bot.send_video(chat_id=chat_id, video=file, caption=caption)
+    if kind == 'audio':
+        return await bot.send_audio(chat_id=chat_id, audio=file, caption=caption)
+    return await bot.send_document(chat_id=chat_id, document=file, filename=file_name, caption=caption)
+
+
+class ReferenceDelivery:
+    """Tries the by-reference delivery methods and remembers chats that refuse copies."""
+
+    def __init__(self, file_ids=None, no_copy_ttl=3600):
+        """
+        Args:
+            file_ids: FileIdCache to look file_ids up in; without one only the
+                document's own file_id is used
+            no_copy_ttl: Seconds a chat (or a single post) that refused a copy
+                is skipped
+        """
+        self.file_ids = file_ids
+        self.no_copy_ttl = no_copy_ttl
+        # Bot API chat id, or (chat id, message id) -> when copying from it failed
+        self._no_copy = {}
+
+    def _refused(self, key):
+        failed = self._no_copy.get(key)
+        return failed is not None and time.monotonic() - failed <= self.no_copy_ttl
+
+    def can_copy(self, from_chat_id, message_id=None):
+        return not self._refused(from_chat_id) and not self._refused((from_chat_id, message_id))
+
+    def _remember_refusal(self, key):
+        now = time.monotonic()
+        if len(self._no_copy) >= 1024:
+            # Deleted posts accumulate; forget the expired ones
+            self._no_copy = {k: failed for k, failed in self._no_copy.items() if now - failed <= self.no_copy_ttl}
+        self._no_copy[key] = now
+
+    async def copy(self, bot, chat_id, from_chat_id, message_id):
+        """Copy the original post to chat_id. Returns False if it can't be copied right now."""
+        if from_chat_id is None or not message_id or not self.can_copy(from_chat_id, message_id):
+            return False
+        try:
+            await bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+        except TelegramError as e:
+            logger.info(f"Could not copy message {message_id} from {from_chat_id}: {e}")
+            metrics.incr("delivery.copy_failed")
+            if refuses_copies(e):
+                # Bot isn't a member or content is protected: skip the chat for a while
+                self._remember_refusal(from_chat_id)
+            elif isinstance(e, BadRequest):
+                # E.g. the post was deleted: only this message falls back from now on
+                self._remember_refusal((from_chat_id, message_id))
+            # Flood waits, timeouts and network errors only affect this delivery
+            return False
+        return True
+
+    async def send_cached(self, bot, chat_id, document, caption=None):
+        """Resend a document's file by its Bot API file_id. Returns the sent message or None."""
+        if self.file_ids is not None:
+            file_id, kind = self.file_ids.get(document)
+        else:
+            file_id, kind = document.get('file_id'), document.get('file_id_kind')
+        if not file_id:
+            return None
+
+        try:
+            return await send_file(bot, chat_id, file_id, kind or 'document', caption=caption)
+        except BadRequest as e:
+            # Telegram rejected the id itself, don't offer it again
+            logger.info(f"Cached file_id was rejected: {e}")
+            if self.file_ids is not None:
+                self.file_ids.invalidate(document, file_id)
+        except TelegramError as e:
+            logger.info(f"Cached file_id could not be sent: {e}")
+        metrics.incr("delivery.file_id_failed")
+        return None
+
+    async def deliver(self, bot, chat_id, document, from_chat_id, caption=None):
+        """Send an indexed document by reference.
+
+        Args:
+            bot: The Bot API bot
+            chat_id: User to send the file to
+            document: The indexed document
+            from_chat_id: Bot API id of the source chat, None if unknown
+            caption: Caption used when sending by file_id
+
+        Returns:
+            'copy' or 'file_id' for the method that worked, None if the file
+            has to be downloaded and uploaded
+        """
+        started = time.monotonic()
+        original = document.get('original_message') or {}
+
+        if await self.copy(bot, chat_id, from_chat_id, original.get('message_id')):
+            method = 'copy'
+        elif await self.send_cached(bot, chat_id, document, caption):
+            method = 'file_id'
+        else:
+            return None
+
+        metrics.incr(f"delivery.{method}")
+        metrics.observe(f"delivery.{method}.latency", time.monotonic() - started)
+        return method
@@ -0,0 +1,210 @@
+"""Single-flight downloads of Telegram files to disk.
+
+A popular file is often requested by several users (and website visitors) at
+the same time, and each request used to start its own full download, writing
+to the same path the others were already reading from. Downloads now go
+through a manager keyed by the file's identity: the first request downloads,
+concurrent requests in the same process await the same future, and a
+process finding another one downloading to the same path (e.g. a second
+website worker) waits for the file to be published. Files are written to `<path>.part`, created exclusively so only
+one process downloads, and renamed into place once complete, so a file that
+exists at its final path is always whole. A failed or abandoned download
+leaves its bytes in `<path>.resume`, which the next download of the file
+picks up and continues.
+
+A speculative fetch (a prefetch nobody asked for yet) is cancelled when its
+last waiter gives up, unless a real request has joined it meanwhile.
+"""
+import os
+import time
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+RESUME_SUFFIX = '.resume'
+
+
+def part_path(path):
+    return path + PART_SUFFIX
+
+
+def resume_path(path):
+    return path + RESUME_SUFFIX
+
+
+def safe_name(key):
+    """File name fragment for a file identity such as 'document:123'."""
+    return "".join(c if c.isalnum() or c in '-_.' else '_' for c in str(key))
+
+
+class DownloadManager:
+    """Coalesces concurrent downloads of the same file and publishes them atomically."""
+
+    def __init__(self, cache=None, stale_after=120.0, poll_interval=0.5):
+        """
+        Args:
+            cache: MediaCache told about published files, hits and files in use
+            stale_after: Seconds without writes after which another process'
+                .part file is considered abandoned and taken over
+            poll_interval: Seconds between checks while another process downloads
+        """
+        self.cache = cache
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._flights = {}
+        # Key -> number of callers awaiting the flight
+        self._waiters = {}
+        # Keys of flights only speculative fetches are waiting for
+        self._speculative = set()
+        # Path -> number of callers still using the published file
+        self._holders = {}
+
+    def in_flight(self):
+        return len(self._flights)
+
+    async def fetch(self, key, path, download, speculative=False):
+        """Return path once the complete file is there, downloading it at most once.
+
+        Args:
+            key: Identity of the file (requests with the same key share one download)
+            path: Final path of the file
+            download: Coroutine function called with the .part path to write to
+            speculative: Nobody asked for the file yet; the download is cancelled
+                if every waiter gives up before a real request joins
+
+        Call release(path) when done with the file.
+        """
+        # Pinned before the download so the file can't be evicted before it's used
+        if self.cache is not None:
+            self.cache.pin(path)
+        try:
+            if os.path.exists(path):
+                metrics.incr("downloads.disk_hits")
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.lookup, path)
+            else:
+                flight = self._flights.get(key)
+                if flight is not None:
+                    metrics.incr("downloads.coalesced")
+                else:
+                    flight = asyncio.ensure_future(self._download(path, download))
+                    self._flights[key] = flight
+                    flight.add_done_callback(lambda _: self._landed(key))
+                    if speculative:
+                        self._speculative.add(key)
+                if not speculative:
+                    self._speculative.discard(key)
+                await self._await_flight(key, flight)
+        except BaseException:
+            if self.cache is not None:
+                self.cache.unpin(path)
+            raise
+
+        self._holders[path] = self._holders.get(path, 0) + 1
+        return path
+
+    async def _await_flight(self, key, flight):
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # One waiter giving up (e.g. a closed request) doesn't cancel the download for the others
+            await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.done() and self._waiters[key] == 1 and key in self._speculative:
+                metrics.incr("downloads.speculative_cancelled")
+                flight.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _landed(self, key):
+        self._flights.pop(key, None)
+        self._speculative.discard(key)
+
+    def release(self, path, delete=False):
+        """Stop using a fetched file; with delete, remove it once nobody else holds it."""
+        if self.cache is not None:
+            self.cache.unpin(path)
+        holders = self._holders.get(path, 0) - 1
+        if holders > 0:
+            self._holders[path] = holders
+            return
+        self._holders.pop(path, None)
+        if delete:
+            if self.cache is not None:
+                self.cache.remove(path)
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _claim(self, part):
+        """Create the .part file exclusively; False if another process owns it."""
+        try:
+            os.close(os.open(part, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def _abandoned(self, part):
+        try:
+            return time.time() - os.path.getmtime(part) > self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def _keep_partial(self, path):
+        """Move a .part file aside for a later resume (or drop it if it's empty)."""
+        part = part_path(path)
+        try:
+            if os.path.getsize(part):
+                os.replace(part, resume_path(path))
+            else:
+                os.remove(part)
+        except FileNotFoundError:
+            pass
+
+    async def _download(self, path, download):
+        part = part_path(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # Another process may already be downloading the same file
+        while not self._claim(part):
+            if os.path.exists(path):
+                metrics.incr("downloads.coalesced_across_processes")
+                if self.cache is not None:
+                    await asyncio.to_thread(self.cache.lookup, path)
+                return path
+            if self._abandoned(part):
+                logger.warning(f"Taking over abandoned partial download {part}")
+                self._keep_partial(path)
+                continue
+            await asyncio.sleep(self.poll_interval)
+
+        if os.path.exists(path):
+            # Published between the last check and the claim
+            os.remove(part)
+            return path
+
+        # Continue from what an earlier attempt left behind
+        if os.path.exists(resume_path(path)):
+            os.replace(resume_path(path), part)
+
+        started = time.monotonic()
+        try:
+            await download(part)
+            os.replace(part, path)
+            if self.cache is not None:
+                # May evict other files
+                await asyncio.to_thread(self.cache.add, path)
+        except BaseException:
+            self._keep_partial(path)
+            raise
+
+        metrics.observe("downloads.time", time.monotonic() - started)
+        return path
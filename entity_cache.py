@@ -0,0 +1,258 @@
+"""Two-tier cache for resolved Telegram entities.
+
+Resolving a username or id with get_entity can cost a network round trip and
+counts toward the ResolveUsername flood limits. Resolved entities are kept in
+an in-memory LRU and in a SQLite table (id, access_hash, username) shared by
+the bot and the website. Cached entries are turned back into InputPeer
+objects locally, and are only refreshed when Telegram rejects the stored peer.
+Async callers read and write the SQLite table from worker threads.
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from telethon import utils
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
+from telethon.tl.types import (
+    Channel, Chat, User,
+    InputPeerChannel, InputPeerChat, InputPeerUser
+)
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_DB = os.getenv(
+    'ENTITY_CACHE_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'entity_cache.db')
+)
+
+# Errors meaning the stored peer (usually its access_hash) is no longer valid
+INVALID_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError, ValueError)
+
+
+def normalize_key(key):
+    """Normalize a username, link or id so equivalent inputs share one cache entry."""
+    if isinstance(key, int):
+        return str(key)
+
+    key = str(key).strip()
+    for prefix in ('https://t.me/', 'http://t.me/', 't.me/'):
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+    key = key.lstrip('@')
+
+    if key.lstrip('-').isdigit():
+        return str(int(key))
+    return key.lower()
+
+
+class CachedEntity:
+    """The parts of an entity needed to address it without another lookup."""
+
+    def __init__(self, entity_id, access_hash, peer_type, username=None, title=None):
+        self.id = entity_id
+        self.access_hash = access_hash
+        self.peer_type = peer_type
+        self.username = username
+        self.title = title
+
+    @classmethod
+    def from_entity(cls, entity):
+        if isinstance(entity, Channel):
+            peer_type = 'channel'
+        elif isinstance(entity, Chat):
+            peer_type = 'chat'
+        elif isinstance(entity, User):
+            peer_type = 'user'
+        else:
+            raise TypeError(f"Cannot cache entity of type {type(entity).__name__}")
+
+        title = getattr(entity, 'title', None)
+        if title is None and peer_type == 'user':
+            title = " ".join(filter(None, [entity.first_name, entity.last_name])) or None
+
+        return cls(
+            entity.id,
+            getattr(entity, 'access_hash', None),
+            peer_type,
+            getattr(entity, 'username', None),
+            title
+        )
+
+    @property
+    def input_peer(self):
+        if self.peer_type == 'channel':
+            return InputPeerChannel(self.id, self.access_hash or 0)
+        if self.peer_type == 'chat':
+            return InputPeerChat(self.id)
+        return InputPeerUser(self.id, self.access_hash or 0)
+
+    @property
+    def peer_id(self):
+        """Marked id (e.g. -100... for channels), as used in update events."""
+        return utils.get_peer_id(self.input_peer)
+
+    def keys(self):
+        keys = {str(self.id), str(self.peer_id)}
+        if self.username:
+            keys.add(self.username.lower())
+        return keys
+
+
+class EntityCache:
+    """In-memory LRU in front of a persistent SQLite table of resolved entities.
+
+    Access hashes are only valid for the account that resolved them, so
+    entries are scoped by an account label (the session phone number).
+    """
+
+    def __init__(self, account, path=ENTITY_CACHE_DB, max_size=1024):
+        self.account = account
+        self.path = path
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        # The LRU is also updated from worker threads (see get_async)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            " account TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " entity_id INTEGER NOT NULL,"
+            " access_hash INTEGER,"
+            " peer_type TEXT NOT NULL,"
+            " username TEXT,"
+            " title TEXT,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (account, key))"
+        )
+
+    def _remember(self, key, cached):
+        with self._lock:
+            self._memory[key] = cached
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key):
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+        if cached is not None:
+            metrics.incr("entity_cache.memory_hits")
+        return cached
+
+    def get(self, key):
+        """Return the cached entity for key, or None if it isn't cached."""
+        key = normalize_key(key)
+        cached = self._from_memory(key)
+        if cached is not None:
+            return cached
+        return self._from_disk(key)
+
+    async def get_async(self, key):
+        """Like get, reading SQLite from a worker thread when the entry isn't in memory."""
+        key = normalize_key(key)
+        cached = self._from_memory(key)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self._from_disk, key)
+
+    def _from_disk(self, key):
+        row = self._connect().execute(
+            "SELECT entity_id, access_hash, peer_type, username, title FROM entities "
+            "WHERE account = ? AND key = ?",
+            (self.account, key)
+        ).fetchone()
+        if row is None:
+            metrics.incr("entity_cache.misses")
+            return None
+
+        cached = CachedEntity(*row)
+        self._remember(key, cached)
+        metrics.incr("entity_cache.disk_hits")
+        return cached
+
+    def put(self, entity, key=None):
+        """Cache a Telethon entity under its id, marked id, username and key."""
+        cached = CachedEntity.from_entity(entity)
+        keys = cached.keys()
+        if key is not None:
+            keys.add(normalize_key(key))
+
+        now = time.time()
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO entities "
+            "(account, key, entity_id, access_hash, peer_type, username, title, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (self.account, k, cached.id, cached.access_hash, cached.peer_type,
+                 cached.username, cached.title, now)
+                for k in keys
+            ]
+        )
+        for k in keys:
+            self._remember(k, cached)
+        return cached
+
+    def invalidate(self, key):
+        """Drop every cached key that points at the same entity as key."""
+        cached = self.get(key)
+        keys = cached.keys() if cached else set()
+        keys.add(normalize_key(key))
+
+        with self._lock:
+            for k in keys:
+                self._memory.pop(k, None)
+        self._connect().executemany(
+            "DELETE FROM entities WHERE account = ? AND key = ?",
+            [(self.account, k) for k in keys]
+        )
+        metrics.incr("entity_cache.invalidations")
+
+    def _lookup_arg(self, key):
+        key = normalize_key(key)
+        return int(key) if key.lstrip('-').isdigit() else key
+
+    async def resolve(self, client, key, refresh=False):
+        """Return a CachedEntity for key, calling get_entity only on a miss."""
+        if not refresh:
+            cached = await self.get_async(key)
+            if cached is not None:
+                return cached
+        else:
+            await asyncio.to_thread(self.invalidate, key)
+
+        entity = await client.get_entity(self._lookup_arg(key))
+        return await asyncio.to_thread(self.put, entity, key)
+
+    def resolve_sync(self, client, key, refresh=False):
+        """Blocking variant of resolve for telethon.sync clients."""
+        if not refresh:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        else:
+            self.invalidate(key)
+
+        entity = client.get_entity(self._lookup_arg(key))
+        return self.put(entity, key)
@@ -0,0 +1,113 @@
+"""Bot API file_id cache keyed by the identity of the Telegram file.
+
+Once the bot has uploaded a file, Telegram hands back a file_id that can be
+sent again (or fetched with getFile) without another upload. The id used to
+be thrown away, so the next user asking for the same file paid for another
+full download and upload. File ids are now kept in a collection keyed by the
+file's canonical identity: the Telegram media id from the stored location,
+which is the same wherever the file was posted or reposted, or the original
+(chat, message) for documents without a location. The id is also set on
+every indexed document of that file, which is where the website's /download
+route looks for it.
+"""
+import logging
+from datetime import datetime
+
+import pymongo
+
+import metrics
+from delivery import sent_file_id
+
+logger = logging.getLogger(__name__)
+
+
+def document_key(document):
+    """Canonical identity of the file an indexed document points to, or None."""
+    location = document.get('location')
+    if location and location.get('id'):
+        return f"{location['kind']}:{location['id']}"
+    original = document.get('original_message') or {}
+    if original.get('chat_id') and original.get('message_id'):
+        return f"message:{original['chat_id']}:{original['message_id']}"
+    return None
+
+
+def _same_file(document):
+    """Filter matching every indexed document of the same file."""
+    location = document.get('location')
+    if location and location.get('id'):
+        return {'location.kind': location['kind'], 'location.id': location['id']}
+    original = document['original_message']
+    return {
+        'original_message.chat_id': original['chat_id'],
+        'original_message.message_id': original['message_id']
+    }
+
+
+class FileIdCache:
+    """file_id of uploaded files, shared by every user and document of the same file."""
+
+    def __init__(self, collection, documents_collection):
+        self.collection = collection
+        self.documents_collection = documents_collection
+
+    def ensure_indexes(self):
+        self.documents_collection.create_index([("location.id", pymongo.ASCENDING)])
+
+    def get(self, document):
+        """Return (file_id, kind) for a document, or (None, None)."""
+        if document.get('file_id'):
+            metrics.incr("file_ids.hits")
+            return document['file_id'], document.get('file_id_kind')
+
+        key = document_key(document)
+        entry = self.collection.find_one({'_id': key}) if key else None
+        if entry is None:
+            metrics.incr("file_ids.misses")
+            return None, None
+        metrics.incr("file_ids.hits")
+        return entry['file_id'], entry.get('kind')
+
+    def store(self, document, message):
+        """Remember the file_id of a message the bot sent with this document's file.
+
+        Returns the file_id, or None if the message carries no file.
+        """
+        file_id, kind = sent_file_id(message)
+        key = document_key(document)
+        if not file_id or not key:
+            return None
+
+        attachment = getattr(message, kind)
+        if kind == 'photo':
+            attachment = attachment[-1]
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {
+                'file_id': file_id,
+                'kind': kind,
+                'file_unique_id': getattr(attachment, 'file_unique_id', None),
+                'file_size': getattr(attachment, 'file_size', None),
+                'updated_at': datetime.now()
+            }},
+            upsert=True
+        )
+        self.documents_collection.update_many(
+            _same_file(document),
+            {'$set': {'file_id': file_id, 'file_id_kind': kind}}
+        )
+        metrics.incr("file_ids.stored")
+        return file_id
+
+    def invalidate(self, document, file_id):
+        """Forget a file_id Telegram no longer accepts."""
+        key = document_key(document)
+        if not key:
+            return
+        self.collection.delete_one({'_id': key, 'file_id': file_id})
+        self.documents_collection.update_many(
+            dict(_same_file(document), file_id=file_id),
+            {'$unset': {'file_id': "", 'file_id_kind': ""}}
+        )
+        metrics.incr("file_ids.invalidated")
+        logger.info(f"Dropped cached file_id for {key}")
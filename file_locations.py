@@ -0,0 +1,236 @@
+"""Stored MTProto file locations for downloading without fetching the message.
+
+The index used to keep only (chat_id, message_id), so every download started
+with a get_messages call just to learn where the file lives. Indexed
+documents now also store the media's id, access_hash, dc_id, size,
+embedded thumbnail and file_reference (plus when the reference was seen
+and by which account, since references and access hashes are only valid
+for that account). Downloads start straight from that location. File references expire, so a
+location older than FILE_REFERENCE_TTL, or one Telegram rejects with
+FILE_REFERENCE_EXPIRED, is refreshed with a single get_messages call that
+also refreshes other stale documents from the same chat.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import UpdateMany
+from telethon.tl import types
+
+import metrics
+from parallel_download import downloader
+
+logger = logging.getLogger(__name__)
+
+# Seconds a stored file reference is trusted before it's refreshed up front
+FILE_REFERENCE_TTL = float(os.getenv('FILE_REFERENCE_TTL', 6 * 3600))
+
+# get_messages accepts at most this many ids per request
+REFRESH_BATCH_SIZE = 100
+
+# Largest side (px) of the stored size picked as a photo's thumbnail
+THUMB_MAX_SIDE = 320
+
+
+def media_thumb(sizes, max_side=THUMB_MAX_SIDE):
+    """Return the stored thumbnail dict for a photo's sizes or a document's thumbs, or None.
+
+    The largest downloadable size no bigger than max_side is picked (the
+    smallest one if all are bigger). Sizes Telegram sends inline (cached or
+    stripped) are stored with their bytes and need no download.
+    """
+    sizes = sizes or []
+    downloadable = [s for s in sizes if isinstance(s, (types.PhotoSize, types.PhotoSizeProgressive))]
+    if downloadable:
+        fitting = [s for s in downloadable if max(s.w, s.h) <= max_side]
+        chosen = max(fitting, key=lambda s: s.w * s.h) if fitting else min(downloadable, key=lambda s: s.w * s.h)
+        size = chosen.size if isinstance(chosen, types.PhotoSize) else max(chosen.sizes)
+        return {'type': chosen.type, 'size': size}
+
+    inline = [s for s in sizes if isinstance(s, (types.PhotoCachedSize, types.PhotoStrippedSize)) and s.bytes]
+    if inline:
+        # Cached sizes are real images, stripped ones a blurry placeholder
+        chosen = max(inline, key=lambda s: isinstance(s, types.PhotoCachedSize))
+        return {'type': chosen.type, 'bytes': chosen.bytes, 'stripped': isinstance(chosen, types.PhotoStrippedSize)}
+    return None
+
+
+def media_location(message, account=None):
+    """Return the stored location dict for a message's document or photo, or None."""
+    media = message.media
+    document = getattr(media, 'document', None)
+    if isinstance(document, types.Document):
+        return {
+            'kind': 'document',
+            'id': document.id,
+            'access_hash': document.access_hash,
+            'file_reference': document.file_reference,
+            'dc_id': document.dc_id,
+            'size': document.size,
+            'mime_type': document.mime_type,
+            'thumb': media_thumb(document.thumbs),
+            'account': account,
+            'reference_at': datetime.now()
+        }
+
+    photo = getattr(media, 'photo', None)
+    if isinstance(photo, types.Photo):
+        # Download the largest stored size, like download_media does
+        sizes = [s for s in photo.sizes if isinstance(s, (types.PhotoSize, types.PhotoSizeProgressive))]
+        if not sizes:
+            return None
+        largest = max(sizes, key=lambda s: s.size if isinstance(s, types.PhotoSize) else max(s.sizes))
+        return {
+            'kind': 'photo',
+            'id': photo.id,
+            'access_hash': photo.access_hash,
+            'file_reference': photo.file_reference,
+            'dc_id': photo.dc_id,
+            'size': largest.size if isinstance(largest, types.PhotoSize) else max(largest.sizes),
+            'thumb_size': largest.type,
+            'thumb': media_thumb(photo.sizes),
+            'account': account,
+            'reference_at': datetime.now()
+        }
+
+    return None
+
+
+def is_fresh(location, ttl=FILE_REFERENCE_TTL):
+    """True if location exists and its file reference is recent enough to use as is."""
+    if not location or not location.get('reference_at'):
+        return False
+    return datetime.now() - location['reference_at'] < timedelta(seconds=ttl)
+
+
+def input_location(location):
+    """Return (dc_id, InputFileLocation) for a stored location."""
+    if location['kind'] == 'photo':
+        return location['dc_id'], types.InputPhotoFileLocation(
+            id=location['id'],
+            access_hash=location['access_hash'],
+            file_reference=location['file_reference'],
+            thumb_size=location['thumb_size']
+        )
+    return location['dc_id'], types.InputDocumentFileLocation(
+        id=location['id'],
+        access_hash=location['access_hash'],
+        file_reference=location['file_reference'],
+        thumb_size=''
+    )
+
+
+def thumb_location(location):
+    """Return (dc_id, InputFileLocation) of the stored thumbnail of a location."""
+    thumb_type = location['thumb']['type']
+    if location['kind'] == 'photo':
+        return location['dc_id'], types.InputPhotoFileLocation(
+            id=location['id'],
+            access_hash=location['access_hash'],
+            file_reference=location['file_reference'],
+            thumb_size=thumb_type
+        )
+    return location['dc_id'], types.InputDocumentFileLocation(
+        id=location['id'],
+        access_hash=location['access_hash'],
+        file_reference=location['file_reference'],
+        thumb_size=thumb_type
+    )
+
+
+def location_document(location):
+    """Rebuild a Document object from a stored location."""
+    return types.Document(
+        id=location['id'],
+        access_hash=location['access_hash'],
+        file_reference=location['file_reference'],
+        date=None,
+        mime_type=location.get('mime_type') or '',
+        size=location['size'],
+        dc_id=location['dc_id'],
+        attributes=[]
+    )
+
+
+async def download_location(client, location, path, progress_callback=None):
+    """Download the file at a stored location to path.
+
+    Documents and photos go through the parallel downloader (pooled
+    connections to the file's DC). Bytes already in path from an interrupted
+    attempt are kept and the download resumes after them. Raises
+    FileReferenceExpiredError if the stored reference is no longer valid;
+    what was downloaded so far stays in path for the retry.
+
+    Args:
+        client: The raw TelegramClient of the account that stored the location
+    """
+    dc_id, file_location = input_location(location)
+    await downloader.download(client, file_location, dc_id, location['size'], path, progress_callback)
+    metrics.incr("downloads.direct")
+    return path
+
+
+def stale_message_ids(collection, chat_id, limit=REFRESH_BATCH_SIZE):
+    """Ids of indexed messages in a chat whose stored location is missing or old."""
+    cutoff = datetime.now() - timedelta(seconds=FILE_REFERENCE_TTL)
+    cursor = collection.find(
+        {
+            'original_message.chat_id': chat_id,
+            'deleted': {'$ne': True},
+            '$or': [{'location': None}, {'location.reference_at': {'$lt': cutoff}}]
+        },
+        {'original_message.message_id': 1}
+    ).limit(limit * 2)
+
+    message_ids = []
+    for doc in cursor:
+        message_id = doc['original_message']['message_id']
+        if message_id not in message_ids:
+            message_ids.append(message_id)
+            if len(message_ids) == limit:
+                break
+    return message_ids
+
+
+async def refresh_locations(client, collection, entity, message_ids, account=None):
+    """Fetch messages in one request and store their current locations.
+
+    Every document indexed from one of these messages is updated (several
+    users can index the same message).
+
+    Args:
+        client: Client of the account the locations are stored for
+        collection: The documents collection
+        entity: Cached entity of the chat (its bare id is original_message.chat_id)
+        message_ids: Up to REFRESH_BATCH_SIZE message ids
+        account: Name of the account, stored with each location
+
+    Returns:
+        {message_id: message} for the messages that still exist
+    """
+    messages = await client.get_messages(entity.input_peer, ids=list(message_ids))
+
+    found = {}
+    updates = []
+    for message in messages:
+        if message is None or not message.media:
+            continue
+        found[message.id] = message
+        location = media_location(message, account)
+        if location is not None:
+            updates.append(UpdateMany(
+                {'original_message.chat_id': entity.id, 'original_message.message_id': message.id},
+                {'$set': {'location': location}}
+            ))
+
+    if updates:
+        try:
+            # pymongo blocks; the bot and the website both call this on their event loop
+            await asyncio.to_thread(collection.bulk_write, updates, ordered=False)
+        except Exception as e:
+            logger.error(f"Could not store refreshed file locations: {e}")
+
+    metrics.incr("downloads.reference_refreshes")
+    metrics.incr("downloads.refreshed_locations", len(updates))
+    return found
@@ -0,0 +1,201 @@
+"""Serving byte ranges of local files with constant memory per response.
+
+/media used to read a requested range into one bytes object, so a player
+asking for 500MB made the website allocate 500MB. Responses are now
+generators reading the open file in BUFFER_SIZE pieces (the async server
+runs them in a worker thread, so disk reads don't stall the event loop);
+several ranges are sent as multipart/byteranges built from the same pieces.
+
+ETag and Last-Modified come from the file's stat, so If-None-Match and
+If-Modified-Since are answered with 304, and a Range whose If-Range no
+longer matches the file gets the whole file instead of mismatched bytes.
+"""
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+
+from werkzeug.http import parse_if_range_header
+from werkzeug.sansio.http import is_resource_modified
+from werkzeug.wrappers import Response
+
+import metrics
+
+# Bytes read from disk per piece of a response
+BUFFER_SIZE = 64 * 1024
+
+# More ranges than this in one request are ignored and the whole file is sent
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r'(\d*)-(\d*)$')
+
+
+def parse_ranges(header, size):
+    """Return the inclusive (start, end) spans of a Range header, sorted and merged.
+
+    Returns None if there is no header, or one that isn't a byte range this
+    module understands (the whole file is sent, as RFC 7233 allows).
+
+    Raises:
+        ValueError: If no span overlaps the file (answer 416)
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    spans = []
+    for spec in specs:
+        match = _RANGE_SPEC.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        else:
+            # Suffix range: the last n bytes
+            if int(last) == 0:
+                continue
+            start, end = max(size - int(last), 0), size - 1
+        if start < size:
+            spans.append((start, end))
+    if not spans:
+        raise ValueError(f"Range {header!r} outside of {size} bytes")
+
+    # Overlapping or adjacent spans are sent once
+    spans.sort()
+    merged = [spans[0]]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def file_etag(stat):
+    """Strong validator for a file: changes whenever its size or mtime does."""
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def if_range_matches(header, etag, last_modified):
+    """Whether a Range may be honoured under an If-Range header (True without one)."""
+    if not header:
+        return True
+    if_range = parse_if_range_header(header)
+    if if_range.etag is not None:
+        # Weak validators never match (RFC 7233 section 3.2)
+        return not header.strip().startswith('W/') and if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return False
+
+
+def _read_span(file, start, end):
+    file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = file.read(min(BUFFER_SIZE, remaining))
+        if not data:
+            return
+        remaining -= len(data)
+        yield data
+
+
+def _iter_file(file, start, end):
+    try:
+        yield from _read_span(file, start, end)
+    finally:
+        file.close()
+
+
+def _iter_multipart(file, parts, closing):
+    try:
+        for head, start, end in parts:
+            yield head
+            yield from _read_span(file, start, end)
+        yield closing
+    finally:
+        file.close()
+
+
+def send_ranges(path, mimetype, headers, response_class=Response):
+    """Answer a GET for a local file, honouring Range, If-Range and cache validators.
+
+    Args:
+        path: File to send
+        mimetype: Content type of the file
+        headers: Headers of the request
+        response_class: Response type of the web framework
+
+    Returns:
+        A response_class instance: 200, 206 (single or multipart), 304 or 416
+    """
+    # Opened before answering, so the file stays readable if it's evicted meanwhile
+    file = open(path, 'rb')
+    try:
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+        etag = file_etag(stat)
+        last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+        if not is_resource_modified(
+            http_if_modified_since=headers.get('If-Modified-Since'),
+            http_if_none_match=headers.get('If-None-Match'),
+            etag=etag,
+            last_modified=last_modified
+        ):
+            file.close()
+            rv = response_class(status=304)
+        else:
+            ranges = None
+            if if_range_matches(headers.get('If-Range'), etag, last_modified):
+                try:
+                    ranges = parse_ranges(headers.get('Range'), size)
+                except ValueError:
+                    file.close()
+                    metrics.incr("media.range_unsatisfiable")
+                    rv = response_class(status=416)
+                    rv.headers['Content-Range'] = f'bytes */{size}'
+                    return rv
+
+            if not ranges:
+                rv = response_class(_iter_file(file, 0, size - 1), 200, mimetype=mimetype)
+                rv.headers['Content-Length'] = str(size)
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                rv = response_class(_iter_file(file, start, end), 206, mimetype=mimetype)
+                rv.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+                rv.headers['Content-Length'] = str(end - start + 1)
+                metrics.incr("media.ranges")
+            else:
+                boundary = uuid.uuid4().hex
+                parts = [
+                    (
+                        f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n".encode(),
+                        start, end
+                    )
+                    for start, end in ranges
+                ]
+                closing = f"\r\n--{boundary}--\r\n".encode()
+                length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(closing)
+                rv = response_class(_iter_multipart(file, parts, closing), 206,
+                                    content_type=f'multipart/byteranges; boundary={boundary}')
+                rv.headers['Content-Length'] = str(length)
+                metrics.incr("media.multipart_ranges")
+    except BaseException:
+        file.close()
+        raise
+
+    rv.headers['Accept-Ranges'] = 'bytes'
+    rv.set_etag(etag)
+    rv.last_modified = last_modified
+    return rv
@@ -14,6 +14,7 @@ from fuzzywuzzy import fuzz
 from telethon import events
 import re
 from enum import Enum
+from session_pool import UserClientPool
 
 # Load environment variables
 load_dotenv()
@@ -99,8 +100,17 @@ if not mongo_available:
 # Telethon client for the bot
 bot_client = TelegramClient('bot_session', API_ID, API_HASH)
 
-# Dictionary to store user clients
-user_clients = {}
+# Per-user clients stay connected between operations instead of a new handshake each time
+user_clients = UserClientPool(
+    lambda user_id: TelegramClient(
+        f"sessions/{user_id}",
+        API_ID,
+        API_HASH,
+        timeout=120  # Increase timeout to 2 minutes
+    ),
+    max_connected=int(os.getenv('USER_CLIENT_LIMIT', 20)),
+    idle_timeout=float(os.getenv('USER_CLIENT_IDLE_TIMEOUT', 600))
+)
 
 # Constants for user state
 AWAITING_SOURCE = "awaiting_source"
@@ -501,16 +511,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
         
+        client = None
         try:
-            # Create a new Telethon client for this user
-            client = TelegramClient(
-                f"sessions/{user_id}",
-                API_ID,
-                API_HASH,
-                timeout=120  # Increase timeout to 2 minutes
-            )
-            
-            await client.connect()
+            # Reuse this user's pooled client, it keeps the code hash for the sign-in step
+            client = await user_clients.acquire(user_id)
             
             # Start the authentication process
             # Use a longer timeout for code expiration (max 30 minutes)
@@ -534,8 +538,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Note: This code will expire in 30 minutes."
             )
             
-            await client.disconnect()
-            
         except PhoneNumberInvalidError:
             await update.message.reply_text(
                 "The phone number is invalid. Please enter a valid phone number in international format."
@@ -564,6 +566,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 {"user_id": user_id},
                 {"$set": {"state": UserState.AWAITING_PHONE.value}}
             )
+        finally:
+            if client is not None:
+                user_clients.release(user_id)
     
     elif user_state == UserState.AWAITING_CODE.value:
         # User is entering verification code
@@ -604,16 +609,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 )
                 return
         
+        client = None
         try:
-            # Create a client for this user
-            client = TelegramClient(
-                f"sessions/{user_id}",
-                API_ID,
-                API_HASH,
-                timeout=120  # Increase timeout to 2 minutes
-            )
-            
-            await client.connect()
+            # Same pooled client that requested the code (Telethon keeps the code hash on it)
+            client = await user_clients.acquire(user_id)
             
             # Try to sign in with the code
             await client.sign_in(phone, code)
@@ -633,8 +632,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Authentication successful! You can now use /search to search for documents in your channels and groups."
             )
             
-            await client.disconnect()
-            
         except PhoneCodeInvalidError:
             await update.message.reply_text(
                 "The verification code is invalid. Please check and enter the correct code."
@@ -648,8 +645,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 {"user_id": user_id},
                 {"$set": {"state": UserState.INITIAL.value}}
             )
-            
-            await client.disconnect()
         except SessionPasswordNeededError:
             # 2FA is enabled, need password
             users_collection.update_one(
@@ -661,8 +656,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Two-factor authentication is enabled for your account. Please enter your password."
             )
             
-            await client.disconnect()
-            
         except Exception as e:
             logger.error(f"Error signing in with code for user {user_id}: {str(e)}")
             await update.message.reply_text(
@@ -673,11 +666,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 {"user_id": user_id},
                 {"$set": {"state": UserState.INITIAL.value}}
             )
-            
-            try:
-                await client.disconnect()
-            except:
-                pass
+        finally:
+            if client is not None:
+                user_clients.release(user_id)
     
     elif user_state == UserState.AWAITING_2FA.value:
         # User is entering 2FA password
@@ -695,15 +686,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
         
+        client = None
         try:
-            # Create a client for this user
-            client = TelegramClient(
-                f"sessions/{user_id}",
-                API_ID,
-                API_HASH
-            )
-            
-            await client.connect()
+            # Same pooled client, still in the middle of signing in
+            client = await user_clients.acquire(user_id)
             
             # Try to complete sign-in with password
             await client.sign_in(password=password)
@@ -723,8 +709,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Authentication successful! You can now use /search to search for documents in your channels and groups."
             )
             
-            await client.disconnect()
-            
         except PasswordHashInvalidError:
             await update.message.reply_text(
                 "The password is incorrect. Please try again."
@@ -739,11 +723,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 {"user_id": user_id},
                 {"$set": {"state": UserState.INITIAL.value}}
             )
-            
-            try:
-                await client.disconnect()
-            except:
-                pass
+        finally:
+            if client is not None:
+                user_clients.release(user_id)
     
     elif user_state == UserState.AUTHENTICATED.value:
         # User is authenticated, check if they're trying to search
@@ -823,22 +805,16 @@ async def fetch_channel_content(update: Update, context: ContextTypes.DEFAULT_TY
         "Starting to fetch content from the channel/group. This may take a while depending on the amount of content..."
     )
     
+    client = None
     try:
-        # Create a client for this user
-        client = TelegramClient(
-            f"sessions/{user_id}",
-            API_ID,
-            API_HASH
-        )
-        
-        await client.connect()
+        # Reuse this user's pooled client
+        client = await user_clients.acquire(user_id)
         
         # Check if the client is authorized
         if not await client.is_user_authorized():
             await status_message.edit_text(
                 "You are not properly authenticated. Please use /auth to authenticate again."
             )
-            await client.disconnect()
             return
         
         # Try to validate the chat_id before proceeding
@@ -851,7 +827,6 @@ async def fetch_channel_content(update: Update, context: ContextTypes.DEFAULT_TY
                 f"Failed to access the specified channel/group: {str(e)}\n\n"
                 f"Make sure you provided a valid channel username, invite link, or ID, and that you have access to it."
             )
-            await client.disconnect()
             return
         
         # Store the source in the database if it doesn't exist
@@ -984,18 +959,15 @@ async def fetch_channel_content(update: Update, context: ContextTypes.DEFAULT_TY
             await status_message.edit_text(
                 f"No new documents found in {source_name}."
             )
-        
-        await client.disconnect()
     
     except Exception as e:
         logger.error(f"Error fetching content from {chat_id}: {str(e)}")
         await status_message.edit_text(
             f"An error occurred while fetching content: {str(e)}"
         )
-        try:
-            await client.disconnect()
-        except:
-            pass
+    finally:
+        if client is not None:
+            user_clients.release(user_id)
 
 async def view_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str) -> None:
     """View a specific file."""
@@ -1118,6 +1090,14 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Error in error handler: {e}")
         logger.error(f"Original error: {context.error}")
 
+async def post_init(application: Application) -> None:
+    """Start closing idle user clients in the background."""
+    user_clients.start()
+
+async def post_shutdown(application: Application) -> None:
+    """Disconnect the pooled user clients."""
+    await user_clients.close()
+
 def main() -> None:
     """Start the bot."""
     # Initialize database collections if not exists
@@ -1136,7 +1116,7 @@ def main() -> None:
     os.makedirs("sessions", exist_ok=True)
     
     # Create the Application instance
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -0,0 +1,123 @@
+"""Recovery of messages posted while the bot was offline.
+
+For every monitored chat the id of the newest message whose document has been
+written is stored in MongoDB (a high-water mark that only moves forward once
+the index write succeeded). On startup each chat is diffed with
+iter_messages(min_id=mark), so an outage costs a few targeted history pages
+instead of a full reindex, and the missed messages go through the same
+batched indexing path as live updates.
+"""
+import logging
+import threading
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SyncState:
+    """Per-chat high-water marks (newest indexed message id)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._marks = {}
+        self._startup_marks = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            for state in self.collection.find({}):
+                self._marks[state['chat_id']] = state['last_message_id']
+            # Live updates move the marks forward, recovery has to start from where we stopped
+            self._startup_marks = dict(self._marks)
+        logger.info(f"Loaded sync state for {len(self._marks)} chats")
+
+    def last_message_id(self, peer_id):
+        return self._marks.get(peer_id)
+
+    def startup_message_id(self, peer_id):
+        """The mark as it was when the process started (before any live update)."""
+        return self._startup_marks.get(peer_id)
+
+    def advance(self, marks):
+        """Record (peer_id, message_id) pairs whose documents have been written.
+
+        Only moves marks forward; safe to call from a worker thread.
+        """
+        newest = {}
+        for peer_id, message_id in marks:
+            newest[peer_id] = max(message_id, newest.get(peer_id, 0))
+
+        updates = []
+        with self._lock:
+            for peer_id, message_id in newest.items():
+                if message_id > self._marks.get(peer_id, 0):
+                    self._marks[peer_id] = message_id
+                    updates.append(UpdateOne(
+                        {'chat_id': peer_id},
+                        {'$max': {'last_message_id': message_id}, '$set': {'updated_at': datetime.now()}},
+                        upsert=True
+                    ))
+
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+
+
+async def recover_gaps(client, entity_cache, routing_table, sync_state, index_messages, limit=5000):
+    """Index messages posted after each monitored chat's high-water mark.
+
+    History is read in passes of up to limit messages until a chat has no
+    more, so a long outage is recovered in full rather than cut off with the
+    rest of the gap hidden behind the next live mark.
+
+    Args:
+        client: Telegram client used to fetch history
+        entity_cache: Cache used to turn chat ids into input peers
+        routing_table: Monitored chats and their subscribers
+        sync_state: High-water marks of the monitored chats
+        index_messages: Callable(peer_id, routes, messages) that queues documents
+        limit: Messages fetched per pass
+
+    Returns:
+        The number of recovered media messages
+    """
+    recovered = 0
+
+    for peer_id in routing_table.chats():
+        last_id = sync_state.startup_message_id(peer_id)
+        if last_id is None:
+            # Never indexed live, the initial indexing job covers its history
+            continue
+
+        chat_recovered = 0
+        try:
+            entity = await entity_cache.resolve(client, peer_id)
+            while True:
+                messages = []
+                count = 0
+                async for message in client.iter_messages(entity.input_peer, min_id=last_id, reverse=True, limit=limit):
+                    count += 1
+                    last_id = message.id
+                    if message.media:
+                        messages.append(message)
+
+                routes = routing_table.lookup(peer_id)
+                if messages and routes:
+                    # Index in chunks so albums in the same chunk still share captions
+                    for start in range(0, len(messages), 100):
+                        index_messages(peer_id, routes, messages[start:start + 100])
+                    chat_recovered += len(messages)
+                if count < limit:
+                    break
+        except Exception as e:
+            logger.error(f"Gap recovery failed for chat {peer_id} after message {last_id}: {e}")
+
+        if chat_recovered:
+            logger.info(f"Recovered {chat_recovered} missed messages from chat {peer_id}")
+        recovered += chat_recovered
+
+    metrics.incr("gap_recovery.messages", recovered)
+    return recovered
@@ -0,0 +1,318 @@
+"""Import a Telegram Desktop chat export (result.json) into the document index.
+
+Backfilling a large channel through iter_messages takes hours and runs into
+flood waits. Telegram Desktop can export a chat's full history as JSON
+locally; this script streams that file (without loading it into memory),
+turns media messages into the same documents the bot indexes and bulk-loads
+them with several writer threads. The chat's sync mark is then moved to the
+newest exported message, so live indexing and gap recovery only cover what
+was posted after the export.
+
+Usage:
+    python import_export.py path/to/result.json --user-id 12345 --source @channel
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from telethon import utils
+from telethon.tl.types import PeerChannel, PeerChat
+
+import metrics
+from gap_recovery import SyncState
+
+logger = logging.getLogger(__name__)
+
+# Export chat types that are basic groups; everything else is a channel or supergroup
+BASIC_GROUP_TYPES = ('private_group',)
+
+
+class ExportReader:
+    """Streams the messages of a single-chat export with an incremental JSON parser.
+
+    The chat's own fields (name, type, id) come before the messages array in
+    the export and are available in .chat once iteration has started.
+    """
+
+    def __init__(self, fileobj, chunk_size=1 << 20):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.chat = {}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        # Drop what has been consumed so the buffer stays around one chunk
+        data = self.fileobj.read(self.chunk_size)
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        if not data:
+            self._eof = True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it ('' at the end)."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return self._buffer[self._pos:self._pos + 1]
+            self._fill()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Malformed export: expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def _value(self):
+        """Decode the next complete JSON value, reading more input as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        while self._peek() != '}':
+            key = self._value()
+            self._expect(':')
+            if key == 'messages':
+                yield from self._messages()
+            else:
+                self.chat[key] = self._value()
+            if self._peek() == ',':
+                self._pos += 1
+
+    def _messages(self):
+        if 'id' not in self.chat:
+            raise ValueError("Not a single chat export (no chat id before the messages)")
+        self._expect('[')
+        while self._peek() != ']':
+            yield self._value()
+            if self._peek() == ',':
+                self._pos += 1
+        self._pos += 1
+
+
+def export_peer_id(chat):
+    """Marked peer id (as used by the routing table) of the exported chat."""
+    if chat.get('type') in BASIC_GROUP_TYPES:
+        return utils.get_peer_id(PeerChat(chat['id']))
+    return utils.get_peer_id(PeerChannel(chat['id']))
+
+
+def export_text(entry):
+    """Plain text of an exported message (formatted text is a list of strings and entities)."""
+    text = entry.get('text', "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get('text', "") for part in text)
+    return text
+
+
+def export_date(entry):
+    if entry.get('date_unixtime'):
+        return datetime.fromtimestamp(int(entry['date_unixtime']), timezone.utc)
+    return datetime.fromisoformat(entry['date'])
+
+
+def export_document(entry, chat_id, user_id, source_id, source_name):
+    """Build the index document for an exported message, or None if it has no media.
+
+    Mirrors bot.build_document/get_file_details so file hashes (and with them
+    deduplication) match documents indexed from the live client.
+    """
+    if entry.get('type') != 'message':
+        return None
+
+    if 'photo' in entry:
+        file_name = f"photo_{entry['id']}.jpg"
+        file_type = "photo"
+        mime_type = "image/jpeg"
+        file_size = entry.get('photo_file_size', 0)
+    elif 'file' in entry:
+        mime_type = entry.get('mime_type', "")
+        file_type = "unknown"
+        if mime_type:
+            file_type = mime_type.split('/')[-1] if '/' in mime_type else mime_type
+
+        # Like get_file_details, a document without a file name attribute is
+        # "Unnamed file" (the saved path is renamed by the exporter)
+        file_name = entry.get('file_name') or "Unnamed file"
+        if '.' in file_name and not file_type:
+            file_type = file_name.split('.')[-1]
+
+        file_size = entry.get('file_size', 0)
+    else:
+        return None
+
+    file_hash = hashlib.md5(f"{chat_id}_{entry['id']}_{file_name}".encode()).hexdigest()
+
+    return {
+        'user_id': user_id,
+        'source_id': str(source_id),
+        'source_name': source_name,
+        'file_name': file_name,
+        'file_type': file_type,
+        'file_size': file_size,
+        'mime_type': mime_type,
+        'file_hash': file_hash,
+        'text': export_text(entry),
+        'grouped_id': None,
+        'date': export_date(entry),
+        'original_message': {
+            'chat_id': chat_id,
+            'message_id': entry['id']
+        },
+        # Exports carry no file location, it is stored on the first download
+        'location': None,
+        'indexed_at': datetime.now()
+    }
+
+
+def write_batch(collection, documents):
+    """Upsert a batch of documents, leaving already indexed files untouched."""
+    operations = [
+        UpdateOne(
+            {'user_id': document['user_id'], 'file_hash': document['file_hash']},
+            {'$setOnInsert': document},
+            upsert=True
+        )
+        for document in documents
+    ]
+    return collection.bulk_write(operations, ordered=False).upserted_count
+
+
+def import_export(reader, collection, user_id, source_id, source_name=None, batch_size=1000, writers=4):
+    """Load every media message of an export into collection.
+
+    Batches are written by a pool of writer threads; at most two batches per
+    writer are in flight so memory stays bounded however large the export is.
+
+    Returns:
+        (imported, media_messages, newest_message_id)
+    """
+    imported = 0
+    media_messages = 0
+    newest_id = 0
+    batch = []
+    in_flight = set()
+    started = time.time()
+
+    def collect(done):
+        nonlocal imported
+        for future in done:
+            imported += future.result()
+
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        for entry in reader:
+            newest_id = max(newest_id, entry.get('id', 0))
+            chat = reader.chat
+            document = export_document(
+                entry, chat['id'], user_id, source_id, source_name or chat.get('name', str(chat['id']))
+            )
+            if document is None:
+                continue
+
+            media_messages += 1
+            batch.append(document)
+            if len(batch) < batch_size:
+                continue
+
+            if len(in_flight) >= writers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(write_batch, collection, batch))
+            batch = []
+
+            if media_messages % (batch_size * 10) == 0:
+                rate = media_messages / max(time.time() - started, 0.001)
+                logger.info(f"Read {media_messages} media messages ({rate:.0f}/s)")
+
+        if batch:
+            in_flight.add(pool.submit(write_batch, collection, batch))
+        collect(wait(in_flight)[0])
+
+    metrics.incr("import.documents", imported)
+    return imported, media_messages, newest_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop JSON export into the search index")
+    parser.add_argument('export', help="Path to the export's result.json")
+    parser.add_argument('--user-id', type=int, required=True, help="Telegram user id the documents are indexed for")
+    parser.add_argument('--source', required=True, help="Source name as used with /connect (e.g. @channel)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Documents per bulk write")
+    parser.add_argument('--writers', type=int, default=4, help="Parallel writer threads")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    client = pymongo.MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    db = client['telegram_search_bot']
+    documents_collection = db['documents']
+    sources_collection = db['sources']
+
+    # Reuse the user's source if it's already connected, so the bot keeps monitoring it
+    source = sources_collection.find_one({'user_id': args.user_id, 'source_name': args.source})
+    if source:
+        source_id = source['_id']
+    else:
+        source_id = sources_collection.insert_one({
+            'user_id': args.user_id,
+            'source_name': args.source,
+            'date_added': datetime.now()
+        }).inserted_id
+
+    documents_collection.create_index([("user_id", pymongo.ASCENDING), ("file_hash", pymongo.ASCENDING)])
+
+    started = time.time()
+    with open(args.export, encoding='utf-8') as f:
+        reader = ExportReader(f)
+        imported, media_messages, newest_id = import_export(
+            reader, documents_collection, args.user_id, source_id,
+            batch_size=args.batch_size, writers=args.writers
+        )
+
+    chat = reader.chat
+    peer_id = export_peer_id(chat)
+
+    # Store the chat id so live updates are routed, and start them after the export
+    sources_collection.update_one(
+        {'_id': source_id},
+        {'$set': {'chat_id': peer_id, 'chat_title': chat.get('name')}}
+    )
+    if newest_id:
+        SyncState(db['sync_state']).advance([(peer_id, newest_id)])
+
+    logger.info(
+        f"Imported {imported} new documents from {media_messages} media messages of "
+        f"{chat.get('name')} in {time.time() - started:.1f}s (newest message {newest_id})"
+    )
+
+
+if __name__ == '__main__':
+    main()
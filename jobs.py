@@ -0,0 +1,197 @@
+"""Persistent background job queue backed by MongoDB.
+
+Jobs are stored in a collection so they survive restarts, and are executed by
+a small number of asyncio worker tasks running in the bot's event loop.
+Handlers only enqueue work and return immediately; workers pick jobs up by
+priority (lower first) and in FIFO order within a priority, run the
+registered coroutine for the job kind and notify the user when it finishes.
+The pymongo calls the workers make run in threads, so a slow or unreachable
+database doesn't stall the event loop. A job that keeps getting interrupted
+(e.g. because it crashes the process) is failed after max_attempts claims
+instead of being requeued forever.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+import pymongo
+from pymongo import ReturnDocument
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobQueue:
+    """Priority/FIFO job queue stored in MongoDB with in-process async workers."""
+
+    def __init__(self, collection, workers=2, poll_interval=5.0, max_attempts=3):
+        self.collection = collection
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self.completion_callback = None
+        self._wakeup = None
+        self._tasks = []
+
+    def register(self, kind, handler):
+        """Register the coroutine function that runs jobs of this kind.
+
+        The handler is called with the job document and its return value is
+        stored as the job result.
+        """
+        self.handlers[kind] = handler
+
+    def on_complete(self, callback):
+        """Set a coroutine function called with the job after it finishes."""
+        self.completion_callback = callback
+
+    def ensure_indexes(self):
+        self.collection.create_index([
+            ("status", pymongo.ASCENDING), ("priority", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)
+        ])
+        self.collection.create_index([("user_id", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING)])
+
+    def enqueue(self, kind, user_id, payload=None, description=None, priority=0):
+        """Store a new job and wake up an idle worker. Returns the job id.
+
+        Jobs with a lower priority value are claimed first.
+        """
+        job = {
+            'kind': kind,
+            'user_id': user_id,
+            'payload': payload or {},
+            'description': description or kind,
+            'status': JOB_QUEUED,
+            'priority': priority,
+            'created_at': datetime.now(),
+            'attempts': 0
+        }
+        job_id = self.collection.insert_one(job).inserted_id
+        metrics.incr(f"jobs.{kind}.enqueued")
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        logger.info(f"Enqueued job {job_id} ({kind}) for user {user_id}")
+        return job_id
+
+    def list_jobs(self, user_id, limit=10):
+        """Return the most recent jobs of a user, newest first."""
+        return list(self.collection.find({'user_id': user_id}).sort('created_at', pymongo.DESCENDING).limit(limit))
+
+    def queued_count(self):
+        return self.collection.count_documents({'status': JOB_QUEUED})
+
+    async def start(self):
+        """Requeue jobs interrupted by a restart and start the worker tasks."""
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.ensure_indexes)
+
+        # Jobs left running by a previous process never finished
+        exhausted = await asyncio.to_thread(self._fail_exhausted)
+        if exhausted:
+            logger.warning(f"Failed {exhausted} jobs interrupted {self.max_attempts} times")
+        requeued = await asyncio.to_thread(self._requeue_running)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+
+        metrics.gauge("jobs.queued", self.queued_count)
+
+        for n in range(self.workers):
+            self._tasks.append(asyncio.ensure_future(self._worker(n)))
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _fail_exhausted(self):
+        return self.collection.update_many(
+            {'status': {'$in': [JOB_QUEUED, JOB_RUNNING]}, 'attempts': {'$gte': self.max_attempts}},
+            {'$set': {
+                'status': JOB_FAILED,
+                'error': f"Interrupted {self.max_attempts} times",
+                'finished_at': datetime.now()
+            }}
+        ).modified_count
+
+    def _requeue_running(self):
+        return self.collection.update_many(
+            {'status': JOB_RUNNING},
+            {'$set': {'status': JOB_QUEUED}}
+        ).modified_count
+
+    def _claim(self):
+        """Atomically move the most urgent, oldest queued job to running and return it."""
+        return self.collection.find_one_and_update(
+            {'status': JOB_QUEUED, 'attempts': {'$lt': self.max_attempts}},
+            {
+                '$set': {'status': JOB_RUNNING, 'started_at': datetime.now()},
+                '$inc': {'attempts': 1}
+            },
+            sort=[('priority', pymongo.ASCENDING), ('created_at', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self, n):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Job worker {n} could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                # Sleep until a job is enqueued (or poll again in case another process added one)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _run(self, job):
+        kind = job['kind']
+        handler = self.handlers.get(kind)
+        started = datetime.now()
+        metrics.observe(f"jobs.{kind}.queue_wait", (started - job['created_at']).total_seconds())
+
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind '{kind}'")
+            result = await handler(job)
+            update = {'status': JOB_DONE, 'result': result, 'finished_at': datetime.now()}
+            metrics.incr(f"jobs.{kind}.done")
+        except asyncio.CancelledError:
+            # Leave the job running; it is requeued on the next start
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['_id']} ({kind}) failed: {e}", exc_info=True)
+            update = {'status': JOB_FAILED, 'error': str(e), 'finished_at': datetime.now()}
+            metrics.incr(f"jobs.{kind}.failed")
+
+        metrics.observe(f"jobs.{kind}.run_time", (datetime.now() - started).total_seconds())
+        try:
+            await asyncio.to_thread(self.collection.update_one, {'_id': job['_id']}, {'$set': update})
+        except Exception as e:
+            # Left running, so the job is requeued on the next start
+            logger.error(f"Could not record the outcome of job {job['_id']}: {e}")
+        job.update(update)
+
+        if self.completion_callback is not None:
+            try:
+                await self.completion_callback(job)
+            except Exception as e:
+                logger.error(f"Error in job completion callback: {e}")
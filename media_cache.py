@@ -0,0 +1,341 @@
+"""Media cache shared by the bot and the website.
+
+Both processes keep downloaded files in one directory, named by the identity
+of the Telegram file (see file_id_cache.document_key), so a file fetched for
+one user or visitor is reused by everyone. Sizes, access times, hit counts
+and pins live in a small SQLite index in the same directory that both
+processes update (like rate_limiter and thumbnails), so MEDIA_CACHE_BYTES is
+one budget for the directory rather than one per process, and a cache miss
+doesn't stat every file in the directory. The index is reconciled with the
+directory listing on startup. Files in use (being uploaded or streamed) are
+pinned by the process using them and never evicted by either process; pins
+of a process that died are dropped on the next startup. A file deleted
+while it is open stays readable until it is closed.
+
+Files still being written (.part) are not part of the cache until they are
+published. The sparse files the website streams into (see media_stream) are
+filled in over many requests, so they count against the budget with the
+blocks actually written, and are evicted together with their chunk map.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import metrics
+from download_manager import safe_name, PART_SUFFIX, RESUME_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DIR = os.getenv(
+    'MEDIA_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
+)
+MEDIA_CACHE_BYTES = int(os.getenv('MEDIA_CACHE_BYTES', 2 * 1024 ** 3))
+MEDIA_CACHE_POLICY = os.getenv('MEDIA_CACHE_POLICY', 'lru')
+
+# SQLite index (plus its -wal and -shm files) inside the cache directory
+INDEX_FILE = '.cache_index.db'
+
+# Index written by earlier versions, imported once by load()
+LEGACY_INDEX_FILE = '.cache_index.json'
+
+SPARSE_SUFFIX = '.sparse'
+CHUNK_MAP_SUFFIX = '.chunks'
+
+# Files that are being written, or belong to a file being written
+IN_PROGRESS_SUFFIXES = (PART_SUFFIX, RESUME_SUFFIX, CHUNK_MAP_SUFFIX, '.tmp')
+
+# Seconds an interrupted download is kept for resuming
+RESUME_TTL = 24 * 3600
+
+# Eviction order of each policy, lowest priority first
+_EVICTION_ORDER = {
+    'lru': "last_access",
+    'lfu': "hits, last_access",
+}
+
+
+def allocated_size(path):
+    """Disk space a file takes up; less than its length for a sparse file."""
+    st = os.stat(path)
+    blocks = getattr(st, 'st_blocks', None)
+    # st_blocks is in 512-byte units; Windows doesn't report it
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def _remove_file(path):
+    """Remove a cached file, and the chunk map of a sparse one."""
+    paths = [path]
+    if path.endswith(SPARSE_SUFFIX):
+        paths.append(path[:-len(SPARSE_SUFFIX)] + CHUNK_MAP_SUFFIX)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _process_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MediaCache:
+    """Byte-budgeted LRU/LFU cache of files in one directory, shared between processes."""
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_BYTES, policy=MEDIA_CACHE_POLICY):
+        """
+        Args:
+            directory: Directory holding the cached files and the index
+            max_bytes: Total size the cached files are kept under
+            policy: 'lru' evicts the least recently used file first, 'lfu'
+                the least often used (ties by age)
+        """
+        if policy not in _EVICTION_ORDER:
+            raise ValueError(f"Unknown cache policy {policy!r}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self._pid = os.getpid()
+        self._local = threading.local()
+
+        metrics.gauge("media_cache.bytes", lambda: self.total_bytes)
+        metrics.gauge("media_cache.files", lambda: len(self))
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads; the index is
+        # created on first use, so constructing a cache touches no files
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " name TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_hits ON entries (hits, last_access)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pins ("
+                " name TEXT NOT NULL,"
+                " pid INTEGER NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " PRIMARY KEY (name, pid))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, path):
+        return self._connect().execute(
+            "SELECT 1 FROM entries WHERE name = ?", (os.path.basename(path),)
+        ).fetchone() is not None
+
+    @property
+    def total_bytes(self):
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def path(self, key, extension=None):
+        """Cache path of the file with this identity."""
+        name = safe_name(key)
+        if extension:
+            name = f"{name}.{extension}"
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """Reconcile the index with the directory, drop dead processes' pins and evict down to budget."""
+        conn = self._connect()
+        legacy = self._read_legacy_index()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            indexed = {name for name, in conn.execute("SELECT name FROM entries")}
+            present = set()
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(RESUME_SUFFIX):
+                    self._drop_stale_resume(path)
+                    continue
+                if name.startswith(INDEX_FILE) or name == LEGACY_INDEX_FILE or name.endswith(IN_PROGRESS_SUFFIXES):
+                    continue
+                if not os.path.isfile(path):
+                    continue
+                present.add(name)
+                if name.endswith(SPARSE_SUFFIX):
+                    # Streamed into since it was last accounted, perhaps
+                    size = allocated_size(path)
+                    conn.execute("UPDATE entries SET size = ? WHERE name = ?", (size, name))
+                else:
+                    size = os.path.getsize(path)
+                if name not in indexed:
+                    # Added while no process was running (or by an older version)
+                    known = legacy.get(name) or {}
+                    conn.execute(
+                        "INSERT INTO entries (name, size, last_access, hits) VALUES (?, ?, ?, ?)",
+                        (name, size, known.get('last_access') or os.path.getmtime(path), known.get('hits', 0))
+                    )
+            conn.executemany("DELETE FROM entries WHERE name = ?", [(name,) for name in indexed - present])
+
+            pids = [pid for pid, in conn.execute("SELECT DISTINCT pid FROM pins")]
+            dead = [(pid,) for pid in pids if pid != self._pid and not _process_alive(pid)]
+            conn.executemany("DELETE FROM pins WHERE pid = ?", dead)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if legacy:
+            try:
+                os.remove(os.path.join(self.directory, LEGACY_INDEX_FILE))
+            except OSError:
+                pass
+        self._evict()
+        logger.info(f"Media cache: {len(self)} files, {self.total_bytes / 1024 / 1024:.1f} MB")
+
+    def _read_legacy_index(self):
+        try:
+            with open(os.path.join(self.directory, LEGACY_INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not read the old media cache index ({e}), ignoring it")
+            return {}
+
+    def _drop_stale_resume(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > RESUME_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def add(self, path):
+        """Account for a file just published at path and evict if over budget."""
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        # The download itself counts as a use
+        self._connect().execute(
+            "INSERT OR REPLACE INTO entries (name, size, last_access, hits) VALUES (?, ?, ?, 1)",
+            (os.path.basename(path), size, time.time())
+        )
+        self._evict()
+        metrics.incr("media_cache.added")
+
+    def add_partial(self, path):
+        """Account for the disk space of a file still being filled in (a .sparse stream cache).
+
+        Called again as it grows; evicted like a published file unless pinned.
+        """
+        try:
+            size = allocated_size(path)
+        except FileNotFoundError:
+            return
+        self._connect().execute(
+            "INSERT INTO entries (name, size, last_access, hits) VALUES (?, ?, ?, 0) "
+            "ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+            (os.path.basename(path), size, time.time())
+        )
+        self._evict()
+
+    def lookup(self, path):
+        """Return True and record a hit if the file is cached.
+
+        A file that was published without being indexed is adopted.
+        """
+        name = os.path.basename(path)
+        conn = self._connect()
+        found = conn.execute(
+            "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE name = ?", (time.time(), name)
+        ).rowcount
+        if found and not os.path.exists(path):
+            # Deleted behind the index's back
+            conn.execute("DELETE FROM entries WHERE name = ?", (name,))
+            found = False
+        if not found:
+            if not os.path.isfile(path):
+                metrics.incr("media_cache.misses")
+                return False
+            conn.execute(
+                "INSERT OR IGNORE INTO entries (name, size, last_access, hits) VALUES (?, ?, ?, 1)",
+                (name, os.path.getsize(path), time.time())
+            )
+        metrics.incr("media_cache.hits")
+        return True
+
+    def pin(self, path):
+        """Keep a file from being evicted, by either process, until unpin() (calls nest).
+
+        Can be called before the file exists, e.g. while it is downloaded.
+        """
+        self._connect().execute(
+            "INSERT INTO pins (name, pid, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(name, pid) DO UPDATE SET count = count + 1",
+            (os.path.basename(path), self._pid)
+        )
+
+    def unpin(self, path):
+        name = os.path.basename(path)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE pins SET count = count - 1 WHERE name = ? AND pid = ?", (name, self._pid))
+            conn.execute("DELETE FROM pins WHERE name = ? AND pid = ? AND count <= 0", (name, self._pid))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._evict()
+
+    def remove(self, path):
+        self._connect().execute("DELETE FROM entries WHERE name = ?", (os.path.basename(path),))
+        _remove_file(path)
+
+    def _evict(self):
+        """Remove the lowest priority unpinned files until under budget."""
+        conn = self._connect()
+        victims = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - self.max_bytes
+            if excess > 0:
+                rows = conn.execute(
+                    "SELECT name, size FROM entries WHERE name NOT IN (SELECT name FROM pins) "
+                    f"ORDER BY {_EVICTION_ORDER[self.policy]}"
+                )
+                for name, size in rows:
+                    if excess <= 0:
+                        break
+                    victims.append(name)
+                    excess -= size
+                rows.close()
+                conn.executemany("DELETE FROM entries WHERE name = ?", [(name,) for name in victims])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Outside the transaction, so the other process isn't kept waiting on the disk
+        for name in victims:
+            _remove_file(os.path.join(self.directory, name))
+            metrics.incr("media_cache.evictions")
+            logger.debug(f"Evicted {name} from the media cache")
@@ -0,0 +1,249 @@
+"""Streaming Telegram media to HTTP Range requests.
+
+The website used to download a whole file before sending its first byte, so
+opening (or seeking in) a large video meant waiting for the full download.
+A Range request is now mapped onto the chunk grid Telegram serves files in
+(STREAM_CHUNK_SIZE, the largest request upload.getFile accepts): only the
+chunks covering the requested bytes are fetched with iter_download, sent on
+as they arrive and written through to a sparse cache file. Chunks already in
+the cache are read from disk, and once every chunk of a file has been seen
+the sparse file is published as the complete cached copy.
+
+Players send overlapping Range requests for the same file, so all responses
+streaming a file share one SparseCache (see open_sparse) and its bitmap of
+present chunks. The bitmap is saved after each fetched run rather than per
+chunk, and disk I/O runs in threads off the event loop. Sparse files count
+against the media cache's byte budget with the blocks actually written.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+
+import metrics
+from file_locations import input_location
+from media_cache import SPARSE_SUFFIX, CHUNK_MAP_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# upload.getFile limit; offsets on this grid are always valid
+STREAM_CHUNK_SIZE = 512 * 1024
+
+# Most bytes sent for one Range response (players ask for more as they go)
+STREAM_WINDOW = int(os.getenv('STREAM_WINDOW', 8 * 1024 * 1024))
+
+# Path -> the SparseCache responses streaming that file share
+_open_caches = {}
+_open_lock = threading.Lock()
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size, window=STREAM_WINDOW):
+    """Return the inclusive (start, end) byte span to send for a Range header.
+
+    A missing header means the whole file; open-ended and overlong ranges are
+    cut to window bytes so one response never holds the server for long.
+
+    Raises:
+        ValueError: If the range can't be satisfied (answer 416)
+    """
+    start, end = 0, size - 1
+    if header:
+        match = _RANGE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            raise ValueError(f"Unsupported range {header!r}")
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last:
+                end = min(int(last), size - 1)
+        else:
+            # Suffix range: the last n bytes
+            start = max(size - int(last), 0)
+        if start >= size or start > end:
+            raise ValueError(f"Range {header!r} outside of {size} bytes")
+    return start, min(end, start + window - 1)
+
+
+def open_sparse(path, size, chunk_size=STREAM_CHUNK_SIZE, media_cache=None):
+    """Return the SparseCache for path, shared with the other responses streaming it.
+
+    Every call must be matched by one close().
+    """
+    with _open_lock:
+        cache = _open_caches.get(path)
+        if cache is None:
+            cache = _open_caches[path] = SparseCache(path, size, chunk_size, media_cache)
+        else:
+            cache._users += 1
+        return cache
+
+
+class SparseCache:
+    """A partially downloaded file: chunk data in a sparse file plus a bitmap of present chunks."""
+
+    def __init__(self, path, size, chunk_size=STREAM_CHUNK_SIZE, media_cache=None):
+        """
+        Args:
+            path: Where the complete file is published
+            size: File size in bytes
+            chunk_size: Size of the chunks the file is fetched in
+            media_cache: MediaCache the sparse file, and then the published
+                file, are accounted in
+        """
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.media_cache = media_cache
+        self._users = 1
+        self.chunks = max(1, (size + chunk_size - 1) // chunk_size)
+        self.data_path = path + SPARSE_SUFFIX
+        self.map_path = path + CHUNK_MAP_SUFFIX
+        self._lock = threading.Lock()
+
+        present = bytearray((self.chunks + 7) // 8)
+        if os.path.exists(self.data_path) and os.path.exists(self.map_path):
+            with open(self.map_path, 'rb') as f:
+                saved = f.read()
+            if len(saved) == len(present):
+                present = bytearray(saved)
+        self._present = present
+
+        # Only allocated blocks take up disk space
+        if not os.path.exists(self.data_path):
+            with open(self.data_path, 'wb') as f:
+                f.truncate(size)
+        self._file = open(self.data_path, 'r+b')
+        if media_cache is not None:
+            # Not evicted while it is being streamed
+            media_cache.pin(self.data_path)
+
+    def has(self, index):
+        return bool(self._present[index >> 3] & (1 << (index & 7)))
+
+    @property
+    def complete(self):
+        return all(self.has(index) for index in range(self.chunks))
+
+    def read(self, index):
+        with self._lock:
+            self._file.seek(index * self.chunk_size)
+            return self._file.read(min(self.chunk_size, self.size - index * self.chunk_size))
+
+    def write(self, index, data):
+        """Store a chunk; the bitmap on disk catches up on sync() or close()."""
+        with self._lock:
+            self._file.seek(index * self.chunk_size)
+            self._file.write(data)
+            self._file.flush()
+            self._present[index >> 3] |= 1 << (index & 7)
+
+    def sync(self):
+        """Save the bitmap and account for the sparse file's grown size."""
+        with self._lock:
+            self._save_map()
+        if self.media_cache is not None:
+            self.media_cache.add_partial(self.data_path)
+
+    def _save_map(self):
+        # Written after the data, so a chunk marked present is always on disk
+        with open(self.map_path, 'wb') as f:
+            f.write(self._present)
+
+    def close(self):
+        """Release the cache; the last user closes the file, publishing it at path once every chunk is present."""
+        with _open_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            if _open_caches.get(self.path) is self:
+                del _open_caches[self.path]
+
+        with self._lock:
+            self._file.close()
+            complete = self.complete
+            if not complete:
+                self._save_map()
+            else:
+                try:
+                    if os.path.exists(self.path):
+                        os.remove(self.data_path)
+                    else:
+                        os.replace(self.data_path, self.path)
+                        metrics.incr("stream.files_completed")
+                    os.remove(self.map_path)
+                except FileNotFoundError:
+                    # Published or cleaned up by the other process
+                    pass
+
+        if self.media_cache is not None:
+            if complete:
+                self.media_cache.remove(self.data_path)
+                self.media_cache.add(self.path)
+            else:
+                self.media_cache.add_partial(self.data_path)
+            self.media_cache.unpin(self.data_path)
+
+
+async def iter_range(client, location, cache, start, end):
+    """Yield the bytes start..end (inclusive) of a stored location's file.
+
+    Cached chunks come from disk; each run of missing chunks is fetched with
+    one iter_download call on the chunk grid and written to the cache.
+    """
+    chunk_size = cache.chunk_size
+    dc_id, file_location = input_location(location)
+    started = time.monotonic()
+    sent_first_byte = False
+
+    def piece(index, data):
+        nonlocal sent_first_byte
+        if not sent_first_byte:
+            metrics.observe("stream.first_byte", time.monotonic() - started)
+            sent_first_byte = True
+        offset = index * chunk_size
+        return data[max(start - offset, 0):end - offset + 1]
+
+    index = start // chunk_size
+    last = end // chunk_size
+    while index <= last:
+        if cache.has(index):
+            metrics.incr("stream.chunks_cached")
+            yield piece(index, await asyncio.to_thread(cache.read, index))
+            index += 1
+            continue
+
+        run_end = index
+        while run_end < last and not cache.has(run_end + 1):
+            run_end += 1
+        async for chunk_index, data in _fetch(client, file_location, dc_id, cache, index, run_end):
+            yield piece(chunk_index, data)
+        index = run_end + 1
+
+
+async def _fetch(client, file_location, dc_id, cache, first, last):
+    """Download chunks first..last, writing each one to the cache as it arrives.
+
+    The bitmap is saved once the run is complete; close() saves what a cut-off
+    run wrote.
+    """
+    chunk_size = cache.chunk_size
+    index = first
+    async for data in client.iter_download(
+        file_location,
+        offset=first * chunk_size,
+        limit=last - first + 1,
+        chunk_size=chunk_size,
+        request_size=chunk_size,
+        file_size=cache.size,
+        dc_id=dc_id
+    ):
+        data = bytes(data)
+        await asyncio.to_thread(cache.write, index, data)
+        metrics.incr("stream.chunks_fetched")
+        yield index, data
+        index += 1
+    await asyncio.to_thread(cache.sync)
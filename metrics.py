@@ -0,0 +1,96 @@
+"""Lightweight in-process metrics shared by the bot and the website.
+
+Counters accumulate, observations keep a bounded window of recent samples so
+percentiles can be reported, and gauges hold the latest value (or a callable
+that is evaluated when a snapshot is taken).
+"""
+import threading
+from collections import defaultdict, deque
+
+# Number of recent samples kept per observed metric
+SAMPLE_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+_gauges = {}
+
+
+def incr(name, value=1):
+    """Increase a counter by value."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    """Record a sample (e.g. a delay in seconds) for percentile reporting."""
+    with _lock:
+        _samples[name].append(value)
+
+
+def gauge(name, value):
+    """Set a gauge to a value, or to a callable evaluated on snapshot."""
+    with _lock:
+        _gauges[name] = value
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile (0-100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def snapshot():
+    """Return a plain dict with all counters, gauges and sample summaries."""
+    with _lock:
+        counters = dict(_counters)
+        samples = {name: list(values) for name, values in _samples.items()}
+        gauges = dict(_gauges)
+
+    for name, value in gauges.items():
+        if callable(value):
+            try:
+                gauges[name] = value()
+            except Exception:
+                gauges[name] = None
+
+    summaries = {}
+    for name, values in samples.items():
+        summaries[name] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else 0.0,
+        }
+
+    return {'counters': counters, 'gauges': gauges, 'samples': summaries}
+
+
+def format_report(prefix=None):
+    """Format a snapshot as plain text, optionally filtered by name prefix."""
+    data = snapshot()
+    lines = []
+
+    for name, value in sorted(data['counters'].items()):
+        if prefix and not name.startswith(prefix):
+            continue
+        lines.append(f"{name}: {value:g}")
+
+    for name, value in sorted(data['gauges'].items()):
+        if prefix and not name.startswith(prefix):
+            continue
+        lines.append(f"{name}: {value}")
+
+    for name, summary in sorted(data['samples'].items()):
+        if prefix and not name.startswith(prefix):
+            continue
+        lines.append(
+            f"{name}: n={summary['count']} p50={summary['p50']:.3f} "
+            f"p95={summary['p95']:.3f} p99={summary['p99']:.3f} max={summary['max']:.3f}"
+        )
+
+    return "\n".join(lines) if lines else "No metrics recorded yet."
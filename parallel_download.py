@@ -0,0 +1,375 @@
+"""Parallel downloads of Telegram files over pooled connections to each media DC.
+
+FastTelethon's downloader opened a fixed number of connections per download
+(and exported the authorization again each time), photos went through a
+single connection, and an interrupted download started over. Downloads now
+borrow connections from a per-DC pool that stays connected between
+downloads, and a Tuner picks the number of parallel requests and the part
+size from what it measures:
+
+- part size doubles while upload.getFile requests come back quickly and
+  halves when they are slow, so each request carries a useful amount of data,
+- the connection count hill-climbs on throughput, measured every
+  TUNE_INTERVAL seconds: it keeps stepping the same way while throughput
+  rises and turns around when it drops (and halves on flood waits).
+
+The tuned settings live on the pool, so the next download from the same DC
+starts where the last one ended. A file that already holds part of the
+download is resumed after its last complete part; on failure the file is cut
+back to the parts that arrived in order, ready for the next attempt.
+"""
+import os
+import time
+import asyncio
+import inspect
+import logging
+from collections import namedtuple
+
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Most connections to one DC (shared by every download from it)
+DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', 8))
+
+# upload.getFile limits: parts divide 1MB and offsets are multiples of the part size
+MIN_PART_SIZE = 128 * 1024
+MAX_PART_SIZE = 1024 * 1024
+
+# Seconds between throughput measurements
+TUNE_INTERVAL = 1.0
+
+# Request durations (seconds) below/above which the part size grows/shrinks
+FAST_REQUEST = 0.25
+SLOW_REQUEST = 1.0
+
+# Throughput changes smaller than this fraction don't turn the tuner around
+TOLERANCE = 0.05
+
+# Seconds an unused pooled connection stays open
+SENDER_IDLE_TIMEOUT = 300
+
+# Attempts per part before the download fails
+PART_RETRIES = 3
+
+DownloadStats = namedtuple('DownloadStats', 'size seconds resumed_from connections part_size')
+
+
+def part_limit(offset, part_size):
+    """Largest valid request size up to part_size for a part starting at offset."""
+    limit = part_size
+    while offset % limit and limit > 4096:
+        limit //= 2
+    return limit
+
+
+def resume_offset(path, size):
+    """Offset to resume a download of size bytes into path from (0 if there's nothing to keep)."""
+    try:
+        existing = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    if existing >= size:
+        return size
+    return existing - existing % MIN_PART_SIZE
+
+
+class Tuner:
+    """Picks the connection count and part size for one DC from measured throughput."""
+
+    def __init__(self, max_connections=DOWNLOAD_CONNECTIONS, connections=4, part_size=512 * 1024):
+        self.max_connections = max_connections
+        self.connections = min(connections, max_connections)
+        self.part_size = part_size
+        self._direction = 1
+        self._last = None
+
+    def observe_request(self, seconds):
+        """Account for one upload.getFile request that took seconds."""
+        if seconds < FAST_REQUEST and self.part_size < MAX_PART_SIZE:
+            self.part_size *= 2
+        elif seconds > SLOW_REQUEST and self.part_size > MIN_PART_SIZE:
+            self.part_size //= 2
+
+    def observe_window(self, throughput):
+        """Account for the bytes per second of the last window and step the connection count."""
+        if self._last is not None and throughput < self._last * (1 - TOLERANCE):
+            # The last step made things worse, go the other way
+            self._direction = -self._direction
+        self._last = throughput
+        self.connections = min(max(self.connections + self._direction, 1), self.max_connections)
+
+    def penalize(self):
+        """Back off after a flood wait."""
+        self.connections = max(self.connections // 2, 1)
+        self._direction = -1
+        self._last = None
+
+
+class SenderPool:
+    """Connected, authorized senders to one DC, kept between downloads."""
+
+    def __init__(self, client, dc_id, max_senders=DOWNLOAD_CONNECTIONS, idle_timeout=SENDER_IDLE_TIMEOUT):
+        self.client = client
+        self.dc_id = dc_id
+        self.max_senders = max_senders
+        self.idle_timeout = idle_timeout
+        self.tuner = Tuner(max_senders)
+        # The home DC accepts the session's key; other DCs need an exported authorization
+        self._auth_key = client.session.auth_key if dc_id == client.session.dc_id else None
+        self._auth_lock = asyncio.Lock()
+        self._idle = []
+        self._open = 0
+        self._released = asyncio.Event()
+
+    async def acquire(self):
+        """Return an idle sender, a new one while under max_senders, or wait for one."""
+        self._close_idle()
+        while True:
+            while self._idle:
+                sender, _ = self._idle.pop()
+                if sender.is_connected():
+                    metrics.incr("downloads.senders_reused")
+                    return sender
+                self._open -= 1
+            if self._open < self.max_senders:
+                self._open += 1
+                try:
+                    return await self._connect()
+                except BaseException:
+                    self._open -= 1
+                    raise
+            self._released.clear()
+            await self._released.wait()
+
+    def release(self, sender, broken=False):
+        """Return a sender to the pool; a broken one is disconnected instead."""
+        if broken:
+            self._open -= 1
+            asyncio.ensure_future(sender.disconnect())
+        else:
+            self._idle.append((sender, time.monotonic()))
+        self._released.set()
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for item in [item for item in self._idle if now - item[1] > self.idle_timeout]:
+            self._idle.remove(item)
+            self._open -= 1
+            asyncio.ensure_future(item[0].disconnect())
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        self._open -= len(idle)
+        await asyncio.gather(*[sender.disconnect() for sender, _ in idle], return_exceptions=True)
+
+    async def _connect(self):
+        if self._auth_key is None:
+            async with self._auth_lock:
+                if self._auth_key is None:
+                    # Only the first connection imports an exported authorization, the rest share its key
+                    sender = await self._open_sender(None)
+                    try:
+                        auth = await self.client(ExportAuthorizationRequest(self.dc_id))
+                        self.client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                        await sender.send(InvokeWithLayerRequest(LAYER, self.client._init_request))
+                    except BaseException:
+                        await sender.disconnect()
+                        raise
+                    self._auth_key = sender.auth_key
+                    return sender
+        return await self._open_sender(self._auth_key)
+
+    async def _open_sender(self, auth_key):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=client._log,
+            proxy=client._proxy,
+            local_addr=client._local_addr
+        ))
+        metrics.incr("downloads.senders_created")
+        return sender
+
+
+class ParallelDownloader:
+    """Downloads files with a tuned number of parallel requests over pooled senders."""
+
+    def __init__(self, max_connections=DOWNLOAD_CONNECTIONS):
+        self.max_connections = max_connections
+        # (client, dc_id) -> SenderPool
+        self._pools = {}
+
+    def pool(self, client, dc_id):
+        pool = self._pools.get((client, dc_id))
+        if pool is None:
+            pool = SenderPool(client, dc_id, self.max_connections)
+            self._pools[(client, dc_id)] = pool
+        return pool
+
+    async def close(self):
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            await pool.close()
+
+    async def download(self, client, file_location, dc_id, size, path, progress_callback=None):
+        """Download a file to path, resuming after the bytes already in it.
+
+        Args:
+            client: Client of the account the file location belongs to
+            file_location: InputDocumentFileLocation or InputPhotoFileLocation
+            dc_id: DC the file is stored in
+            size: File size in bytes
+            path: File to write to
+            progress_callback: Called with (bytes downloaded, size), may be a coroutine
+
+        Returns:
+            DownloadStats of the download
+
+        Raises whatever upload.getFile raised (e.g. FileReferenceExpiredError);
+        the parts that arrived in order are kept in path.
+        """
+        pool = self.pool(client, dc_id)
+        tuner = pool.tuner
+        started = time.monotonic()
+        resumed_from = resume_offset(path, size)
+        if resumed_from:
+            logger.info(f"Resuming download of {path} at {resumed_from} of {size} bytes")
+            metrics.incr("downloads.resumed")
+            metrics.incr("downloads.resumed_bytes", resumed_from)
+
+        # Offset -> end of each part written; parts arrive out of order
+        completed = {}
+        retry = []
+        attempts = {}
+        next_offset = resumed_from
+        downloaded = resumed_from
+        active = 0
+        failure = None
+
+        def parts_left():
+            return len(retry) + -(-(size - next_offset) // tuner.part_size)
+
+        def take_part():
+            nonlocal next_offset
+            if retry:
+                return retry.pop()
+            if next_offset >= size:
+                return None
+            limit = part_limit(next_offset, tuner.part_size)
+            part = (next_offset, limit)
+            next_offset += limit
+            return part
+
+        async def report():
+            if progress_callback is not None:
+                result = progress_callback(downloaded, size)
+                if inspect.isawaitable(result):
+                    await result
+
+        async def worker(out):
+            nonlocal active, downloaded
+            sender = None
+            broken = False
+            try:
+                sender = await pool.acquire()
+                while failure is None and active <= tuner.connections:
+                    part = take_part()
+                    if part is None:
+                        break
+                    offset, limit = part
+                    request_started = time.monotonic()
+                    try:
+                        result = await client._call(sender, GetFileRequest(file_location, offset=offset, limit=limit))
+                    except FloodWaitError as e:
+                        retry.append(part)
+                        tuner.penalize()
+                        metrics.incr("downloads.flood_waits")
+                        await asyncio.sleep(e.seconds)
+                        continue
+                    except (ConnectionError, asyncio.TimeoutError):
+                        retry.append(part)
+                        attempts[offset] = attempts.get(offset, 0) + 1
+                        if attempts[offset] >= PART_RETRIES:
+                            raise
+                        # Replaced by a fresh connection from the pool
+                        broken = True
+                        metrics.incr("downloads.part_retries")
+                        return
+                    tuner.observe_request(time.monotonic() - request_started)
+
+                    data = result.bytes
+                    out.seek(offset)
+                    out.write(data)
+                    completed[offset] = offset + len(data)
+                    downloaded += len(data)
+                    await report()
+            finally:
+                active -= 1
+                if sender is not None:
+                    pool.release(sender, broken)
+
+        mode = 'r+b' if resumed_from else 'wb'
+        with open(path, mode) as out:
+            out.truncate(resumed_from)
+            tasks = set()
+            window_started, window_bytes = time.monotonic(), downloaded
+            try:
+                while True:
+                    while active < min(tuner.connections, parts_left()):
+                        active += 1
+                        tasks.add(asyncio.ensure_future(worker(out)))
+                    if not tasks:
+                        break
+                    done, tasks = await asyncio.wait(tasks, timeout=TUNE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                    errors = [task.exception() for task in done if task.exception() is not None]
+                    if errors:
+                        failure = errors[0]
+                        raise failure
+
+                    now = time.monotonic()
+                    if now - window_started >= TUNE_INTERVAL:
+                        tuner.observe_window((downloaded - window_bytes) / (now - window_started))
+                        window_started, window_bytes = now, downloaded
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                # Keep what arrived in order, so the next attempt resumes after it
+                end = resumed_from
+                while end in completed:
+                    end = completed[end]
+                out.truncate(end)
+                raise
+
+        if downloaded < size:
+            raise ConnectionError(f"Download of {path} ended after {downloaded} of {size} bytes")
+
+        seconds = time.monotonic() - started
+        stats = DownloadStats(size, seconds, resumed_from, tuner.connections, tuner.part_size)
+        throughput = (size - resumed_from) / seconds if seconds else 0.0
+        metrics.observe("downloads.throughput", throughput)
+        metrics.observe(f"downloads.dc{dc_id}.throughput", throughput)
+        metrics.observe("downloads.connections", tuner.connections)
+        metrics.observe("downloads.part_size", tuner.part_size)
+        logger.info(
+            f"Downloaded {size - resumed_from} bytes from DC {dc_id} in {seconds:.1f}s "
+            f"({throughput / 1024 / 1024:.2f} MB/s, {tuner.connections} connections, "
+            f"{tuner.part_size // 1024}KB parts)"
+        )
+        return stats
+
+
+# Shared by every download in the process, so pools and tuning carry over
+downloader = ParallelDownloader()
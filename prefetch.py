@@ -0,0 +1,185 @@
+"""Speculative downloads of the files a user is likely to ask for next.
+
+After a search, users usually open one of the first few results, and then
+wait for the whole download. With PREFETCH=1 the bot starts downloading the
+top results (and the file being viewed) into the shared media cache in the
+background, at backfill priority, so the download button often finds the
+file already there.
+
+Speculation is kept within budgets: files above PREFETCH_MAX_FILE_BYTES are
+skipped, at most PREFETCH_BYTES_PER_MINUTE are started per minute, and
+prefetched files nobody has asked for yet may take up at most
+PREFETCH_DISK_BYTES of the cache. A user's earlier speculation is cancelled
+as soon as they move on (a new search, or viewing one particular file);
+the bytes already downloaded are kept for resuming.
+
+prefetch.hits / prefetch.completed (the prefetch.hit_ratio gauge) shows how
+much of the speculative work is used, prefetch.wasted how much was evicted
+unused.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+import metrics
+from scheduler import INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv('PREFETCH', '0') == '1'
+
+# Number of top search results fetched ahead
+PREFETCH_TOP = int(os.getenv('PREFETCH_TOP', 3))
+
+PREFETCH_MAX_FILE_BYTES = int(os.getenv('PREFETCH_MAX_FILE_BYTES', 50 * 1024 * 1024))
+PREFETCH_BYTES_PER_MINUTE = int(os.getenv('PREFETCH_BYTES_PER_MINUTE', 200 * 1024 * 1024))
+PREFETCH_DISK_BYTES = int(os.getenv('PREFETCH_DISK_BYTES', 512 * 1024 * 1024))
+
+
+class Prefetcher:
+    """Fetches candidate files into the media cache ahead of requests, within budgets."""
+
+    def __init__(self, manager, cache, scheduler=None, enabled=PREFETCH_ENABLED,
+                 max_file_bytes=PREFETCH_MAX_FILE_BYTES, bytes_per_minute=PREFETCH_BYTES_PER_MINUTE,
+                 disk_bytes=PREFETCH_DISK_BYTES):
+        """
+        Args:
+            manager: DownloadManager the files are fetched through
+            cache: MediaCache the files land in
+            scheduler: WorkScheduler whose ticket tagged with a file's path is
+                promoted to INTERACTIVE when a user asks for the file
+            enabled: With False, prefetch() does nothing
+            max_file_bytes: Larger files are never prefetched
+            bytes_per_minute: Most bytes of prefetches started per minute
+            disk_bytes: Most bytes of prefetched files not requested yet
+        """
+        self.manager = manager
+        self.cache = cache
+        self.scheduler = scheduler
+        self.enabled = enabled
+        self.max_file_bytes = max_file_bytes
+        self.bytes_per_minute = bytes_per_minute
+        self.disk_bytes = disk_bytes
+        # Owner -> {key: task} of speculative fetches
+        self._tasks = {}
+        # Path -> size of prefetched files nobody has asked for yet
+        self._unused = {}
+        # (started at, size) of prefetches started in the last minute
+        self._started = deque()
+        self._in_flight = set()
+        # In-flight paths a user asked for before they completed
+        self._claimed = set()
+        self.completed = 0
+        self.hits = 0
+
+        metrics.gauge("prefetch.hit_ratio", self.hit_ratio)
+        metrics.gauge("prefetch.unused_bytes", lambda: sum(self._unused.values()))
+
+    def hit_ratio(self):
+        """Share of completed prefetches that a user went on to request."""
+        return self.hits / self.completed if self.completed else 0.0
+
+    def prefetch(self, owner, candidates):
+        """Start fetching candidates for owner, cancelling owner's other speculation.
+
+        Args:
+            owner: Whose speculation this is (e.g. the user id)
+            candidates: (key, path, size, download) tuples, most likely first;
+                download is the coroutine function DownloadManager.fetch calls
+        """
+        if not self.enabled:
+            return
+        previous = self._tasks.pop(owner, {})
+        tasks = {}
+        for key, path, size, download in candidates:
+            # Still wanted: keep it running rather than cancel and restart it
+            task = previous.pop(key, None)
+            if task is not None and not task.done():
+                tasks[key] = task
+                continue
+            if path in self._unused or path in self._in_flight or os.path.exists(path):
+                continue
+            if not self._admit(size):
+                metrics.incr("prefetch.skipped")
+                continue
+            tasks[key] = asyncio.ensure_future(self._fetch(key, path, size, download))
+
+        # The user moved on from these
+        for task in previous.values():
+            if not task.done():
+                task.cancel()
+        if tasks:
+            self._tasks[owner] = tasks
+
+    def cancel(self, owner):
+        for task in self._tasks.pop(owner, {}).values():
+            if not task.done():
+                task.cancel()
+
+    def claim(self, path):
+        """Record that a user asked for path. Returns True if it was prefetched."""
+        if self._unused.pop(path, None) is not None:
+            self.hits += 1
+            metrics.incr("prefetch.hits")
+            return True
+        if path in self._in_flight:
+            # Joins the running download instead of starting its own, which stops
+            # waiting behind indexing (downloads starting later check requested())
+            self._claimed.add(path)
+            if self.scheduler is not None:
+                self.scheduler.promote(path, INTERACTIVE)
+            metrics.incr("prefetch.partial_hits")
+            return True
+        metrics.incr("prefetch.misses")
+        return False
+
+    def requested(self, path):
+        """Whether a user asked for path while it was being prefetched."""
+        return path in self._claimed
+
+    def _admit(self, size):
+        if not size or size > self.max_file_bytes:
+            return False
+
+        now = time.monotonic()
+        while self._started and now - self._started[0][0] > 60:
+            self._started.popleft()
+        if sum(started for _, started in self._started) + size > self.bytes_per_minute:
+            return False
+
+        # Prefetched files evicted before anyone asked for them
+        for path in [path for path in self._unused if path not in self.cache]:
+            del self._unused[path]
+            metrics.incr("prefetch.wasted")
+        if sum(self._unused.values()) + size > self.disk_bytes:
+            return False
+
+        self._started.append((now, size))
+        return True
+
+    async def _fetch(self, key, path, size, download):
+        metrics.incr("prefetch.started")
+        self._in_flight.add(path)
+        try:
+            await self.manager.fetch(key, path, download, speculative=True)
+        except asyncio.CancelledError:
+            self._claimed.discard(path)
+            metrics.incr("prefetch.cancelled")
+            raise
+        except Exception as e:
+            self._claimed.discard(path)
+            logger.debug(f"Prefetch of {key} failed: {e}")
+            metrics.incr("prefetch.failed")
+            return
+        finally:
+            self._in_flight.discard(path)
+        self.manager.release(path)
+        self.completed += 1
+        metrics.incr("prefetch.completed")
+        if path in self._claimed:
+            self._claimed.discard(path)
+            self.hits += 1
+        else:
+            self._unused[path] = size
@@ -0,0 +1,227 @@
+"""Shared MTProto request rate limiting for the bot and the website.
+
+Both processes use the same Telegram account, so the token buckets live in a
+small SQLite file that every process updates inside an exclusive transaction.
+A caller reserves a token up front and then sleeps for its share of the wait,
+which keeps the combined request rate under the limits without busy polling.
+The async methods run the SQLite transactions in worker threads, so a
+lock held by the other process never stalls the event loop.
+Flood waits reported by Telegram are written to the same file so that the
+other process backs off as well. Additional accounts (see client_pool.py) use
+a namespace so each account has its own buckets in the same file.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from telethon.errors import FloodWaitError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DB = os.getenv(
+    'RATE_LIMIT_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_limits.db')
+)
+
+# Requests per second and burst size for each wrapped method
+DEFAULT_LIMITS = {
+    'get_entity': (0.5, 5),     # ResolveUsername has the strictest flood limits
+    'get_messages': (3.0, 10),
+    'iter_messages': (1.0, 5),  # One token per history page (100 messages)
+    'download': (2.0, 4),
+}
+
+# iter_messages fetches history in pages of this many messages
+HISTORY_PAGE_SIZE = 100
+
+
+class RateLimiter:
+    """Token buckets per method, coordinated across processes through SQLite."""
+
+    def __init__(self, path=RATE_LIMIT_DB, limits=None, namespace=None):
+        self.path = path
+        self.namespace = namespace
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " method TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " blocked_until REAL NOT NULL DEFAULT 0)"
+        )
+
+    def _key(self, method):
+        # The primary account keeps the plain method names shared with the website
+        return f"{self.namespace}:{method}" if self.namespace else method
+
+    def estimate(self, method):
+        """Return how long a request for method would wait right now, without taking a token."""
+        rate, burst = self.limits.get(method, (1.0, 1))
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT tokens, updated, blocked_until FROM buckets WHERE method = ?",
+            (self._key(method),)
+        ).fetchone()
+        if row is None:
+            return 0.0
+
+        tokens, updated, blocked_until = row
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+        return max(wait, blocked_until - now)
+
+    def reserve(self, method):
+        """Take one token for method and return how long the caller must wait.
+
+        The token is taken even if the bucket is empty (the balance goes
+        negative), so concurrent callers queue up behind each other instead
+        of all waking up at the same time.
+        """
+        rate, burst = self.limits.get(method, (1.0, 1))
+        conn = self._connect()
+        now = time.time()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated, blocked_until FROM buckets WHERE method = ?",
+                (self._key(method),)
+            ).fetchone()
+
+            if row is None:
+                tokens, updated, blocked_until = float(burst), now, 0.0
+            else:
+                tokens, updated, blocked_until = row
+
+            # Refill for the time elapsed since the last update
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            tokens -= 1
+            wait = 0.0 if tokens >= 0 else -tokens / rate
+
+            # A flood wait reported by either process overrides the bucket
+            if blocked_until > now:
+                wait = max(wait, blocked_until - now)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (method, tokens, updated, blocked_until) "
+                "VALUES (?, ?, ?, ?)",
+                (self._key(method), tokens, now, blocked_until)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return wait
+
+    def block(self, method, seconds):
+        """Record a flood wait so every process pauses this method."""
+        until = time.time() + seconds
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _, burst = self.limits.get(method, (1.0, 1))
+            conn.execute(
+                "INSERT INTO buckets (method, tokens, updated, blocked_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(method) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                (self._key(method), float(burst), time.time(), until)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        metrics.incr(f"ratelimit.{method}.flood_waits")
+        logger.warning(f"Flood wait of {seconds}s recorded for {method}")
+
+    def _record(self, method, wait):
+        metrics.incr(f"ratelimit.{method}.calls")
+        if wait > 0:
+            metrics.incr(f"ratelimit.{method}.throttled")
+            metrics.incr(f"ratelimit.{method}.delay_seconds", wait)
+            metrics.observe(f"ratelimit.{method}.delay", wait)
+
+    async def acquire(self, method):
+        """Wait (asynchronously) until a request for method may be sent."""
+        wait = await asyncio.to_thread(self.reserve, method)
+        self._record(method, wait)
+        if wait > 0:
+            logger.debug(f"Throttling {method} for {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, method):
+        """Blocking variant of acquire for synchronous callers."""
+        wait = self.reserve(method)
+        self._record(method, wait)
+        if wait > 0:
+            logger.debug(f"Throttling {method} for {wait:.2f}s")
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """Wrap a TelegramClient so its heavy request methods go through a RateLimiter.
+
+    Every other attribute is passed through to the wrapped client, so the
+    wrapper can be used anywhere the client was used before.
+    """
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def _limited(self, method, func, *args, **kwargs):
+        await self.limiter.acquire(method)
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            await asyncio.to_thread(self.limiter.block, method, e.seconds)
+            raise
+
+    async def get_entity(self, *args, **kwargs):
+        return await self._limited('get_entity', self.client.get_entity, *args, **kwargs)
+
+    async def get_messages(self, *args, **kwargs):
+        return await self._limited('get_messages', self.client.get_messages, *args, **kwargs)
+
+    async def download_media(self, *args, **kwargs):
+        return await self._limited('download', self.client.download_media, *args, **kwargs)
+
+    async def download_file(self, *args, **kwargs):
+        return await self._limited('download', self.client.download_file, *args, **kwargs)
+
+    async def iter_messages(self, *args, **kwargs):
+        """Async generator over iter_messages taking one token per history page."""
+        count = 0
+        await self.limiter.acquire('iter_messages')
+        try:
+            async for message in self.client.iter_messages(*args, **kwargs):
+                count += 1
+                if count % HISTORY_PAGE_SIZE == 0:
+                    await self.limiter.acquire('iter_messages')
+                yield message
+        except FloodWaitError as e:
+            await asyncio.to_thread(self.limiter.block, 'iter_messages', e.seconds)
+            raise
@@ -0,0 +1,123 @@
+"""In-memory routing table from monitored chats to subscribed users.
+
+Every NewMessage update from every chat the account is in reaches the bot,
+but only a few chats are connected as sources. The routing table answers
+"who is subscribed to this chat?" from the event's chat_id alone, so updates
+from unmonitored chats are dropped without a network or database call.
+"""
+import logging
+import threading
+
+from telethon import utils
+from telethon.tl.types import PeerChat
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingTable:
+    """Maps a chat's marked peer id to {user_id: source_id} of its subscribers."""
+
+    def __init__(self):
+        self._routes = {}
+        self._titles = {}
+        self._by_source = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, peer_id, user_id, source_id, title=None):
+        """Subscribe user_id to the chat with this peer id."""
+        source_id = str(source_id)
+        with self._lock:
+            self._routes.setdefault(peer_id, {})[user_id] = source_id
+            if title:
+                self._titles[peer_id] = title
+            self._by_source[source_id] = (peer_id, user_id)
+        metrics.gauge("routing.monitored_chats", len(self._routes))
+
+    def remove_source(self, source_id):
+        """Drop the subscription created by a source document."""
+        with self._lock:
+            route = self._by_source.pop(str(source_id), None)
+            if route is None:
+                return
+            peer_id, user_id = route
+            users = self._routes.get(peer_id, {})
+            users.pop(user_id, None)
+            if not users:
+                self._routes.pop(peer_id, None)
+                self._titles.pop(peer_id, None)
+        metrics.gauge("routing.monitored_chats", len(self._routes))
+
+    def chats(self):
+        """Peer ids of all monitored chats."""
+        return list(self._routes)
+
+    def lookup(self, peer_id):
+        """Return {user_id: source_id} for a chat, or None if nobody monitors it."""
+        users = self._routes.get(peer_id)
+        if not users:
+            metrics.incr("routing.dropped")
+            return None
+        metrics.incr("routing.routed")
+        return dict(users)
+
+    def basic_group_ids(self):
+        """Bare ids of monitored basic groups (their deletions don't carry a chat id)."""
+        group_ids = []
+        for peer_id in list(self._routes):
+            bare_id, peer_type = utils.resolve_id(peer_id)
+            if peer_type is PeerChat:
+                group_ids.append(bare_id)
+        return group_ids
+
+    def title(self, peer_id, default=None):
+        return self._titles.get(peer_id, default)
+
+    def load(self, sources, entity_cache=None):
+        """Fill the table from source documents.
+
+        Sources that already store their chat_id are added directly, others
+        are looked up in the entity cache (without touching the network).
+        Returns the sources that still need to be resolved.
+        """
+        unresolved = []
+        for source in sources:
+            peer_id = source.get('chat_id')
+            title = source.get('chat_title')
+
+            if peer_id is None and entity_cache is not None:
+                cached = entity_cache.get(source.get('source_name', ''))
+                if cached is not None:
+                    peer_id, title = cached.peer_id, cached.title
+
+            if peer_id is None:
+                unresolved.append(source)
+                continue
+
+            self.add(peer_id, source['user_id'], source['_id'], title)
+
+        logger.info(f"Routing table loaded: {len(self)} chats, {len(unresolved)} sources unresolved")
+        return unresolved
+
+    def watch(self, collection):
+        """Follow a MongoDB change stream on the sources collection (blocking).
+
+        Change streams need a replica set; on a standalone server this logs
+        and returns, and the table is kept current by the bot's own updates.
+        """
+        try:
+            with collection.watch(full_document='updateLookup') as stream:
+                for change in stream:
+                    operation = change.get('operationType')
+                    if operation == 'delete':
+                        self.remove_source(change['documentKey']['_id'])
+                    elif operation in ('insert', 'update', 'replace'):
+                        source = change.get('fullDocument') or {}
+                        if source.get('chat_id') is not None:
+                            self.add(source['chat_id'], source['user_id'], source['_id'], source.get('chat_title'))
+        except Exception as e:
+            logger.info(f"Sources change stream unavailable ({e}), relying on in-process updates")
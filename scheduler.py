@@ -0,0 +1,235 @@
+"""Priority scheduler for work that shares the Telegram connections and MongoDB.
+
+Downloads, live updates, first-time indexing of a new source and reindex
+backfills all go through the same user client and database. Without any
+ordering, a large backfill delays new posts becoming searchable and makes a
+user wait minutes for a download. Work now takes a slot from the scheduler
+first. Free slots go to the highest priority class, and within a class
+round-robin over users so one user's reindex-all can't hold back everyone
+else's. Waiters are promoted one class for every `aging` seconds they wait,
+so backfill still makes progress under sustained live traffic, and the
+background classes may not fill every slot, keeping room for interactive
+work.
+
+Long running work should call checkpoint() between units (e.g. history
+pages) so it hands its slot over when something more urgent is waiting.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+INTERACTIVE = 0
+LIVE = 1
+CONNECT = 2
+BACKFILL = 3
+
+CLASS_NAMES = {
+    INTERACTIVE: 'interactive',
+    LIVE: 'live',
+    CONNECT: 'connect',
+    BACKFILL: 'backfill',
+}
+
+
+class Ticket:
+    """A granted (or pending) slot."""
+
+    def __init__(self, priority, user_id, tag=None):
+        self.priority = priority
+        self.user_id = user_id
+        self.tag = tag
+        self.enqueued_at = time.monotonic()
+        self.future = None
+        self.released = False
+
+
+class WorkScheduler:
+    """Hands out a fixed number of slots by priority class with per-user fairness."""
+
+    def __init__(self, slots=4, aging=30.0, reserved=1):
+        """
+        Args:
+            slots: Number of pieces of work allowed to run at once
+            aging: Seconds of waiting that promote a waiter by one class
+            reserved: Slots the connect and backfill classes may never take
+        """
+        self.slots = max(1, slots)
+        self.aging = aging
+        background_limit = max(1, self.slots - reserved)
+        self.limits = {
+            INTERACTIVE: self.slots,
+            LIVE: self.slots,
+            CONNECT: background_limit,
+            BACKFILL: background_limit,
+        }
+        self.running = {priority: 0 for priority in CLASS_NAMES}
+        # Per class: user_id -> deque of waiting tickets, in round-robin order
+        self._queues = {priority: OrderedDict() for priority in CLASS_NAMES}
+        # Tag -> waiting or running ticket, for promote()
+        self._tagged = {}
+
+        for priority, name in CLASS_NAMES.items():
+            metrics.gauge(f"scheduler.{name}.queued", lambda priority=priority: self.queued(priority))
+            metrics.gauge(f"scheduler.{name}.running", lambda priority=priority: self.running[priority])
+
+    def queued(self, priority=None):
+        """Number of waiting tickets in one class (or in all of them)."""
+        classes = [priority] if priority is not None else list(CLASS_NAMES)
+        return sum(len(waiters) for c in classes for waiters in self._queues[c].values())
+
+    @property
+    def in_use(self):
+        return sum(self.running.values())
+
+    def _effective_priority(self, ticket, now):
+        if not self.aging:
+            return ticket.priority
+        return max(INTERACTIVE, ticket.priority - int((now - ticket.enqueued_at) / self.aging))
+
+    def _next_waiter(self):
+        """The ticket that gets the next free slot, or None."""
+        now = time.monotonic()
+        best = None
+        best_key = None
+        for priority, users in self._queues.items():
+            if not users or self.running[priority] >= self.limits[priority]:
+                continue
+            # Head of the user whose turn it is in this class
+            ticket = next(iter(users.values()))[0]
+            key = (self._effective_priority(ticket, now), priority, ticket.enqueued_at)
+            if best_key is None or key < best_key:
+                best, best_key = ticket, key
+        return best
+
+    def _remove(self, ticket):
+        users = self._queues[ticket.priority]
+        waiters = users.get(ticket.user_id)
+        if waiters is None or ticket not in waiters:
+            return
+        waiters.remove(ticket)
+        if not waiters:
+            del users[ticket.user_id]
+
+    def _grant(self, ticket):
+        self.running[ticket.priority] += 1
+        name = CLASS_NAMES[ticket.priority]
+        metrics.observe(f"scheduler.{name}.queue_wait", time.monotonic() - ticket.enqueued_at)
+        metrics.incr(f"scheduler.{name}.granted")
+
+    def _dispatch(self):
+        while self.in_use < self.slots:
+            ticket = self._next_waiter()
+            if ticket is None:
+                return
+            users = self._queues[ticket.priority]
+            waiters = users[ticket.user_id]
+            waiters.popleft()
+            # The user goes to the back of the class' round-robin
+            if waiters:
+                users.move_to_end(ticket.user_id)
+            else:
+                del users[ticket.user_id]
+
+            if ticket.priority > self._effective_priority(ticket, time.monotonic()):
+                metrics.incr(f"scheduler.{CLASS_NAMES[ticket.priority]}.aged")
+            self._grant(ticket)
+            ticket.future.set_result(ticket)
+
+    async def acquire(self, priority, user_id=None, tag=None):
+        """Wait for a slot; call release(ticket) when the work is done.
+
+        A tag (e.g. the file a download writes) lets promote() find the ticket.
+        """
+        ticket = Ticket(priority, user_id, tag)
+        if tag is not None:
+            self._tagged[tag] = ticket
+        if (
+            self.in_use < self.slots
+            and self.running[priority] < self.limits[priority]
+            and self._next_waiter() is None
+        ):
+            self._grant(ticket)
+            return ticket
+
+        ticket.future = asyncio.get_event_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(ticket)
+        try:
+            return await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Granted just as the caller was cancelled
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+                self._untag(ticket)
+            raise
+
+    def _untag(self, ticket):
+        if ticket.tag is not None and self._tagged.get(ticket.tag) is ticket:
+            del self._tagged[ticket.tag]
+
+    def promote(self, tag, priority):
+        """Move the waiting or running ticket with this tag up to priority.
+
+        For work that turns out to be more urgent than it was queued as (e.g.
+        a prefetch a user has just asked for). Returns True if a ticket moved.
+        """
+        ticket = self._tagged.get(tag)
+        if ticket is None or ticket.priority <= priority:
+            return False
+        if ticket.future is not None and not ticket.future.done():
+            # Still waiting: requeue it in the more urgent class
+            self._remove(ticket)
+            ticket.priority = priority
+            self._queues[priority].setdefault(ticket.user_id, deque()).append(ticket)
+        else:
+            self.running[ticket.priority] = max(0, self.running[ticket.priority] - 1)
+            ticket.priority = priority
+            self.running[priority] += 1
+        metrics.incr(f"scheduler.{CLASS_NAMES[priority]}.promoted")
+        self._dispatch()
+        return True
+
+    def release(self, ticket):
+        # A ticket handed over by a checkpoint that was then cancelled is released again by its owner
+        if ticket.released:
+            return
+        ticket.released = True
+        self._untag(ticket)
+        self.running[ticket.priority] = max(0, self.running[ticket.priority] - 1)
+        self._dispatch()
+
+    async def checkpoint(self, ticket):
+        """Hand the slot over if more urgent (or aged) work is waiting.
+
+        Returns the ticket to keep using, which is a new one if the slot was
+        given up and acquired again.
+        """
+        waiter = self._next_waiter()
+        if waiter is None:
+            return ticket
+        effective = self._effective_priority(waiter, time.monotonic())
+        if effective > ticket.priority:
+            return ticket
+        if effective == ticket.priority and waiter.user_id == ticket.user_id:
+            # Only this user's own work of the same class is waiting
+            return ticket
+
+        metrics.incr(f"scheduler.{CLASS_NAMES[ticket.priority]}.yields")
+        self.release(ticket)
+        return await self.acquire(ticket.priority, ticket.user_id, ticket.tag)
+
+    @asynccontextmanager
+    async def slot(self, priority, user_id=None):
+        ticket = await self.acquire(priority, user_id)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
@@ -0,0 +1,152 @@
+"""Pool of per-user Telegram clients with LRU reuse.
+
+Creating a TelegramClient for sessions/{user_id}, connecting it and
+disconnecting it again for every operation costs a fresh MTProto handshake
+and session file I/O each time. The pool keeps a user's client connected
+between operations, disconnects clients that have been idle for too long and
+caps the number of open connections, evicting the least recently used idle
+client when a new one is needed.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.connect_lock = asyncio.Lock()
+
+
+class UserClientPool:
+    """Connected clients keyed by user id, most recently used last."""
+
+    def __init__(self, factory, max_connected=20, idle_timeout=600.0):
+        """
+        Args:
+            factory: Callable(user_id) returning a new (unconnected) client
+            max_connected: Maximum number of clients kept connected at once
+            idle_timeout: Seconds after which an unused client is disconnected
+        """
+        self.factory = factory
+        self.max_connected = max_connected
+        self.idle_timeout = idle_timeout
+        self._clients = OrderedDict()
+        self._condition = None
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _get_condition(self):
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, user_id):
+        """Return a connected client for user_id; call release(user_id) when done.
+
+        Waits if max_connected clients are all in use.
+        """
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                entry = self._clients.get(user_id)
+                if entry is not None:
+                    self._clients.move_to_end(user_id)
+                    metrics.incr("user_clients.hits")
+                    break
+                if len(self._clients) < self.max_connected or await self._evict_idle():
+                    entry = _PooledClient(self.factory(user_id))
+                    self._clients[user_id] = entry
+                    metrics.incr("user_clients.misses")
+                    metrics.gauge("user_clients.connected", len(self._clients))
+                    break
+                metrics.incr("user_clients.waits")
+                await condition.wait()
+            entry.in_use += 1
+
+        # Concurrent first uses of the same client must not connect it twice
+        async with entry.connect_lock:
+            if not entry.client.is_connected():
+                try:
+                    await entry.client.connect()
+                except Exception:
+                    await self.discard(user_id)
+                    raise
+        return entry.client
+
+    def release(self, user_id):
+        entry = self._clients.get(user_id)
+        if entry is None or entry.in_use == 0:
+            return
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+        if entry.in_use == 0 and self._condition is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify()
+
+    async def _evict_idle(self):
+        """Disconnect the least recently used idle client; False if all are in use."""
+        for user_id, entry in self._clients.items():
+            if entry.in_use == 0:
+                del self._clients[user_id]
+                metrics.incr("user_clients.evictions")
+                await self._disconnect(user_id, entry)
+                return True
+        return False
+
+    async def discard(self, user_id):
+        """Drop a user's client (e.g. after the session was revoked)."""
+        entry = self._clients.pop(user_id, None)
+        if entry is not None:
+            await self._disconnect(user_id, entry)
+            if self._condition is not None:
+                await self._notify()
+
+    async def _disconnect(self, user_id, entry):
+        metrics.gauge("user_clients.connected", len(self._clients))
+        try:
+            await entry.client.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting client for user {user_id}: {e}")
+
+    async def close_idle(self):
+        """Disconnect every client that has been unused for longer than idle_timeout."""
+        now = time.monotonic()
+        idle = [
+            user_id for user_id, entry in self._clients.items()
+            if entry.in_use == 0 and now - entry.last_used > self.idle_timeout
+        ]
+        for user_id in idle:
+            logger.info(f"Disconnecting idle client for user {user_id}")
+            await self.discard(user_id)
+        return len(idle)
+
+    def start(self):
+        """Start the background task that closes idle clients."""
+        async def reap():
+            while True:
+                await asyncio.sleep(max(self.idle_timeout / 2, 1))
+                await self.close_idle()
+
+        self._reaper = asyncio.ensure_future(reap())
+
+    async def close(self):
+        """Disconnect every client (call on shutdown)."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for user_id in list(self._clients):
+            await self.discard(user_id)
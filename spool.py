@@ -0,0 +1,153 @@
+"""Local write-ahead spool and circuit breaker for index writes.
+
+When MongoDB is down or too slow, index writes are appended to a small SQLite
+file instead of being dropped, and are replayed in bulk, in their original
+order, once the database is reachable again. The circuit breaker stops
+callers from waiting on server-selection timeouts while the database is known
+to be unavailable.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+import bson
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DB = os.getenv(
+    'SPOOL_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index_spool.db')
+)
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Opens after repeated failures and lets one trial call through after a timeout."""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.state} -> {state}")
+        self.state = state
+        metrics.incr(f"breaker.{state}")
+        if self.on_state_change is not None:
+            self.on_state_change(state)
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._set_state(CLOSED)
+
+    def trip(self):
+        """Open the breaker right away (e.g. the database is down at startup)."""
+        with self._lock:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class WriteSpool:
+    """Append-only queue of write operations stored in SQLite.
+
+    Operations are plain dicts (see batching.build_operation) encoded as BSON,
+    so datetimes and ObjectIds survive the round trip.
+    """
+
+    def __init__(self, path=SPOOL_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload BLOB NOT NULL)"
+        )
+        self._depth = conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        metrics.gauge("spool.depth", lambda: self._depth)
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._depth
+
+    def append(self, operations):
+        """Durably append operations (in order) to the spool."""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO spool (payload) VALUES (?)",
+            [(bson.encode(operation),) for operation in operations]
+        )
+        conn.execute("COMMIT")
+        self._depth += len(operations)
+        metrics.incr("spool.appended", len(operations))
+
+    def peek(self, limit=500):
+        """Return up to limit of the oldest operations as (id, operation) pairs."""
+        rows = self._connect().execute(
+            "SELECT id, payload FROM spool ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+        return [(row_id, bson.decode(payload)) for row_id, payload in rows]
+
+    def remove_through(self, last_id):
+        """Delete every operation up to and including last_id."""
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,)).rowcount
+        self._depth = max(0, self._depth - removed)
+        metrics.incr("spool.replayed", removed)
+
+    def replay(self, write, batch_size=500):
+        """Replay spooled operations in order through write(operations) until empty.
+
+        Stops and re-raises on the first failed batch, leaving it spooled.
+        Returns the number of replayed operations.
+        """
+        replayed = 0
+        while True:
+            rows = self.peek(batch_size)
+            if not rows:
+                return replayed
+            write([operation for _, operation in rows])
+            self.remove_through(rows[-1][0])
+            replayed += len(rows)
+            logger.info(f"Replayed {len(rows)} spooled writes ({len(self)} left)")
@@ -0,0 +1,114 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+
+def _get(doc, path):
+    for part in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _matches_field(actual, expected):
+    if not isinstance(expected, dict) or not any(key.startswith('$') for key in expected):
+        return actual == expected
+    operators = {
+        '$in': lambda values: actual in values,
+        '$gt': lambda value: actual is not None and actual > value,
+        '$gte': lambda value: actual is not None and actual >= value,
+        '$lt': lambda value: actual is not None and actual < value,
+    }
+    return all(operators[op](value) for op, value in expected.items())
+
+
+def matches(doc, query):
+    return all(_matches_field(_get(doc, field), value) for field, value in query.items())
+
+
+class FakeCollection:
+    """In-memory stand-in for the parts of a pymongo collection the indexer uses.
+
+    Queries support dotted fields, equality, $in, $gt, $gte and $lt; updates
+    support $set, $setOnInsert and $unset with upserts. Every call is recorded
+    in calls, and every bulk_write's operations in batches.
+    """
+
+    def __init__(self, docs=()):
+        self._ids = itertools.count(1)
+        self.docs = []
+        self.calls = []
+        self.batches = []
+        for doc in docs:
+            self._insert(dict(doc))
+
+    def _insert(self, doc):
+        doc.setdefault('_id', next(self._ids))
+        self.docs.append(doc)
+        return doc
+
+    def _apply(self, query, update, many=False, upsert=False):
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            doc.update(update.get('$set', {}))
+            for field in update.get('$unset', {}):
+                doc.pop(field, None)
+        if matched or not upsert:
+            return SimpleNamespace(matched_count=len(matched), upserted_id=None)
+
+        doc = {field: value for field, value in query.items() if not isinstance(value, dict)}
+        doc.update(update.get('$setOnInsert', {}))
+        doc.update(update.get('$set', {}))
+        return SimpleNamespace(matched_count=0, upserted_id=self._insert(doc)['_id'])
+
+    def create_index(self, keys, **kwargs):
+        pass
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def find(self, query=None, projection=None):
+        self.calls.append(('find', query))
+        return [dict(doc) for doc in self.docs if matches(doc, query or {})]
+
+    def find_one(self, query):
+        self.calls.append(('find_one', query))
+        for doc in self.docs:
+            if matches(doc, query):
+                return dict(doc)
+        return None
+
+    def update_one(self, query, update, upsert=False):
+        self.calls.append(('update_one', query, update))
+        return self._apply(query, update, upsert=upsert)
+
+    def update_many(self, query, update, upsert=False):
+        self.calls.append(('update_many', query, update))
+        return self._apply(query, update, many=True, upsert=upsert)
+
+    def delete_one(self, query):
+        self.calls.append(('delete_one', query))
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls.append(('bulk_write', operations))
+        self.batches.append(operations)
+        upserted = 0
+        for operation in operations:
+            many = type(operation).__name__ == 'UpdateMany'
+            result = self._apply(operation._filter, operation._doc, many=many, upsert=operation._upsert)
+            upserted += result.upserted_id is not None
+        return SimpleNamespace(upserted_count=upserted)
+
+
+@pytest.fixture
+def make_collection():
+    """Factory for FakeCollections, optionally holding some documents already."""
+    return FakeCollection
@@ -0,0 +1,74 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timezone
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import IndexBatcher, AlbumBuffer
+from scheduler import WorkScheduler, INTERACTIVE, LIVE
+
+
+def test_flushes_by_size_and_on_stop(make_collection):
+    """A full buffer is written at once, the remainder on stop()."""
+    collection = make_collection()
+
+    async def run():
+        batcher = IndexBatcher(collection, max_batch=2, max_delay=60)
+        for i in range(3):
+            batcher.add({'user_id': 1, 'file_hash': f"hash{i}"}, datetime.now(timezone.utc))
+        await asyncio.sleep(0.1)
+        assert [len(b) for b in collection.batches] == [2]
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert [len(b) for b in collection.batches] == [2, 1]
+
+
+def test_flushes_after_delay(make_collection):
+    """A partly filled buffer is written once the time window expires."""
+    collection = make_collection()
+
+    async def run():
+        batcher = IndexBatcher(collection, max_batch=100, max_delay=0.05)
+        batcher.add({'user_id': 1, 'file_hash': 'hash'})
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert len(collection.batches) == 1
+    assert collection.batches[0][0]._filter == {'user_id': 1, 'file_hash': 'hash'}
+
+
+def test_album_buffer_releases_group_once():
+    """Items sharing a grouped_id are handed over together after the delay."""
+    released = []
+
+    async def run():
+        albums = AlbumBuffer(released.append, delay=0.05)
+        albums.add(42, 'photo-1')
+        albums.add(42, 'photo-2')
+        albums.add(7, 'video-1')
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert sorted(released) == [['photo-1', 'photo-2'], ['video-1']]
+
+
+def test_flush_takes_a_live_slot(make_collection):
+    """Queuing never waits for the scheduler, the write does."""
+    collection = make_collection()
+    scheduler = WorkScheduler(slots=1, aging=0)
+
+    async def run():
+        batcher = IndexBatcher(collection, max_batch=100, max_delay=60, scheduler=scheduler)
+        download = await scheduler.acquire(INTERACTIVE, 1)
+        batcher.add({'user_id': 1, 'file_hash': 'hash'})
+        flush = asyncio.ensure_future(batcher.flush())
+        await asyncio.sleep(0.05)
+        assert collection.batches == [] and scheduler.queued(LIVE) == 1
+
+        scheduler.release(download)
+        assert await flush == 1
+
+    asyncio.run(run())
@@ -0,0 +1,55 @@
+import os
+import sys
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bloom import BloomFilter, FileHashFilter
+
+
+def test_no_false_negatives_and_low_fp_rate():
+    """Added keys are always found; unseen keys rarely are."""
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"key{i}")
+
+    assert all(f"key{i}" in bloom for i in range(10000))
+    false_positives = sum(1 for i in range(10000) if f"other{i}" in bloom)
+    assert false_positives < 300
+    assert 0.005 < bloom.estimated_fp_rate() < 0.02
+
+
+def test_save_and_load(tmp_path):
+    """The filter and its save time survive a round trip through the file."""
+    path = str(tmp_path / 'hashes.bloom')
+    bloom = BloomFilter(1000)
+    bloom.add("1:abc")
+    bloom.save(path, saved_at=123.0)
+
+    loaded, saved_at = BloomFilter.load(path)
+    assert "1:abc" in loaded
+    assert loaded.count == 1
+    assert saved_at == 123.0
+
+
+def test_only_possible_duplicates_reach_mongo(tmp_path, make_collection):
+    """New hashes are ruled out in memory; one query checks the rest."""
+    collection = make_collection([{'user_id': 1, 'file_hash': 'old'}])
+    hashes = FileHashFilter(collection, str(tmp_path / 'hashes.bloom'), capacity=1000)
+    hashes.rebuild()
+    collection.calls.clear()
+
+    assert hashes.existing_hashes(1, ['new1', 'new2']) == set()
+    assert collection.calls == []
+
+    assert hashes.existing_hashes(1, ['old', 'new3']) == {'old'}
+    assert len(collection.calls) == 1
+    assert collection.calls[0][1]['file_hash']['$in'] == ['old']
+
+
+def test_everything_is_checked_until_loaded(tmp_path, make_collection):
+    """Before load() the filter can't rule anything out."""
+    collection = make_collection()
+    hashes = FileHashFilter(collection, str(tmp_path / 'hashes.bloom'))
+
+    assert hashes.might_contain(1, 'anything')
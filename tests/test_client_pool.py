@@ -0,0 +1,78 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.errors import ChannelPrivateError
+
+from client_pool import ClientPool
+from rate_limiter import RateLimiter
+
+
+class FakeEntityCache:
+    """Resolves only the chats the account is a member of."""
+
+    def __init__(self, chats):
+        self.chats = chats
+        self.calls = 0
+
+    async def resolve(self, client, key, refresh=False):
+        self.calls += 1
+        if key not in self.chats:
+            raise ChannelPrivateError(request=None)
+        return f"entity:{key}"
+
+
+def make_pool(tmp_path):
+    pool = ClientPool()
+    path = str(tmp_path / 'limits.db')
+    limits = {'iter_messages': (1.0, 1)}
+    busy = pool.add('busy', object(), RateLimiter(path, limits, namespace='busy'),
+                    FakeEntityCache({'@news', '@books'}), connected=True)
+    idle = pool.add('idle', object(), RateLimiter(path, limits, namespace='idle'),
+                    FakeEntityCache({'@news'}), connected=True)
+    return pool, busy, idle
+
+
+def test_least_throttled_account_is_chosen(tmp_path):
+    """An account with an empty bucket loses to one that can send right away."""
+    pool, busy, idle = make_pool(tmp_path)
+    busy.limiter.reserve('iter_messages')
+
+    account, entity = asyncio.run(pool.acquire('@news', 'iter_messages'))
+
+    assert account is idle
+    assert entity == "entity:@news"
+    assert idle.active == 1
+    pool.release(account)
+    assert idle.active == 0
+
+
+def test_accounts_without_access_are_skipped(tmp_path):
+    """A chat only one account is in goes to that account, and the miss is remembered."""
+    pool, busy, idle = make_pool(tmp_path)
+    busy.limiter.reserve('iter_messages')
+
+    account, _ = asyncio.run(pool.acquire('@books', 'iter_messages'))
+    assert account is busy
+    assert not idle.can_access('@books', pool.no_access_ttl)
+
+    # The remembered miss saves a lookup next time
+    calls = idle.entity_cache.calls
+    pool.release(account)
+    asyncio.run(pool.acquire('@books', 'iter_messages'))
+    assert idle.entity_cache.calls == calls
+
+
+def test_disconnected_accounts_are_not_used(tmp_path):
+    """Accounts that are reconnecting get no work."""
+    pool, busy, idle = make_pool(tmp_path)
+    busy.connected = False
+    idle.connected = False
+
+    with pytest.raises(ValueError):
+        asyncio.run(pool.acquire('@news', 'iter_messages'))
@@ -0,0 +1,109 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from delivery import ReferenceDelivery, sent_file_id, file_kind
+
+
+class FakeBot:
+    def __init__(self, copy_error=None, file_id_error=None):
+        self.copy_error = copy_error
+        self.file_id_error = file_id_error
+        self.calls = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.calls.append(('copy', from_chat_id, message_id))
+        if self.copy_error:
+            raise self.copy_error
+        return SimpleNamespace(message_id=1)
+
+    async def send_video(self, chat_id, video, caption=None):
+        self.calls.append(('video', video))
+        if self.file_id_error:
+            raise self.file_id_error
+        return SimpleNamespace(video=SimpleNamespace(file_id=video))
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        self.calls.append(('document', document))
+        if self.file_id_error:
+            raise self.file_id_error
+        return SimpleNamespace(document=SimpleNamespace(file_id=document))
+
+
+DOCUMENT = {
+    'original_message': {'chat_id': 1234567, 'message_id': 42},
+    'file_id': 'BAAD-video',
+    'file_id_kind': 'video',
+}
+
+
+def test_copies_original_post_first():
+    """When the bot can read the source chat no file_id or upload is needed."""
+    bot = FakeBot()
+    method = asyncio.run(ReferenceDelivery().deliver(bot, 5, DOCUMENT, -1000001234567))
+    assert method == 'copy'
+    assert bot.calls == [('copy', -1000001234567, 42)]
+
+
+def test_falls_back_to_cached_file_id_and_remembers_refusing_chat():
+    """A chat that refuses copies is skipped on the next delivery."""
+    bot = FakeBot(copy_error=BadRequest("Chat not found"))
+    delivery = ReferenceDelivery()
+
+    async def run():
+        first = await delivery.deliver(bot, 5, DOCUMENT, -1000001234567)
+        second = await delivery.deliver(bot, 5, DOCUMENT, -1000001234567)
+        return first, second
+
+    assert asyncio.run(run()) == ('file_id', 'file_id')
+    assert [call[0] for call in bot.calls] == ['copy', 'video', 'video']
+
+
+def test_returns_none_when_upload_is_needed():
+    """No copy access and an invalid file_id leave the download + upload path."""
+    bot = FakeBot(copy_error=BadRequest("Chat not found"), file_id_error=BadRequest("Wrong file identifier"))
+    assert asyncio.run(ReferenceDelivery().deliver(bot, 5, DOCUMENT, -1000001234567)) is None
+
+    bot = FakeBot()
+    assert asyncio.run(ReferenceDelivery().deliver(bot, 5, {'original_message': {}}, None)) is None
+    assert bot.calls == []
+
+
+def test_sent_file_id_and_kind():
+    photo = SimpleNamespace(photo=[SimpleNamespace(file_id='small'), SimpleNamespace(file_id='large')])
+    assert sent_file_id(photo) == ('large', 'photo')
+    assert sent_file_id(SimpleNamespace(photo=[], document=SimpleNamespace(file_id='doc'))) == ('doc', 'document')
+    assert sent_file_id(None) == (None, None)
+    assert file_kind('video/mp4') == 'video'
+    assert file_kind('application/pdf') == 'document'
+
+
+def test_only_chat_level_errors_skip_the_chat():
+    """Transient errors change nothing, a missing post is only skipped for itself."""
+    other = dict(DOCUMENT, original_message={'chat_id': 1234567, 'message_id': 43})
+
+    for error in (RetryAfter(5), TimedOut(), NetworkError("connection reset")):
+        delivery = ReferenceDelivery()
+        asyncio.run(delivery.copy(FakeBot(copy_error=error), 5, -1000001234567, 42))
+        assert delivery.can_copy(-1000001234567, 42)
+
+    delivery = ReferenceDelivery()
+    bot = FakeBot(copy_error=BadRequest("Message to copy not found"))
+
+    async def run():
+        await delivery.deliver(bot, 5, DOCUMENT, -1000001234567)
+        bot.copy_error = None
+        return await delivery.deliver(bot, 5, DOCUMENT, -1000001234567), await delivery.deliver(bot, 5, other, -1000001234567)
+
+    assert asyncio.run(run()) == ('file_id', 'copy')
+    assert [call[0] for call in bot.calls] == ['copy', 'video', 'video', 'copy']
+
+    delivery = ReferenceDelivery()
+    asyncio.run(delivery.copy(FakeBot(copy_error=Forbidden("bot is not a member of the channel chat")), 5, -100, 42))
+    assert not delivery.can_copy(-100, 43)
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_manager import DownloadManager, part_path, resume_path
+
+
+def test_concurrent_requests_share_one_download(tmp_path):
+    """Only the first request downloads; the file appears at its path only when complete."""
+    manager = DownloadManager()
+    path = str(tmp_path / "file.bin")
+    calls = []
+
+    async def download(part):
+        calls.append(part)
+        with open(part, 'wb') as f:
+            f.write(b"half")
+        await asyncio.sleep(0.05)
+        assert not os.path.exists(path)
+        with open(part, 'ab') as f:
+            f.write(b"-done")
+
+    async def run():
+        return await asyncio.gather(*[manager.fetch('document:1', path, download) for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert results == [path] * 5
+    assert calls == [part_path(path)]
+    assert open(path, 'rb').read() == b"half-done"
+    assert not os.path.exists(part_path(path))
+
+
+def test_failed_download_is_kept_for_resume(tmp_path):
+    manager = DownloadManager()
+    path = str(tmp_path / "file.bin")
+
+    async def failing(part):
+        with open(part, 'wb') as f:
+            f.write(b"partial")
+        raise ConnectionError("dropped")
+
+    async def resuming(part):
+        with open(part, 'ab') as f:
+            f.write(b"-rest")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(manager.fetch('document:1', path, failing))
+    assert not os.path.exists(path) and not os.path.exists(part_path(path))
+    assert os.path.exists(resume_path(path))
+
+    # The next request continues from the bytes already downloaded
+    assert asyncio.run(manager.fetch('document:1', path, resuming)) == path
+    assert open(path, 'rb').read() == b"partial-rest"
+    assert not os.path.exists(resume_path(path))
+
+
+def test_waits_for_download_by_another_process(tmp_path):
+    """A .part owned by someone else is waited on, an abandoned one is taken over."""
+    manager = DownloadManager(poll_interval=0.01, stale_after=60)
+    path = str(tmp_path / "file.bin")
+    open(part_path(path), 'wb').close()
+
+    async def download(part):
+        raise AssertionError("should wait for the other process")
+
+    async def other_process_publishes():
+        await asyncio.sleep(0.05)
+        with open(path, 'wb') as f:
+            f.write(b"theirs")
+        os.remove(part_path(path))
+
+    async def run():
+        publisher = asyncio.ensure_future(other_process_publishes())
+        result = await manager.fetch('document:1', path, download)
+        await publisher
+        return result
+
+    assert asyncio.run(run()) == path
+    assert open(path, 'rb').read() == b"theirs"
+
+    # A partial file nobody has written to for a while is taken over
+    other = str(tmp_path / "other.bin")
+    open(part_path(other), 'wb').close()
+    old = time.time() - 120
+    os.utime(part_path(other), (old, old))
+
+    async def download_other(part):
+        with open(part, 'wb') as f:
+            f.write(b"mine")
+
+    assert asyncio.run(manager.fetch('document:2', other, download_other)) == other
+    assert open(other, 'rb').read() == b"mine"
+
+
+def test_release_deletes_after_last_holder(tmp_path):
+    manager = DownloadManager()
+    path = str(tmp_path / "file.bin")
+
+    async def download(part):
+        with open(part, 'wb') as f:
+            f.write(b"data")
+
+    async def run():
+        await asyncio.gather(manager.fetch('document:1', path, download), manager.fetch('document:1', path, download))
+
+    asyncio.run(run())
+    manager.release(path, delete=True)
+    assert os.path.exists(path)
+    manager.release(path, delete=True)
+    assert not os.path.exists(path)
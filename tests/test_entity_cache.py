@@ -0,0 +1,95 @@
+import os
+import sys
+import asyncio
+import threading
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl.types import Channel, ChatPhotoEmpty, InputPeerChannel
+
+from entity_cache import EntityCache, normalize_key
+
+
+def make_channel():
+    return Channel(
+        id=1234567,
+        title='Test Channel',
+        photo=ChatPhotoEmpty(),
+        date=None,
+        access_hash=987654321,
+        username='TestChannel'
+    )
+
+
+def test_normalize_key():
+    """Links, @usernames and ids map onto the same keys."""
+    assert normalize_key('@TestChannel') == 'testchannel'
+    assert normalize_key('https://t.me/TestChannel') == 'testchannel'
+    assert normalize_key('-1001234567') == '-1001234567'
+    assert normalize_key(1234567) == '1234567'
+
+
+def test_entity_persists_across_instances(tmp_path):
+    """A second process opening the same file resolves without the network."""
+    path = str(tmp_path / 'entities.db')
+    EntityCache('+10000000000', path).put(make_channel())
+
+    cached = EntityCache('+10000000000', path).get('@testchannel')
+
+    assert cached.id == 1234567
+    assert cached.title == 'Test Channel'
+    assert cached.input_peer == InputPeerChannel(1234567, 987654321)
+    assert cached.peer_id == -1000001234567
+
+
+def test_entries_are_scoped_by_account(tmp_path):
+    """Access hashes from one account are never handed to another."""
+    path = str(tmp_path / 'entities.db')
+    EntityCache('+10000000000', path).put(make_channel())
+
+    assert EntityCache('+20000000000', path).get('testchannel') is None
+
+
+def test_resolve_calls_telegram_only_on_miss(tmp_path):
+    """get_entity is called once, later lookups by id or username are cached."""
+    calls = []
+
+    class FakeClient:
+        async def get_entity(self, key):
+            calls.append(key)
+            return make_channel()
+
+    cache = EntityCache('+10000000000', str(tmp_path / 'entities.db'))
+    client = FakeClient()
+
+    asyncio.run(cache.resolve(client, 'TestChannel'))
+    asyncio.run(cache.resolve(client, 1234567))
+    asyncio.run(cache.resolve(client, '-1000001234567'))
+    assert calls == ['testchannel']
+
+    cache.invalidate('testchannel')
+    asyncio.run(cache.resolve(client, 1234567))
+    assert calls == ['testchannel', 1234567]
+
+
+def test_get_async_reads_disk_off_the_loop(tmp_path):
+    """Entries only on disk are read in a worker thread, then served from memory."""
+    path = str(tmp_path / 'entities.db')
+    EntityCache('+10000000000', path).put(make_channel())
+    cache = EntityCache('+10000000000', path)
+    threads = []
+    from_disk = cache._from_disk
+
+    def record(key):
+        threads.append(threading.current_thread())
+        return from_disk(key)
+
+    cache._from_disk = record
+
+    async def run():
+        return await cache.get_async('@TestChannel'), await cache.get_async('testchannel')
+
+    first, second = asyncio.run(run())
+    assert first.id == second.id == 1234567
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
@@ -0,0 +1,50 @@
+import os
+import sys
+from types import SimpleNamespace
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_id_cache import FileIdCache, document_key
+
+
+def make_document(location_id=777, user_id=1):
+    return {
+        'user_id': user_id,
+        'original_message': {'chat_id': 1234567, 'message_id': 42},
+        'location': {'kind': 'document', 'id': location_id} if location_id else None,
+    }
+
+
+def test_document_key_prefers_media_identity():
+    assert document_key(make_document()) == "document:777"
+    assert document_key(make_document(location_id=None)) == "message:1234567:42"
+    assert document_key({'original_message': {}}) is None
+
+
+def test_file_id_is_shared_by_documents_of_the_same_file(make_collection):
+    """A file uploaded for one user is found for another user's document of it."""
+    file_ids = make_collection()
+    documents = make_collection()
+    cache = FileIdCache(file_ids, documents)
+
+    sent = SimpleNamespace(photo=None, video=SimpleNamespace(file_id='BAAD', file_unique_id='u1', file_size=10))
+    assert cache.store(make_document(user_id=1), sent) == 'BAAD'
+
+    assert cache.get(make_document(user_id=2)) == ('BAAD', 'video')
+    assert documents.calls == [(
+        'update_many',
+        {'location.kind': 'document', 'location.id': 777},
+        {'$set': {'file_id': 'BAAD', 'file_id_kind': 'video'}}
+    )]
+
+
+def test_invalidate_drops_rejected_file_id(make_collection):
+    file_ids = make_collection()
+    documents = make_collection()
+    cache = FileIdCache(file_ids, documents)
+    cache.store(make_document(), SimpleNamespace(document=SimpleNamespace(file_id='OLD')))
+
+    cache.invalidate(make_document(), 'OLD')
+    assert cache.get(make_document()) == (None, None)
+    assert documents.calls[-1][2] == {'$unset': {'file_id': "", 'file_id_kind': ""}}
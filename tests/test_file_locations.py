@@ -0,0 +1,102 @@
+import os
+import sys
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl import types
+
+from file_locations import media_location, is_fresh, input_location, thumb_location, location_document, refresh_locations
+
+
+def make_document_message(message_id=10):
+    document = types.Document(
+        id=111, access_hash=222, file_reference=b'ref', date=None,
+        mime_type='application/pdf', size=4096, dc_id=4, attributes=[]
+    )
+    return types.Message(id=message_id, peer_id=types.PeerChannel(1234567), date=None, message='',
+                         media=types.MessageMediaDocument(document=document))
+
+
+def make_photo_message(message_id=11):
+    photo = types.Photo(
+        id=333, access_hash=444, file_reference=b'photo-ref', date=None, dc_id=2,
+        sizes=[
+            types.PhotoStrippedSize(type='i', bytes=b''),
+            types.PhotoSize(type='m', w=320, h=320, size=1000),
+            types.PhotoSizeProgressive(type='y', w=1280, h=1280, sizes=[500, 5000, 9000]),
+        ]
+    )
+    return types.Message(id=message_id, peer_id=types.PeerChannel(1234567), date=None, message='',
+                         media=types.MessageMediaPhoto(photo=photo))
+
+
+def test_document_location_round_trip():
+    """A stored document location turns back into the input location and Document."""
+    location = media_location(make_document_message(), account='+10000000000')
+
+    assert location['kind'] == 'document'
+    assert location['account'] == '+10000000000'
+    dc_id, file_location = input_location(location)
+    assert dc_id == 4
+    assert isinstance(file_location, types.InputDocumentFileLocation)
+    assert file_location.file_reference == b'ref'
+    assert location_document(location).size == 4096
+
+
+def test_photo_location_uses_largest_size():
+    """Photos are fetched at their largest stored size, progressive sizes included."""
+    location = media_location(make_photo_message())
+
+    assert location['kind'] == 'photo'
+    assert location['thumb_size'] == 'y'
+    assert location['size'] == 9000
+    assert isinstance(input_location(location)[1], types.InputPhotoFileLocation)
+    # The card thumbnail is the largest size that fits THUMB_MAX_SIDE
+    assert location['thumb'] == {'type': 'm', 'size': 1000}
+    assert thumb_location(location)[1].thumb_size == 'm'
+
+
+def test_freshness():
+    """References older than FILE_REFERENCE_TTL are refreshed before use."""
+    location = media_location(make_document_message())
+    assert is_fresh(location)
+    location['reference_at'] = datetime.now() - timedelta(days=2)
+    assert not is_fresh(location)
+    assert not is_fresh(None)
+
+
+def test_refresh_updates_all_requested_messages():
+    """One get_messages call refreshes every requested message that still exists."""
+    class FakeClient:
+        def __init__(self):
+            self.calls = []
+
+        async def get_messages(self, peer, ids):
+            self.calls.append(ids)
+            return [make_document_message(10), None]
+
+    class FakeCollection:
+        def __init__(self):
+            self.operations = []
+
+        def bulk_write(self, operations, ordered=True):
+            self.operations.extend(operations)
+            self.thread = threading.current_thread()
+
+    class Entity:
+        id = 1234567
+        input_peer = types.InputPeerChannel(1234567, 1)
+
+    client, collection = FakeClient(), FakeCollection()
+    found = asyncio.run(refresh_locations(client, collection, Entity(), [10, 12], account='acc'))
+
+    assert client.calls == [[10, 12]]
+    assert list(found) == [10]
+    assert len(collection.operations) == 1
+    # Written from a worker thread, not on the event loop
+    assert collection.thread is not threading.main_thread()
+    assert collection.operations[0]._filter == {'original_message.chat_id': 1234567, 'original_message.message_id': 10}
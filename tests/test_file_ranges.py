@@ -0,0 +1,121 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_ranges
+from file_ranges import parse_ranges, send_ranges
+
+DATA = bytes(range(256)) * 4
+
+
+def make_file(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    with open(path, 'wb') as f:
+        f.write(DATA)
+    return path
+
+
+def get(path, **headers):
+    rv = send_ranges(path, 'video/mp4', headers)
+    body = b"".join(rv.response)
+    rv.close()
+    return rv, body
+
+
+def test_parse_ranges():
+    assert parse_ranges(None, 100) is None
+    assert parse_ranges('bytes=0-9', 100) == [(0, 9)]
+    assert parse_ranges('bytes=90-', 100) == [(90, 99)]
+    assert parse_ranges('bytes=-5', 100) == [(95, 99)]
+    assert parse_ranges('bytes=50-500', 100) == [(50, 99)]
+    # Overlapping and adjacent spans are merged, in file order
+    assert parse_ranges('bytes=20-29,0-9,10-14,25-40', 100) == [(0, 14), (20, 40)]
+    # Malformed headers are ignored, unsatisfiable ones rejected
+    assert parse_ranges('bytes=9-0', 100) is None
+    assert parse_ranges('items=0-9', 100) is None
+    with pytest.raises(ValueError):
+        parse_ranges('bytes=100-', 100)
+
+
+def test_single_range_is_read_in_bounded_pieces(tmp_path, monkeypatch):
+    path = make_file(tmp_path)
+    rv, body = get(path, Range='bytes=100-899')
+    assert rv.status_code == 206
+    assert body == DATA[100:900]
+    assert rv.headers['Content-Range'] == f'bytes 100-899/{len(DATA)}'
+    assert rv.headers['Content-Length'] == '800'
+
+    # Large ranges come out in BUFFER_SIZE pieces, never as one read
+    monkeypatch.setattr(file_ranges, 'BUFFER_SIZE', 256)
+    rv = send_ranges(path, 'video/mp4', {'Range': 'bytes=0-'})
+    assert [len(piece) for piece in rv.response] == [256] * 4
+
+
+def test_multiple_ranges_are_sent_as_multipart(tmp_path):
+    path = make_file(tmp_path)
+    rv, body = get(path, Range='bytes=0-3,-4')
+    assert rv.status_code == 206
+    assert rv.mimetype == 'multipart/byteranges'
+    assert int(rv.headers['Content-Length']) == len(body)
+    assert f"Content-Range: bytes 0-3/{len(DATA)}\r\n\r\n".encode() + DATA[:4] in body
+    assert f"Content-Range: bytes 1020-1023/{len(DATA)}\r\n\r\n".encode() + DATA[-4:] in body
+    assert body.endswith(b"--\r\n")
+
+
+def test_conditional_requests(tmp_path):
+    path = make_file(tmp_path)
+    rv, body = get(path)
+    assert rv.status_code == 200 and body == DATA
+    etag = rv.headers['ETag']
+
+    rv, body = get(path, **{'If-None-Match': etag})
+    assert rv.status_code == 304 and body == b""
+
+    # If-Range matching the current file: the range is honoured
+    rv, body = get(path, Range='bytes=0-9', **{'If-Range': etag})
+    assert rv.status_code == 206 and body == DATA[:10]
+
+    # The file changed since the client's copy: the whole file is sent
+    rv, body = get(path, Range='bytes=0-9', **{'If-Range': '"stale"'})
+    assert rv.status_code == 200 and body == DATA
+
+    rv, _ = get(path, Range=f'bytes={len(DATA)}-')
+    assert rv.status_code == 416
+    assert rv.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_served_through_quart(tmp_path):
+    """The generator bodies go through Quart's Response, as the website's /media route sends them."""
+    from quart import Quart, Response, request
+
+    make_file(tmp_path)
+    app = Quart(__name__)
+
+    @app.route('/media/<path:filename>')
+    async def serve_media(filename):
+        return send_ranges(str(tmp_path / filename), 'video/mp4', request.headers, Response)
+
+    async def run():
+        client = app.test_client()
+        rv = await client.get('/media/video.mp4')
+        assert rv.status_code == 200 and await rv.get_data() == DATA
+        etag = rv.headers['ETag']
+
+        rv = await client.get('/media/video.mp4', headers={'Range': 'bytes=100-899'})
+        assert rv.status_code == 206 and await rv.get_data() == DATA[100:900]
+        assert rv.headers['Content-Range'] == f'bytes 100-899/{len(DATA)}'
+
+        rv = await client.get('/media/video.mp4', headers={'Range': 'bytes=0-3,-4'})
+        body = await rv.get_data()
+        assert rv.status_code == 206 and int(rv.headers['Content-Length']) == len(body)
+        assert body.endswith(b"--\r\n")
+
+        rv = await client.get('/media/video.mp4', headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+    asyncio.run(run())
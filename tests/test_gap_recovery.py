@@ -0,0 +1,104 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gap_recovery import SyncState, recover_gaps
+from routing import RoutingTable
+
+
+class FakeStateCollection:
+    def __init__(self, states):
+        self.states = states
+        self.writes = []
+
+    def find(self, query):
+        return list(self.states)
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes.extend(operations)
+
+
+def test_marks_only_move_forward():
+    """Older message ids never lower a stored mark."""
+    collection = FakeStateCollection([{'chat_id': -1001, 'last_message_id': 50}])
+    state = SyncState(collection)
+    state.load()
+
+    state.advance([(-1001, 40)])
+    assert state.last_message_id(-1001) == 50
+    assert collection.writes == []
+
+    state.advance([(-1001, 60), (-1001, 55), (-1002, 7)])
+    assert state.last_message_id(-1001) == 60
+    assert state.last_message_id(-1002) == 7
+    assert len(collection.writes) == 2
+
+    # Recovery still starts from the mark loaded at startup
+    assert state.startup_message_id(-1001) == 50
+
+
+def test_recover_gaps_fetches_after_startup_mark():
+    """Only chats with a mark are diffed, starting right after the mark."""
+    state = SyncState(FakeStateCollection([{'chat_id': -1001, 'last_message_id': 50}]))
+    state.load()
+
+    table = RoutingTable()
+    table.add(-1001, user_id=1, source_id='a')
+    table.add(-1002, user_id=1, source_id='b')
+
+    requested = []
+
+    class FakeClient:
+        async def iter_messages(self, peer, min_id=0, reverse=False, limit=None):
+            requested.append((peer, min_id))
+            for message_id in (51, 52):
+                yield SimpleNamespace(id=message_id, media=message_id == 52)
+
+    class FakeCache:
+        async def resolve(self, client, key):
+            return SimpleNamespace(input_peer=key)
+
+    indexed = []
+    recovered = asyncio.run(recover_gaps(
+        FakeClient(), FakeCache(), table, state,
+        lambda peer_id, routes, messages: indexed.append((peer_id, [m.id for m in messages]))
+    ))
+
+    assert requested == [(-1001, 50)]
+    assert indexed == [(-1001, [52])]
+    assert recovered == 1
+
+
+def test_recover_gaps_continues_past_the_limit():
+    """A gap longer than one pass is read in further passes rather than cut off."""
+    state = SyncState(FakeStateCollection([{'chat_id': -1001, 'last_message_id': 0}]))
+    state.load()
+    table = RoutingTable()
+    table.add(-1001, user_id=1, source_id='a')
+
+    requested = []
+
+    class FakeClient:
+        async def iter_messages(self, peer, min_id=0, reverse=False, limit=None):
+            requested.append(min_id)
+            for message_id in range(min_id + 1, min(min_id + limit, 7) + 1):
+                yield SimpleNamespace(id=message_id, media=True)
+
+    class FakeCache:
+        async def resolve(self, client, key):
+            return SimpleNamespace(input_peer=key)
+
+    indexed = []
+    recovered = asyncio.run(recover_gaps(
+        FakeClient(), FakeCache(), table, state,
+        lambda peer_id, routes, messages: indexed.extend(m.id for m in messages),
+        limit=3
+    ))
+
+    assert requested == [0, 3, 6]
+    assert indexed == list(range(1, 8))
+    assert recovered == 7
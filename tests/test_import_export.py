@@ -0,0 +1,103 @@
+import io
+import os
+import sys
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from telethon.tl.types import (
+    Document, DocumentAttributeVideo, Message, MessageMediaDocument, PeerChannel
+)
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_export import ExportReader, export_document, export_peer_id, import_export
+
+
+EXPORT = {
+    "name": "Study Material",
+    "type": "public_channel",
+    "id": 1234567,
+    "messages": [
+        {"id": 1, "type": "service", "date": "2023-01-01T10:00:00", "action": "create_channel"},
+        {"id": 2, "type": "message", "date": "2023-01-01T10:01:00", "date_unixtime": "1672567260",
+         "file": "files/notes.pdf", "file_name": "notes.pdf", "file_size": 2048,
+         "mime_type": "application/pdf",
+         "text": ["Chapter ", {"type": "bold", "text": "one"}]},
+        {"id": 3, "type": "message", "date": "2023-01-01T10:02:00", "text": "no media"},
+        {"id": 4, "type": "message", "date": "2023-01-01T10:03:00",
+         "photo": "photos/photo_1.jpg", "width": 10, "height": 10, "text": ""},
+    ]
+}
+
+
+def test_reader_streams_with_small_chunks():
+    """Messages are parsed correctly even when values straddle chunk boundaries."""
+    reader = ExportReader(io.StringIO(json.dumps(EXPORT, indent=1)), chunk_size=7)
+    messages = list(reader)
+
+    assert [message['id'] for message in messages] == [1, 2, 3, 4]
+    assert reader.chat == {"name": "Study Material", "type": "public_channel", "id": 1234567}
+    assert export_peer_id(reader.chat) == -1000001234567
+
+
+def test_export_document_matches_index_schema():
+    """Files and photos map to index documents, text-only messages are skipped."""
+    messages = EXPORT['messages']
+    document = export_document(messages[1], 1234567, 42, "source", "Study Material")
+
+    assert document['file_name'] == "notes.pdf"
+    assert document['file_type'] == "pdf"
+    assert document['file_size'] == 2048
+    assert document['text'] == "Chapter one"
+    assert document['original_message'] == {'chat_id': 1234567, 'message_id': 2}
+    assert document['date'].year == 2023
+
+    photo = export_document(messages[3], 1234567, 42, "source", "Study Material")
+    assert photo['file_name'] == "photo_4.jpg"
+    assert photo['file_type'] == "photo"
+
+    assert export_document(messages[0], 1234567, 42, "source", "x") is None
+    assert export_document(messages[2], 1234567, 42, "source", "x") is None
+
+
+def test_unnamed_file_hash_matches_live_index():
+    """An exported file without a name hashes like the same message indexed by the bot."""
+    with patch.dict(os.environ, {'API_ID': '123456', 'API_HASH': 'test_hash', 'BOT_TOKEN': 'test_token'}):
+        try:
+            from bot import build_document
+        except ImportError:
+            pytest.skip("Cannot import bot module for testing")
+
+    date = datetime(2023, 1, 1, 10, 4)
+    document = Document(
+        id=1, access_hash=2, file_reference=b'', date=date, mime_type="video/mp4",
+        size=4096, dc_id=2, attributes=[DocumentAttributeVideo(duration=10, w=640, h=360)]
+    )
+    message = Message(
+        id=5, peer_id=PeerChannel(1234567), date=date, message="",
+        media=MessageMediaDocument(document=document)
+    )
+    entry = {"id": 5, "type": "message", "date": "2023-01-01T10:04:00",
+             "file": "files/video_5.mp4", "file_size": 4096, "mime_type": "video/mp4", "text": ""}
+
+    live = build_document(message, 1234567, 42, "source", "Study Material")
+    exported = export_document(entry, 1234567, 42, "source", "Study Material")
+
+    assert exported['file_name'] == live['file_name'] == "Unnamed file"
+    assert exported['file_hash'] == live['file_hash']
+
+
+def test_import_is_idempotent(make_collection):
+    """Importing the same export twice adds nothing the second time."""
+    collection = make_collection()
+
+    def run():
+        reader = ExportReader(io.StringIO(json.dumps(EXPORT)))
+        return import_export(reader, collection, 42, "source", batch_size=1, writers=2)
+
+    assert run() == (2, 2, 4)
+    assert run() == (0, 2, 4)
+    assert len(collection.docs) == 2
@@ -0,0 +1,152 @@
+import os
+import sys
+import asyncio
+import itertools
+from datetime import datetime
+from types import SimpleNamespace
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+
+class FakeJobs:
+    """The subset of a pymongo collection JobQueue uses, with equality, $in, $lt and $gte queries."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._ids = itertools.count(1)
+
+    def _matches(self, job, query):
+        return all(self._match_field(job.get(field), value) for field, value in query.items())
+
+    def _match_field(self, actual, expected):
+        if not isinstance(expected, dict):
+            return actual == expected
+        operators = {
+            '$in': lambda values: actual in values,
+            '$lt': lambda value: actual < value,
+            '$gte': lambda value: actual >= value,
+        }
+        return all(operators[op](value) for op, value in expected.items())
+
+    def create_index(self, keys):
+        pass
+
+    def insert_one(self, job):
+        job['_id'] = next(self._ids)
+        self.jobs[job['_id']] = job
+        return SimpleNamespace(inserted_id=job['_id'])
+
+    def count_documents(self, query):
+        return sum(self._matches(job, query) for job in self.jobs.values())
+
+    def update_one(self, query, update):
+        for job in self.jobs.values():
+            if self._matches(job, query):
+                job.update(update['$set'])
+                return
+
+    def update_many(self, query, update):
+        matched = [job for job in self.jobs.values() if self._matches(job, query)]
+        for job in matched:
+            job.update(update['$set'])
+        return SimpleNamespace(modified_count=len(matched))
+
+    def find_one_and_update(self, query, update, sort, return_document):
+        matched = [job for job in self.jobs.values() if self._matches(job, query)]
+        if not matched:
+            return None
+        job = min(matched, key=lambda job: tuple(job[field] for field, _ in sort))
+        job.update(update['$set'])
+        for field, value in update['$inc'].items():
+            job[field] = job.get(field, 0) + value
+        return dict(job)
+
+
+def test_claims_by_priority_then_age():
+    jobs = FakeJobs()
+    queue = JobQueue(jobs)
+    new = queue.enqueue('index_source', 1)
+    urgent = queue.enqueue('index_source', 1, priority=-1)
+    old = queue.enqueue('index_source', 1)
+    jobs.jobs[new]['created_at'] = datetime(2024, 1, 2)
+    jobs.jobs[urgent]['created_at'] = datetime(2024, 1, 3)
+    jobs.jobs[old]['created_at'] = datetime(2024, 1, 1)
+
+    claimed = [queue._claim()['_id'] for _ in range(3)]
+    assert claimed == [urgent, old, new]
+    assert queue._claim() is None
+    assert all(job['status'] == JOB_RUNNING and job['attempts'] == 1 for job in jobs.jobs.values())
+
+
+def test_start_requeues_interrupted_jobs():
+    jobs = FakeJobs()
+    queue = JobQueue(jobs, workers=0)
+    job_id = queue.enqueue('index_source', 1)
+    queue._claim()
+
+    async def run():
+        await queue.start()
+        await queue.stop()
+
+    asyncio.run(run())
+    assert jobs.jobs[job_id]['status'] == JOB_QUEUED
+    assert queue.queued_count() == 1
+
+
+def test_workers_record_outcomes_and_notify():
+    jobs = FakeJobs()
+    queue = JobQueue(jobs, workers=1, poll_interval=0.01)
+    finished = []
+
+    async def handler(job):
+        if job['payload'].get('fail'):
+            raise ValueError("source gone")
+        return {'indexed': 3}
+
+    async def notify(job):
+        finished.append((job['_id'], job['status']))
+
+    queue.register('index_source', handler)
+    queue.on_complete(notify)
+
+    async def run():
+        await queue.start()
+        ok = queue.enqueue('index_source', 1)
+        failing = queue.enqueue('index_source', 1, payload={'fail': True})
+        while len(finished) < 2:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return ok, failing
+
+    ok, failing = asyncio.run(run())
+    assert finished == [(ok, JOB_DONE), (failing, JOB_FAILED)]
+    assert jobs.jobs[ok]['result'] == {'indexed': 3}
+    assert jobs.jobs[failing]['error'] == "source gone"
+
+
+def test_repeatedly_interrupted_jobs_fail():
+    """A job claimed max_attempts times is failed on the next start instead of requeued."""
+    jobs = FakeJobs()
+    queue = JobQueue(jobs, workers=0, max_attempts=2)
+    crashing = queue.enqueue('index_source', 1)
+    queue._claim()
+    queue._requeue_running()
+    queue._claim()
+    other = queue.enqueue('index_source', 1)
+    queue._claim()
+
+    async def run():
+        await queue.start()
+        await queue.stop()
+
+    asyncio.run(run())
+    assert jobs.jobs[crashing]['status'] == JOB_FAILED
+    assert jobs.jobs[crashing]['error'] == "Interrupted 2 times"
+    assert jobs.jobs[other]['status'] == JOB_QUEUED
+
+    # An exhausted job still queued (e.g. after lowering the limit) is never claimed
+    jobs.jobs[other]['attempts'] = 2
+    assert queue._claim() is None
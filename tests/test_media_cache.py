@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import asyncio
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_cache
+from media_cache import MediaCache, LEGACY_INDEX_FILE
+from download_manager import DownloadManager
+
+
+def put(cache, name, size, add=True):
+    path = os.path.join(cache.directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    if add:
+        cache.add(path)
+    return path
+
+
+def test_lru_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(media_cache.time, 'time', lambda: next(clock))
+    cache = MediaCache(str(tmp_path), max_bytes=250, policy='lru')
+
+    a = put(cache, 'a', 100)
+    b = put(cache, 'b', 100)
+    assert cache.lookup(a)
+    c = put(cache, 'c', 100)
+
+    assert os.path.exists(a) and os.path.exists(c)
+    assert not os.path.exists(b)
+    assert cache.total_bytes == 200
+
+
+def test_lfu_evicts_least_often_used(tmp_path, monkeypatch):
+    clock = iter(range(100, 200))
+    monkeypatch.setattr(media_cache.time, 'time', lambda: next(clock))
+    cache = MediaCache(str(tmp_path), max_bytes=250, policy='lfu')
+
+    a = put(cache, 'a', 100)
+    b = put(cache, 'b', 100)
+    cache.lookup(a)
+    cache.lookup(a)
+    cache.lookup(b)
+    # b was used last, but a was used more often
+    cache.lookup(a)
+    cache.lookup(b)
+    # New files are pinned while they are being delivered (see DownloadManager)
+    c_path = os.path.join(str(tmp_path), 'c')
+    cache.pin(c_path)
+    put(cache, 'c', 100)
+    cache.unpin(c_path)
+
+    assert os.path.exists(a) and os.path.exists(c_path)
+    assert not os.path.exists(b)
+
+
+def test_pinned_files_are_not_evicted(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=150)
+    a_path = os.path.join(str(tmp_path), 'a')
+    cache.pin(a_path)
+    put(cache, 'a', 100)
+    b = put(cache, 'b', 100)
+
+    assert os.path.exists(a_path)
+    assert not os.path.exists(b)
+
+    # Once unpinned, a is the oldest file and goes first
+    cache.unpin(a_path)
+    c = put(cache, 'c', 100)
+    assert not os.path.exists(a_path)
+    assert os.path.exists(c)
+
+
+def test_load_reconciles_index_with_directory(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=1000)
+    put(cache, 'kept', 10)
+    gone = put(cache, 'gone', 10)
+
+    os.remove(gone)
+    put(cache, 'unindexed', 20, add=False)
+    put(cache, 'partial.part', 30, add=False)
+    # Written by an older version, its access times are kept
+    with open(os.path.join(str(tmp_path), LEGACY_INDEX_FILE), 'w') as f:
+        json.dump({'unindexed': {'size': 20, 'last_access': 5, 'hits': 3}}, f)
+
+    reloaded = MediaCache(str(tmp_path), max_bytes=1000)
+    reloaded.load()
+    assert 'kept' in reloaded and 'unindexed' in reloaded
+    assert 'gone' not in reloaded and 'partial.part' not in reloaded
+    assert reloaded.total_bytes == 30
+    assert len(reloaded) == 2
+    assert not os.path.exists(os.path.join(str(tmp_path), LEGACY_INDEX_FILE))
+
+
+def test_lookup_adopts_files_added_by_another_process(tmp_path):
+    bot = MediaCache(str(tmp_path), max_bytes=1000)
+    website = MediaCache(str(tmp_path), max_bytes=1000)
+
+    path = put(bot, 'shared', 50)
+    assert website.lookup(path)
+    assert website.total_bytes == 50
+
+    bot.remove(path)
+    assert not website.lookup(path)
+    assert website.total_bytes == 0
+
+
+def test_downloaded_file_is_pinned_until_released(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=150)
+    manager = DownloadManager(cache=cache)
+    path = cache.path('document:1', 'mp4')
+
+    async def download(part):
+        with open(part, 'wb') as f:
+            f.write(b'x' * 100)
+
+    asyncio.run(manager.fetch('document:1', path, download))
+    assert path in cache
+    # A second file over budget can't push out the one being sent
+    put(cache, 'other', 100)
+    assert os.path.exists(path)
+
+    manager.release(path)
+    put(cache, 'newer', 100)
+    assert not os.path.exists(path)
+
+
+def test_sparse_files_count_until_evicted_with_their_chunk_map(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10 ** 6)
+    sparse = os.path.join(str(tmp_path), 'video.mp4.sparse')
+    chunks = os.path.join(str(tmp_path), 'video.mp4.chunks')
+    with open(sparse, 'wb') as f:
+        f.truncate(10 ** 7)
+        f.write(b'x' * 8192)
+    with open(chunks, 'wb') as f:
+        f.write(b'\x01')
+
+    cache.add_partial(sparse)
+    assert cache.total_bytes == media_cache.allocated_size(sparse)
+    # Indexed again on startup, with the blocks written by then
+    reloaded = MediaCache(str(tmp_path), max_bytes=10 ** 6)
+    reloaded.load()
+    assert sparse in reloaded and reloaded.total_bytes == cache.total_bytes
+
+    cache.max_bytes = 0
+    put(cache, 'a', 10)
+    assert not os.path.exists(sparse) and not os.path.exists(chunks)
+
+
+def test_budget_and_pins_are_shared_between_processes(tmp_path):
+    """Two caches on one directory (the bot and the website) keep one budget and honour each other's pins."""
+    bot = MediaCache(str(tmp_path), max_bytes=250)
+    website = MediaCache(str(tmp_path), max_bytes=250)
+    # Stands in for the website process
+    website._pid = os.getppid()
+
+    sending = os.path.join(str(tmp_path), 'sending')
+    website.pin(sending)
+    put(website, 'sending', 100)
+    put(bot, 'a', 100)
+    put(bot, 'b', 100)
+
+    # The bot evicted its own older file, not the one the website is sending
+    assert os.path.exists(sending) and not os.path.exists(os.path.join(str(tmp_path), 'a'))
+    assert bot.total_bytes == website.total_bytes == 200
+
+    website.unpin(sending)
+    put(bot, 'c', 100)
+    assert not os.path.exists(sending)
+
+
+def test_load_drops_pins_of_dead_processes(tmp_path, monkeypatch):
+    cache = MediaCache(str(tmp_path), max_bytes=150)
+    crashed = MediaCache(str(tmp_path), max_bytes=150)
+    crashed._pid = 999999
+    path = os.path.join(str(tmp_path), 'a')
+    crashed.pin(path)
+    put(cache, 'a', 100)
+
+    monkeypatch.setattr(media_cache, '_process_alive', lambda pid: pid != 999999)
+    cache.load()
+    put(cache, 'b', 100)
+    assert not os.path.exists(path)
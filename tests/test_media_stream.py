@@ -0,0 +1,118 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_cache import MediaCache
+from media_stream import SparseCache, open_sparse, parse_range, iter_range
+
+CHUNK = 4096
+CONTENT = bytes(i % 251 for i in range(CHUNK * 5 + 100))
+LOCATION = {'kind': 'document', 'id': 1, 'access_hash': 2, 'file_reference': b'', 'dc_id': 4, 'size': len(CONTENT)}
+
+
+class FakeClient:
+    """Serves iter_download from CONTENT and records the requested offsets."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def iter_download(self, file, offset, limit, chunk_size, request_size, file_size, dc_id):
+        assert offset % chunk_size == 0
+        self.requests.append((offset, limit))
+        for n in range(limit):
+            data = CONTENT[offset + n * chunk_size:offset + (n + 1) * chunk_size]
+            if not data:
+                return
+            yield data
+
+
+def read_range(client, cache, start, end):
+    async def run():
+        return b"".join([piece async for piece in iter_range(client, LOCATION, cache, start, end)])
+    return asyncio.run(run())
+
+
+def test_parse_range():
+    assert parse_range(None, 1000, window=100) == (0, 99)
+    assert parse_range("bytes=10-19", 1000) == (10, 19)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=0-5000", 1000) == (0, 999)
+    with pytest.raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+    with pytest.raises(ValueError):
+        parse_range("bytes=1-2,5-6", 1000)
+
+
+def test_fetches_only_chunks_covering_the_range(tmp_path):
+    """A range in the middle of the file maps onto whole chunks of the grid."""
+    client = FakeClient()
+    cache = SparseCache(str(tmp_path / "video.mp4"), len(CONTENT), CHUNK)
+
+    assert read_range(client, cache, CHUNK + 10, CHUNK * 3 + 5) == CONTENT[CHUNK + 10:CHUNK * 3 + 6]
+    assert client.requests == [(CHUNK, 3)]
+
+    # Cached chunks come from disk, only the gap before them is fetched
+    assert read_range(client, cache, 0, CHUNK * 2) == CONTENT[:CHUNK * 2 + 1]
+    assert client.requests[1:] == [(0, 1)]
+
+
+def test_sparse_cache_publishes_complete_file(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    client = FakeClient()
+
+    cache = SparseCache(path, len(CONTENT), CHUNK)
+    read_range(client, cache, 0, CHUNK * 2)
+    cache.close()
+    assert not os.path.exists(path)
+
+    # Present chunks survive reopening
+    cache = SparseCache(path, len(CONTENT), CHUNK)
+    assert cache.has(0) and cache.has(2) and not cache.has(3)
+    read_range(client, cache, CHUNK * 3, len(CONTENT) - 1)
+    cache.close()
+
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(path + '.sparse') and not os.path.exists(path + '.chunks')
+
+
+def test_overlapping_streams_share_one_cache(tmp_path):
+    """Concurrent responses for the same file keep each other's chunks."""
+    path = str(tmp_path / "video.mp4")
+    media = MediaCache(str(tmp_path), max_bytes=10 ** 6)
+    client = FakeClient()
+
+    async def stream(start, end):
+        cache = open_sparse(path, len(CONTENT), CHUNK, media)
+        try:
+            return b"".join([piece async for piece in iter_range(client, LOCATION, cache, start, end)])
+        finally:
+            cache.close()
+
+    async def run():
+        first = open_sparse(path, len(CONTENT), CHUNK, media)
+        assert open_sparse(path, len(CONTENT), CHUNK, media) is first
+        first.close()
+        first.close()
+        return await asyncio.gather(stream(0, CHUNK * 2), stream(CHUNK, CHUNK * 3 + 5))
+
+    assert asyncio.run(run()) == [CONTENT[:CHUNK * 2 + 1], CONTENT[CHUNK:CHUNK * 3 + 6]]
+    assert path + '.sparse' in media
+
+    # Both streams' chunks were kept, so only the tail is fetched
+    client.requests.clear()
+    cache = open_sparse(path, len(CONTENT), CHUNK, media)
+    assert all(cache.has(index) for index in range(4))
+    read_range(client, cache, 0, len(CONTENT) - 1)
+    assert client.requests == [(CHUNK * 4, 2)]
+    cache.close()
+
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert path in media and path + '.sparse' not in media
@@ -0,0 +1,140 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_download
+from parallel_download import ParallelDownloader, SenderPool, Tuner, part_limit, MIN_PART_SIZE
+
+DATA = os.urandom(5 * MIN_PART_SIZE + 1000)
+
+
+class FakeSender:
+    def __init__(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+
+class FakeClient:
+    """Serves upload.getFile from DATA, optionally failing for one offset."""
+
+    def __init__(self, fail_offset=None):
+        self.session = SimpleNamespace(dc_id=2, auth_key=b'key')
+        self.requests = []
+        self.fail_offset = fail_offset
+
+    async def _call(self, sender, request):
+        self.requests.append((request.offset, request.limit))
+        assert request.offset % request.limit == 0
+        await asyncio.sleep(0)
+        if request.offset == self.fail_offset:
+            raise ConnectionError("reset")
+        return SimpleNamespace(bytes=DATA[request.offset:request.offset + request.limit])
+
+
+@pytest.fixture(autouse=True)
+def fake_senders(monkeypatch):
+    created = []
+
+    async def connect(self):
+        created.append(FakeSender())
+        return created[-1]
+
+    monkeypatch.setattr(SenderPool, '_connect', connect)
+    return created
+
+
+def test_part_limit_keeps_offsets_aligned():
+    assert part_limit(0, 1024 * 1024) == 1024 * 1024
+    assert part_limit(256 * 1024, 1024 * 1024) == 256 * 1024
+    assert part_limit(384 * 1024, 512 * 1024) == 128 * 1024
+
+
+def test_tuner_hill_climbs_on_throughput(monkeypatch):
+    tuner = Tuner(max_connections=8, connections=4)
+    tuner.observe_window(100)
+    assert tuner.connections == 5
+    tuner.observe_window(120)
+    assert tuner.connections == 6
+    # Worse than the last window: turn around
+    tuner.observe_window(80)
+    assert tuner.connections == 5
+
+    tuner.penalize()
+    assert tuner.connections == 2
+
+    part_size = tuner.part_size
+    tuner.observe_request(0.01)
+    assert tuner.part_size == part_size * 2
+    tuner.observe_request(5)
+    assert tuner.part_size == part_size
+
+
+def test_download_reuses_pooled_senders(tmp_path, fake_senders):
+    downloader = ParallelDownloader(max_connections=4)
+    client = FakeClient()
+
+    async def run():
+        first = str(tmp_path / "first")
+        second = str(tmp_path / "second")
+        await downloader.download(client, None, 2, len(DATA), first)
+        opened = len(fake_senders)
+        stats = await downloader.download(client, None, 2, len(DATA), second)
+        return first, second, opened, stats
+
+    first, second, opened, stats = asyncio.run(run())
+    assert open(first, 'rb').read() == DATA
+    assert open(second, 'rb').read() == DATA
+    assert len(fake_senders) == opened
+    assert stats.size == len(DATA) and stats.resumed_from == 0
+
+
+def test_failed_download_keeps_parts_in_order_and_resumes(tmp_path, monkeypatch):
+    # Fixed small parts, so the failing part is in the middle of the file
+    monkeypatch.setattr(parallel_download, 'FAST_REQUEST', 0)
+    downloader = ParallelDownloader(max_connections=2)
+    path = str(tmp_path / "file")
+    client = FakeClient(fail_offset=3 * MIN_PART_SIZE)
+
+    async def run():
+        downloader.pool(client, 2).tuner.part_size = MIN_PART_SIZE
+        with pytest.raises(ConnectionError):
+            await downloader.download(client, None, 2, len(DATA), path)
+        assert open(path, 'rb').read() == DATA[:3 * MIN_PART_SIZE]
+
+        client.fail_offset = None
+        client.requests = []
+        return await downloader.download(client, None, 2, len(DATA), path)
+
+    stats = asyncio.run(run())
+    assert open(path, 'rb').read() == DATA
+    assert stats.resumed_from == 3 * MIN_PART_SIZE
+    assert min(offset for offset, _ in client.requests) == 3 * MIN_PART_SIZE
+
+
+def test_failed_connection_fails_download(tmp_path, monkeypatch):
+    async def connect(self):
+        raise RuntimeError("authorization import failed")
+
+    monkeypatch.setattr(SenderPool, '_connect', connect)
+    downloader = ParallelDownloader(max_connections=2)
+    client = FakeClient()
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await downloader.download(client, None, 2, len(DATA), str(tmp_path / "file"))
+        pool = downloader.pool(client, 2)
+        return pool._open, pool._idle
+
+    # No sender was obtained, so none is returned to the pool
+    assert asyncio.run(run()) == (0, [])
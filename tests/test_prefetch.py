@@ -0,0 +1,124 @@
+import os
+import sys
+import asyncio
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_manager import DownloadManager, resume_path
+from media_cache import MediaCache
+from prefetch import Prefetcher
+from scheduler import WorkScheduler, BACKFILL
+
+
+def make_prefetcher(tmp_path, **budgets):
+    cache = MediaCache(str(tmp_path), max_bytes=10 ** 6)
+    manager = DownloadManager(cache=cache)
+    return Prefetcher(manager, cache, enabled=True, **budgets), manager
+
+
+def writer(data, started=None, release=None):
+    async def download(part):
+        with open(part, 'wb') as f:
+            f.write(data)
+        if started is not None:
+            started.set()
+        if release is not None:
+            await release.wait()
+    return download
+
+
+def test_prefetched_file_is_a_hit(tmp_path):
+    prefetcher, manager = make_prefetcher(tmp_path)
+    path = str(tmp_path / "a.bin")
+
+    async def run():
+        prefetcher.prefetch(1, [('a', path, 4, writer(b"data"))])
+        await asyncio.gather(*prefetcher._tasks[1].values())
+        assert prefetcher.claim(path)
+        assert not prefetcher.claim(str(tmp_path / "other.bin"))
+
+    asyncio.run(run())
+    assert open(path, 'rb').read() == b"data"
+    assert prefetcher.hit_ratio() == 1.0
+    # Released by the prefetch, so the cache may evict it
+    assert not manager._holders
+
+
+def test_budgets_skip_candidates(tmp_path):
+    prefetcher, _ = make_prefetcher(tmp_path, max_file_bytes=10, bytes_per_minute=15, disk_bytes=100)
+    candidates = [
+        (name, str(tmp_path / name), size, writer(b"x" * (size or 1)))
+        for name, size in [('big', 20), ('a', 8), ('b', 8), ('unknown', None)]
+    ]
+
+    async def run():
+        prefetcher.prefetch(1, candidates)
+        return set(prefetcher._tasks[1])
+
+    # Too large, over the per-minute budget, and of unknown size
+    assert asyncio.run(run()) == {'a'}
+
+
+def test_moving_on_cancels_speculation_but_not_requests(tmp_path):
+    prefetcher, manager = make_prefetcher(tmp_path)
+    first, second = str(tmp_path / "first.bin"), str(tmp_path / "second.bin")
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        prefetcher.prefetch(1, [
+            ('first', first, 4, writer(b"firs", started, release)),
+            ('second', second, 4, writer(b"seco", release=release)),
+        ])
+        await started.wait()
+
+        # A user asks for the second file while it's being prefetched
+        prefetcher.claim(second)
+        request = asyncio.ensure_future(manager.fetch('second', second, writer(b"unused")))
+        await asyncio.sleep(0)
+
+        # ...and views something else: both prefetches are cancelled
+        prefetcher.prefetch(1, [])
+        await asyncio.sleep(0.01)
+        assert 'first' not in manager._flights
+        assert 'second' in manager._flights
+
+        release.set()
+        assert await request == second
+
+    asyncio.run(run())
+    # The speculative download stopped, its bytes are kept for a resume
+    assert not os.path.exists(first) and open(resume_path(first), 'rb').read() == b"firs"
+    assert open(second, 'rb').read() == b"seco"
+
+
+def test_claim_while_queued_promotes_the_prefetch(tmp_path):
+    """A prefetch waiting behind indexing is moved ahead once a user asks for the file."""
+    scheduler = WorkScheduler(slots=2, aging=0, reserved=1)
+    cache = MediaCache(str(tmp_path), max_bytes=10 ** 6)
+    manager = DownloadManager(cache=cache)
+    prefetcher = Prefetcher(manager, cache, scheduler, enabled=True)
+    path = str(tmp_path / "a.bin")
+
+    async def download(part):
+        # Like bot.prefetch_documents: backfill priority, tagged with the path
+        ticket = await scheduler.acquire(BACKFILL, 1, tag=path)
+        try:
+            await writer(b"data")(part)
+        finally:
+            scheduler.release(ticket)
+
+    async def run():
+        # An indexing job holds the only slot background work may take
+        indexing = await scheduler.acquire(BACKFILL, 2)
+        prefetcher.prefetch(1, [('a', path, 4, download)])
+        await asyncio.sleep(0.01)
+        assert scheduler.queued(BACKFILL) == 1
+
+        assert prefetcher.claim(path)
+        assert await asyncio.wait_for(manager.fetch('a', path, download), 1) == path
+        assert scheduler.running[BACKFILL] == 1
+        scheduler.release(indexing)
+
+    asyncio.run(run())
+    assert open(path, 'rb').read() == b"data"
@@ -0,0 +1,66 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import RateLimiter, RateLimitedClient
+
+
+def test_burst_then_throttle(tmp_path):
+    """Tokens up to the burst size are free, the next one has to wait."""
+    limiter = RateLimiter(str(tmp_path / 'limits.db'), limits={'get_entity': (2.0, 3)})
+
+    waits = [limiter.reserve('get_entity') for _ in range(4)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.5, abs=0.05)
+
+
+def test_buckets_are_shared_between_limiters(tmp_path):
+    """Two limiters on the same file (e.g. bot and website) share one budget."""
+    path = str(tmp_path / 'limits.db')
+    bot_limiter = RateLimiter(path, limits={'download': (1.0, 1)})
+    web_limiter = RateLimiter(path, limits={'download': (1.0, 1)})
+
+    assert bot_limiter.reserve('download') == 0.0
+    assert web_limiter.reserve('download') > 0.0
+
+
+def test_flood_wait_blocks_method(tmp_path):
+    """A recorded flood wait delays the next request for that method only."""
+    limiter = RateLimiter(str(tmp_path / 'limits.db'))
+    limiter.block('get_messages', 30)
+
+    assert limiter.reserve('get_messages') > 25
+    assert limiter.reserve('download') == 0.0
+
+
+def test_rate_limited_client_passes_through(tmp_path):
+    """Wrapped methods are awaited, other attributes come from the client."""
+    class FakeClient:
+        name = 'fake'
+
+        async def get_entity(self, key):
+            return f"entity:{key}"
+
+    limiter = RateLimiter(str(tmp_path / 'limits.db'))
+    client = RateLimitedClient(FakeClient(), limiter)
+
+    assert client.name == 'fake'
+    assert asyncio.run(client.get_entity('channel')) == 'entity:channel'
+
+
+def test_namespaces_have_separate_buckets(tmp_path):
+    """Accounts in the client pool don't share buckets, and estimate() takes no token."""
+    path = str(tmp_path / 'limits.db')
+    first = RateLimiter(path, limits={'download': (1.0, 1)})
+    second = RateLimiter(path, limits={'download': (1.0, 1)}, namespace='second')
+
+    assert first.reserve('download') == 0.0
+    assert first.estimate('download') > 0.5
+    assert second.estimate('download') == 0.0
+    assert second.reserve('download') == 0.0
@@ -0,0 +1,46 @@
+import os
+import sys
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing import RoutingTable
+
+
+def test_unmonitored_chat_is_dropped():
+    """Chats nobody subscribed to return None."""
+    table = RoutingTable()
+    table.add(-1001, user_id=1, source_id='a', title='Books')
+
+    assert table.lookup(-1002) is None
+    assert table.lookup(-1001) == {1: 'a'}
+    assert table.title(-1001) == 'Books'
+
+
+def test_load_and_remove_sources():
+    """Sources with chat ids are routed, others are returned for resolving."""
+    table = RoutingTable()
+    unresolved = table.load([
+        {'_id': 's1', 'user_id': 1, 'source_name': 'books', 'chat_id': -1001},
+        {'_id': 's2', 'user_id': 2, 'source_name': 'books', 'chat_id': -1001},
+        {'_id': 's3', 'user_id': 3, 'source_name': 'unknown'},
+    ])
+
+    assert [s['_id'] for s in unresolved] == ['s3']
+    assert table.lookup(-1001) == {1: 's1', 2: 's2'}
+
+    table.remove_source('s1')
+    assert table.lookup(-1001) == {2: 's2'}
+    table.remove_source('s2')
+    assert table.lookup(-1001) is None
+    assert len(table) == 0
+
+
+def test_basic_group_ids():
+    """Only basic groups (-id) are listed, channels (-100...) and users are not."""
+    table = RoutingTable()
+    table.add(-1000001234567, user_id=1, source_id='channel')
+    table.add(-4321, user_id=1, source_id='group')
+    table.add(555, user_id=1, source_id='user')
+
+    assert table.basic_group_ids() == [4321]
@@ -0,0 +1,162 @@
+import os
+import sys
+import asyncio
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from scheduler import WorkScheduler, INTERACTIVE, LIVE, CONNECT, BACKFILL
+
+
+async def wait_and_record(scheduler, priority, user_id, order, tag):
+    ticket = await scheduler.acquire(priority, user_id)
+    order.append(tag)
+    scheduler.release(ticket)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_higher_priority_classes_go_first():
+    """Queued work is granted by class, not arrival order."""
+    scheduler = WorkScheduler(slots=1, aging=0)
+    order = []
+
+    async def run():
+        holder = await scheduler.acquire(INTERACTIVE, 1)
+        tasks = [
+            asyncio.ensure_future(wait_and_record(scheduler, priority, 1, order, tag))
+            for priority, tag in ((BACKFILL, 'backfill'), (CONNECT, 'connect'), (LIVE, 'live'), (INTERACTIVE, 'download'))
+        ]
+        await settle()
+        scheduler.release(holder)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ['download', 'live', 'connect', 'backfill']
+
+
+def test_round_robin_between_users_within_a_class():
+    """One user's many queued jobs don't hold back another user's."""
+    scheduler = WorkScheduler(slots=1, aging=0)
+    order = []
+
+    async def run():
+        holder = await scheduler.acquire(INTERACTIVE, 0)
+        tasks = [
+            asyncio.ensure_future(wait_and_record(scheduler, BACKFILL, user_id, order, f"{user_id}-{n}"))
+            for user_id, n in ((1, 0), (1, 1), (1, 2), (2, 0))
+        ]
+        await settle()
+        scheduler.release(holder)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ['1-0', '2-0', '1-1', '1-2']
+
+
+def test_background_classes_leave_a_reserved_slot():
+    """Backfill can't fill every slot, so a download starts without waiting."""
+    scheduler = WorkScheduler(slots=2, aging=0, reserved=1)
+
+    async def run():
+        backfill = await scheduler.acquire(BACKFILL, 1)
+        waiting = asyncio.ensure_future(scheduler.acquire(BACKFILL, 2))
+        await settle()
+        assert not waiting.done()
+
+        download = await asyncio.wait_for(scheduler.acquire(INTERACTIVE, 3), timeout=1)
+        scheduler.release(download)
+        scheduler.release(backfill)
+        scheduler.release(await waiting)
+
+    asyncio.run(run())
+
+
+def test_waiting_backfill_is_promoted_over_time():
+    """A backfill that has waited long enough goes ahead of fresh live work."""
+    scheduler = WorkScheduler(slots=1, aging=0.05)
+    order = []
+
+    async def run():
+        holder = await scheduler.acquire(INTERACTIVE, 0)
+        backfill = asyncio.ensure_future(wait_and_record(scheduler, BACKFILL, 1, order, 'backfill'))
+        await asyncio.sleep(0.2)
+        live = asyncio.ensure_future(wait_and_record(scheduler, LIVE, None, order, 'live'))
+        await settle()
+        scheduler.release(holder)
+        await asyncio.gather(backfill, live)
+
+    asyncio.run(run())
+    assert order == ['backfill', 'live']
+    assert metrics.snapshot()['samples']['scheduler.backfill.queue_wait']['max'] >= 0.2
+
+
+def test_checkpoint_hands_slot_to_urgent_work():
+    """Long running work yields at a checkpoint and resumes afterwards."""
+    scheduler = WorkScheduler(slots=1, aging=0)
+    order = []
+
+    async def run():
+        ticket = await scheduler.acquire(BACKFILL, 1)
+        # Nothing waiting: the same ticket is kept
+        assert await scheduler.checkpoint(ticket) is ticket
+
+        download = asyncio.ensure_future(wait_and_record(scheduler, INTERACTIVE, 2, order, 'download'))
+        await settle()
+        ticket = await scheduler.checkpoint(ticket)
+        order.append('backfill')
+        scheduler.release(ticket)
+        await download
+
+    asyncio.run(run())
+    assert order == ['download', 'backfill']
+    assert scheduler.in_use == 0
+
+
+def test_ticket_handed_over_by_cancelled_checkpoint_is_released_once():
+    scheduler = WorkScheduler(slots=1, aging=0)
+
+    async def run():
+        ticket = await scheduler.acquire(BACKFILL, 1)
+        download = asyncio.ensure_future(scheduler.acquire(INTERACTIVE, 2))
+        await settle()
+        # Hands the slot to the download, then gives up waiting for it back
+        checkpoint = asyncio.ensure_future(scheduler.checkpoint(ticket))
+        await settle()
+        checkpoint.cancel()
+        await asyncio.gather(checkpoint, return_exceptions=True)
+        scheduler.release(ticket)
+        assert scheduler.running[INTERACTIVE] == 1
+        scheduler.release(await download)
+
+    asyncio.run(run())
+    assert scheduler.in_use == 0
+
+
+def test_promote_moves_waiting_and_running_tickets():
+    scheduler = WorkScheduler(slots=2, aging=0, reserved=1)
+
+    async def run():
+        running = await scheduler.acquire(BACKFILL, 1, tag='running')
+        waiting = asyncio.ensure_future(scheduler.acquire(BACKFILL, 1, tag='waiting'))
+        await settle()
+        assert not waiting.done()
+
+        # Promoted out of the full background class into a free slot
+        assert scheduler.promote('waiting', INTERACTIVE)
+        await settle()
+        assert waiting.result().priority == INTERACTIVE
+
+        assert scheduler.promote('running', LIVE)
+        assert not scheduler.promote('running', BACKFILL)
+        assert (scheduler.running[LIVE], scheduler.running[BACKFILL]) == (1, 0)
+        scheduler.release(running)
+        scheduler.release(waiting.result())
+        assert not scheduler.promote('running', INTERACTIVE)
+
+    asyncio.run(run())
+    assert scheduler.in_use == 0
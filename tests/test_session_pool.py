@@ -0,0 +1,97 @@
+import os
+import sys
+import asyncio
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_pool import UserClientPool
+
+
+class FakeClient:
+    def __init__(self, user_id, log):
+        self.user_id = user_id
+        self.log = log
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.log.append(('connect', self.user_id))
+        self.connected = True
+
+    async def disconnect(self):
+        self.log.append(('disconnect', self.user_id))
+        self.connected = False
+
+
+def make_pool(log, **kwargs):
+    return UserClientPool(lambda user_id: FakeClient(user_id, log), **kwargs)
+
+
+def test_reuses_warm_client():
+    """A second operation by the same user doesn't reconnect."""
+    log = []
+    pool = make_pool(log)
+
+    async def run():
+        first = await pool.acquire(1)
+        pool.release(1)
+        second = await pool.acquire(1)
+        pool.release(1)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert log == [('connect', 1)]
+
+
+def test_evicts_least_recently_used_idle_client():
+    """At the cap, the idle client used longest ago makes room."""
+    log = []
+    pool = make_pool(log, max_connected=2)
+
+    async def run():
+        for user_id in (1, 2, 1, 3):
+            await pool.acquire(user_id)
+            pool.release(user_id)
+
+    asyncio.run(run())
+    assert ('disconnect', 2) in log
+    assert ('disconnect', 1) not in log
+    assert len(pool) == 2
+
+
+def test_waits_when_all_clients_are_busy():
+    """A new user waits for a slot instead of exceeding the cap."""
+    log = []
+    pool = make_pool(log, max_connected=1)
+
+    async def run():
+        await pool.acquire(1)
+        waiter = asyncio.ensure_future(pool.acquire(2))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        pool.release(1)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+    assert log == [('connect', 1), ('disconnect', 1), ('connect', 2)]
+
+
+def test_closes_idle_clients():
+    """Clients unused for longer than idle_timeout are disconnected, busy ones are kept."""
+    log = []
+    pool = make_pool(log, idle_timeout=0)
+
+    async def run():
+        await pool.acquire(1)
+        assert await pool.close_idle() == 0
+        pool.release(1)
+        await asyncio.sleep(0.01)
+        assert await pool.close_idle() == 1
+
+    asyncio.run(run())
+    assert len(pool) == 0
@@ -0,0 +1,123 @@
+import os
+import sys
+import asyncio
+from datetime import datetime
+
+import pytest
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spool import WriteSpool, CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from batching import IndexBatcher
+
+
+class FlakyCollection:
+    """Fails bulk writes while down, records them otherwise."""
+
+    def __init__(self):
+        self.down = True
+        self.attempts = 0
+        self.batches = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.attempts += 1
+        if self.down:
+            raise ConnectionError("server selection timed out")
+        self.batches.append(operations)
+
+        class Result:
+            upserted_count = len(operations)
+        return Result()
+
+
+def test_breaker_opens_and_half_opens():
+    """Repeated failures open the breaker; after the timeout one trial is allowed."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_spool_round_trip_in_order(tmp_path):
+    """Operations come back in insertion order and survive reopening."""
+    spool = WriteSpool(str(tmp_path / "spool.db"))
+    when = datetime(2024, 1, 1, 12, 0)
+    spool.append([{'op': 'update_one', 'filter': {'n': i}, 'update': {'$set': {'at': when}}} for i in range(5)])
+
+    reopened = WriteSpool(str(tmp_path / "spool.db"))
+    assert len(reopened) == 5
+
+    written = []
+    assert reopened.replay(written.extend, batch_size=2) == 5
+    assert [operation['filter']['n'] for operation in written] == [0, 1, 2, 3, 4]
+    assert written[0]['update']['$set']['at'] == when
+    assert len(reopened) == 0
+
+
+def test_batcher_spools_while_down_and_replays(tmp_path):
+    """Failed writes go to the spool, later ones skip the database until it is replayed."""
+    collection = FlakyCollection()
+    spool = WriteSpool(str(tmp_path / "spool.db"))
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    flushed = []
+
+    async def run():
+        batcher = IndexBatcher(collection, max_batch=10, max_delay=60, on_flushed=flushed.extend,
+                               spool=spool, breaker=breaker)
+        batcher.add({'user_id': 1, 'file_hash': 'a'}, mark=(1, 1))
+        await batcher.flush()
+        batcher.add_update({'file_hash': 'a'}, {'$set': {'deleted': True}})
+        await batcher.flush()
+
+        # Only the first flush reached the driver, the breaker kept the second away
+        assert collection.attempts == 1
+        assert len(spool) == 2
+
+        collection.down = False
+        assert await batcher.replay_spool() == 2
+
+    asyncio.run(run())
+    assert len(spool) == 0
+    assert [type(op).__name__ for op in collection.batches[0]] == ['UpdateOne', 'UpdateMany']
+    # The mark was spooled with its document and moves once the replay wrote it
+    assert flushed == [(1, 1)]
+
+
+def test_backfilled_documents_share_the_spool(tmp_path):
+    """write_documents spools like a flush while down, and raises when it can't be stored at all."""
+    collection = FlakyCollection()
+    spool = WriteSpool(str(tmp_path / "spool.db"))
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    documents = [{'user_id': 1, 'file_hash': name} for name in 'ab']
+    flushed = []
+
+    async def run():
+        batcher = IndexBatcher(collection, on_flushed=flushed.extend, spool=spool, breaker=breaker)
+        assert await batcher.write_documents(documents, mark=(-100, 7)) is None
+        assert len(spool) == 2
+        assert flushed == []
+
+        collection.down = False
+        await batcher.replay_spool()
+        assert flushed == [(-100, 7)]
+        breaker.record_success()
+        assert await batcher.write_documents(documents, mark=(-100, 9)) == 2
+        assert flushed == [(-100, 7), (-100, 9)]
+
+        # Without a spool the failure reaches the caller (e.g. a job, which is marked failed)
+        collection.down = True
+        with pytest.raises(ConnectionError):
+            await IndexBatcher(collection).write_documents(documents)
+
+    asyncio.run(run())
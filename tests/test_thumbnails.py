@@ -0,0 +1,60 @@
+import os
+import sys
+import asyncio
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl import types
+
+from file_locations import media_thumb
+from thumbnails import ThumbStore, fetch_thumb, image_type
+
+
+def test_store_remembers_thumbs_and_missing_ones(tmp_path):
+    store = ThumbStore(str(tmp_path / "thumbs.db"), max_entries=2)
+    assert store.get('document:1') == (False, None)
+
+    store.put('document:1', b'\xff\xd8jpeg')
+    store.put('document:2', None)
+    assert store.get('document:1') == (True, b'\xff\xd8jpeg')
+    # Known to have no thumbnail: not fetched again
+    assert store.get('document:2') == (True, None)
+
+    # Over max_entries the oldest thumbnail goes
+    store.put('document:3', b'webp')
+    assert store.get('document:1') == (False, None)
+    assert store.get('document:3') == (True, b'webp')
+
+    # Kept across restarts
+    assert ThumbStore(str(tmp_path / "thumbs.db")).get('document:3') == (True, b'webp')
+
+
+def test_document_without_downloadable_thumb_uses_inline_bytes():
+    stripped = types.PhotoStrippedSize(type='i', bytes=b'\x01\x28\x28' + b'\x00' * 10)
+    thumb = media_thumb([stripped, types.PhotoPathSize(type='j', bytes=b'path')])
+    assert thumb['stripped'] and thumb['type'] == 'i'
+    assert media_thumb(None) is None
+
+    class NoDownloads:
+        async def download_file(self, *args, **kwargs):
+            raise AssertionError("inline thumbnails need no request")
+
+    data = asyncio.run(fetch_thumb(NoDownloads(), {'thumb': thumb}))
+    assert data.startswith(b'\xff\xd8') and image_type(data) == 'image/jpeg'
+
+
+def test_thumb_is_downloaded_from_its_dc():
+    location = {
+        'kind': 'document', 'id': 1, 'access_hash': 2, 'file_reference': b'ref', 'dc_id': 4,
+        'thumb': media_thumb([types.PhotoSize(type='m', w=320, h=180, size=900)])
+    }
+
+    class FakeClient:
+        async def download_file(self, file_location, file, file_size=None, dc_id=None):
+            assert file is bytes and dc_id == 4 and file_size == 900
+            assert file_location.thumb_size == 'm'
+            return b'RIFF\x00\x00\x00\x00WEBPdata'
+
+    data = asyncio.run(fetch_thumb(FakeClient(), location))
+    assert image_type(data) == 'image/webp'
@@ -0,0 +1,119 @@
+"""Thumbnails of indexed files for the website's result cards.
+
+Cards used to load /api/media, so showing a PDF or a video meant downloading
+the whole file. Telegram keeps small thumbnails with photos (photo.sizes)
+and most documents (document.thumbs); the stored file location records which
+one to use (see file_locations.media_thumb). It is fetched once with a
+single small upload.getFile request, or taken straight from the inline
+bytes Telegram sent with the message, and kept in a SQLite key-value store
+keyed by the file's identity, so every document of the same file shares it.
+Files without a thumbnail are remembered too, so they aren't asked for again.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+from telethon import utils
+
+import metrics
+from file_locations import thumb_location
+
+THUMB_DB = os.getenv(
+    'THUMB_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thumbnails.db')
+)
+
+# Most thumbnails kept; the oldest are dropped beyond this
+THUMB_CACHE_ENTRIES = int(os.getenv('THUMB_CACHE_ENTRIES', 50000))
+
+
+def image_type(data):
+    """Content type of a thumbnail from its first bytes (Telegram thumbs are JPEG or WebP)."""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+
+class ThumbStore:
+    """Thumbnail bytes by file identity, stored in SQLite."""
+
+    def __init__(self, path=THUMB_DB, max_entries=THUMB_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS thumbs ("
+            " key TEXT PRIMARY KEY,"
+            " data BLOB,"
+            " stored_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS thumbs_stored_at ON thumbs (stored_at)")
+        self._count = conn.execute("SELECT COUNT(*) FROM thumbs").fetchone()[0]
+        metrics.gauge("thumbs.entries", lambda: self._count)
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (found, data): data is None for a file known to have no thumbnail."""
+        row = self._connect().execute("SELECT data FROM thumbs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            metrics.incr("thumbs.misses")
+            return False, None
+        metrics.incr("thumbs.hits")
+        return True, row[0]
+
+    def put(self, key, data):
+        """Store the thumbnail of key (None: the file has none)."""
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO thumbs (key, data, stored_at) VALUES (?, ?, ?)",
+            (key, data, time.time())
+        )
+        # A replaced key is counted again; the count is corrected before evicting
+        self._count += 1
+        if self._count > self.max_entries:
+            self._count = conn.execute("SELECT COUNT(*) FROM thumbs").fetchone()[0]
+            excess = self._count - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM thumbs WHERE key IN "
+                    "(SELECT key FROM thumbs ORDER BY stored_at, rowid LIMIT ?)", (excess,)
+                )
+                self._count -= excess
+                metrics.incr("thumbs.evicted", excess)
+
+
+async def fetch_thumb(client, location):
+    """Return the thumbnail bytes of a stored location, or None if the file has none.
+
+    Raises FileReferenceExpiredError if the stored reference is no longer valid.
+
+    Args:
+        client: The raw TelegramClient of the account that stored the location
+    """
+    thumb = location.get('thumb')
+    if not thumb:
+        return None
+    if thumb.get('bytes'):
+        metrics.incr("thumbs.inline")
+        data = bytes(thumb['bytes'])
+        # Stripped thumbs come without the JPEG header
+        return utils.stripped_photo_to_jpg(data) if thumb.get('stripped') else data
+
+    dc_id, file_location = thumb_location(location)
+    started = time.monotonic()
+    data = await client.download_file(file_location, bytes, file_size=thumb.get('size'), dc_id=dc_id)
+    metrics.observe("thumbs.fetch_time", time.monotonic() - started)
+    metrics.incr("thumbs.downloaded")
+    return data
@@ -1,102 +1,215 @@
 import os
 import re
-from flask import Flask, request, jsonify, send_from_directory, send_file, abort, Response, stream_with_context
+import sys
+from quart import Quart, request, jsonify, send_from_directory, abort, Response
+from quart.wrappers.response import ResponseBody
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
-from telethon.sync import TelegramClient
+from telethon import TelegramClient
 import io
 import asyncio
 import requests
 import logging
 import mimetypes
-from FastTelethonhelper import fast_download
+import weakref
 from tqdm import tqdm
+from werkzeug.security import safe_join
+
+# Shared helpers (rate limiter, metrics) live in the project root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import metrics
+from rate_limiter import RateLimiter
+from entity_cache import EntityCache, INVALID_PEER_ERRORS
+from file_locations import media_location, is_fresh, download_location, stale_message_ids, refresh_locations, REFRESH_BATCH_SIZE
+from telethon.errors import FileReferenceExpiredError
+from file_id_cache import FileIdCache, document_key
+from download_manager import DownloadManager
+from media_cache import MediaCache
+from parallel_download import downloader
+from file_ranges import send_ranges
+from media_stream import open_sparse, parse_range, iter_range, STREAM_CHUNK_SIZE
+from thumbnails import ThumbStore, fetch_thumb, image_type
 
 # Load environment variables from project root
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 
-# Fix event loop for Telethon sync: create a single loop at startup
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-
-# MongoDB setup
+# MongoDB setup: request handlers await motor, the helpers shared with the bot take pymongo
 db_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
 client = MongoClient(db_uri)
 db = client['telegram_search_bot']
 collection = db['documents']
+documents = AsyncIOMotorClient(db_uri)['telegram_search_bot']['documents']
+
+# file_ids of files the bot has uploaded, shared by every document of the same file
+file_id_cache = FileIdCache(db['file_ids'], collection)
+
+# Downloaded media, shared with the bot and kept under MEDIA_CACHE_BYTES
+media_cache = MediaCache()
+media_cache.load()
 
-# Initialize Flask app
-app = Flask(__name__)
+# Downloads into the cache, coalesced with the bot's
+media_downloads = DownloadManager(cache=media_cache)
+
+# Telegram's embedded thumbnails, one per file, for the result cards
+thumb_store = ThumbStore()
+
+# Thumbnails never change for a file identity, so browsers keep them for a year
+THUMB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Initialize Quart app; Telethon runs on the same event loop, so requests wait on
+# Telegram and MongoDB concurrently instead of one at a time
+app = Quart(__name__)
 app.logger.setLevel(logging.DEBUG)
+# Media responses can stream for longer than Quart's 60s default
+app.config['RESPONSE_TIMEOUT'] = None
 
 # Telethon client setup (use .session file)
 API_ID = int(os.getenv('API_ID', '0'))
 API_HASH = os.getenv('API_HASH', '')
 SESSION_FILE = os.path.join(os.path.dirname(__file__), '+919205010115.session')
 tele_client = TelegramClient(SESSION_FILE, API_ID, API_HASH)
-tele_client.start()
+
+# Same account as the bot, so requests share the bot's token buckets and entity cache
+rate_limiter = RateLimiter()
+entity_cache = EntityCache(os.getenv('Phone_number', ''))
+
+# Stored file locations are only valid for the account that indexed them
+ACCOUNT = os.getenv('Phone_number', '') or "primary"
+
+class SparseStreamBody(ResponseBody):
+    """Body of an api_stream response: the first chunk, then the rest of the range.
+
+    Quart closes a body once it has started sending it; a response dropped
+    before that (the client disconnected first) releases its SparseCache when
+    it is garbage collected, so the cache is closed exactly once either way.
+    """
+
+    def __init__(self, first, chunks, cache):
+        self.first = first
+        self.chunks = chunks
+        self.cache = cache
+        self._release = weakref.finalize(self, cache.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            await self.chunks.aclose()
+        finally:
+            if self._release.detach() is not None:
+                # Publishes the file into media_cache once every chunk is present
+                await asyncio.to_thread(self.cache.close)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        yield self.first
+        async for data in self.chunks:
+            yield data
+
+@app.before_serving
+async def start_telegram():
+    await tele_client.start()
+
+@app.after_serving
+async def stop_telegram():
+    await downloader.close()
+    await tele_client.disconnect()
+
+async def resolve_entity(chat_id, refresh=False):
+    # Only hit Telegram when the shared entity cache can't answer
+    if not refresh:
+        cached = await entity_cache.get_async(chat_id)
+        if cached is not None:
+            return cached
+    await rate_limiter.acquire('get_entity')
+    return await entity_cache.resolve(tele_client, chat_id, refresh=refresh)
 
 @app.route('/css/<path:filename>')
-def serve_css(filename):
-    return send_from_directory('css', filename)
+async def serve_css(filename):
+    return await send_from_directory(os.path.join(app.root_path, 'css'), filename)
 
 @app.route('/js/<path:filename>')
-def serve_js(filename):
-    return send_from_directory('js', filename)
+async def serve_js(filename):
+    return await send_from_directory(os.path.join(app.root_path, 'js'), filename)
 
 @app.route('/media/<path:filename>')
-def serve_media(filename):
-    # Stream local downloaded media with Range support
-    media_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'downloads'))
-    file_path = os.path.join(media_dir, filename)
-    if not os.path.isfile(file_path):
+async def serve_media(filename):
+    # Stream local downloaded media with Range support, one buffer per response
+    file_path = safe_join(media_cache.directory, filename)
+    if file_path is None or not os.path.isfile(file_path):
         abort(404)
-    range_header = request.headers.get('Range', None)
-    if not range_header:
-        # Serve full file
-        mime = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-        return send_file(file_path, mimetype=mime)
-    # Parse byte range
-    size = os.path.getsize(file_path)
-    byte1, byte2 = 0, None
-    m = re.search(r'bytes=(\d+)-(\d*)', range_header)
-    if m:
-        g1, g2 = m.groups()
-        byte1 = int(g1)
-        if g2:
-            byte2 = int(g2)
-    byte2 = byte2 if byte2 is not None else size - 1
-    length = byte2 - byte1 + 1
-    with open(file_path, 'rb') as f:
-        f.seek(byte1)
-        data = f.read(length)
-    rv = Response(data, 206, mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream', direct_passthrough=True)
-    rv.headers.add('Content-Range', f'bytes {byte1}-{byte2}/{size}')
-    rv.headers.add('Accept-Ranges', 'bytes')
-    rv.headers.add('Content-Length', str(length))
-    return rv
+    mime = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    return send_ranges(file_path, mime, request.headers, Response)
 
 @app.route('/')
-def index():
-    return send_from_directory('.', 'index.html')
+async def index():
+    return await send_from_directory(app.root_path, 'index.html')
 
 @app.route('/<page>.html')
-def serve_page(page):
+async def serve_page(page):
     # Serve standalone HTML pages
-    return send_from_directory('.', f'{page}.html')
+    return await send_from_directory(app.root_path, f'{page}.html')
+
+async def fetch_message(chat_id, message_id):
+    """Fetch a message, refreshing stale stored locations from the same chat in the same request.
+
+    Returns (message, None) or (None, error response).
+    """
+    # Resolve the chat entity first
+    try:
+        entity = await resolve_entity(chat_id)
+        app.logger.debug(f"[api_media] resolved entity: {entity.peer_type} {entity.id}")
+    except Exception as e:
+        app.logger.error(f"[api_media] get_entity failed: {e}")
+        return None, (jsonify({'error': f'Failed to resolve chat entity: {e}'}), 500)
+    stale_ids = await asyncio.to_thread(stale_message_ids, collection, chat_id)
+    message_ids = [message_id] + [
+        stale_id for stale_id in stale_ids if stale_id != message_id
+    ][:REFRESH_BATCH_SIZE - 1]
+    # Fetch Telegram message via Telethon
+    await rate_limiter.acquire('get_messages')
+    try:
+        messages = await refresh_locations(tele_client, collection, entity, message_ids, ACCOUNT)
+    except INVALID_PEER_ERRORS as e:
+        # Stored access hash no longer valid, refresh the cached entity once
+        app.logger.debug(f"[api_media] cached entity rejected: {e}")
+        entity = await resolve_entity(chat_id, refresh=True)
+        await rate_limiter.acquire('get_messages')
+        messages = await refresh_locations(tele_client, collection, entity, message_ids, ACCOUNT)
+    message = messages.get(message_id)
+    app.logger.debug(f"[api_media] selected message: {message}")
+    if not message:
+        return None, (jsonify({'error': 'No media found'}), 404)
+    return message, None
+
+async def current_location(chat_id, message_id):
+    """Fetch the message and return (location, None) for its media, or (None, error response)."""
+    message, error = await fetch_message(chat_id, message_id)
+    if error:
+        return None, error
+    location = media_location(message, ACCOUNT)
+    if location is None:
+        return None, (jsonify({'error': 'No media found'}), 404)
+    return location, None
 
 @app.route('/api/media/<doc_id>')
-def api_media(doc_id):
+async def api_media(doc_id):
     app.logger.debug(f"[api_media] called with doc_id={doc_id}")
     # Fetch document
     try:
-        doc = collection.find_one({'_id': ObjectId(doc_id)})
+        doc = await documents.find_one({'_id': ObjectId(doc_id)})
         app.logger.debug(f"[api_media] doc from DB: {doc}")
     except:
         return jsonify({'error': 'Invalid document ID'}), 400
     if not doc:
         return jsonify({'error': 'Document not found'}), 404
+    if doc.get('deleted'):
+        return jsonify({'error': 'Document was deleted from its source'}), 410
     orig = doc.get('original_message', {})
     app.logger.debug(f"[api_media] original_message: {orig}")
     chat_id = orig.get('chat_id')
@@ -104,44 +217,12 @@ def api_media(doc_id):
     app.logger.debug(f"[api_media] chat_id: {chat_id}, message_id: {message_id}")
     if not chat_id or not message_id:
         return jsonify({'error': 'Original message missing'}), 400
-    # Resolve the chat entity first
-    try:
-        entity = tele_client.get_entity(chat_id)
-        app.logger.debug(f"[api_media] resolved entity: {entity}")
-    except Exception as e:
-        app.logger.error(f"[api_media] get_entity failed: {e}")
-        return jsonify({'error': f'Failed to resolve chat entity: {e}'}), 500
-    # Fetch Telegram message via Telethon
-    messages = tele_client.get_messages(entity, ids=[message_id])
-    app.logger.debug(f"[api_media] get_messages returned: {messages}")
-    if not messages:
-        return jsonify({'error': 'No media found'}), 404
-    message = messages[0] if isinstance(messages, (list, tuple)) else messages
-    app.logger.debug(f"[api_media] selected message: {message}")
-    app.logger.debug(f"[api_media] message.media attribute: {getattr(message, 'media', None)}")
-    if not getattr(message, 'media', None):
-        return jsonify({'error': 'No media found'}), 404
     # Download media to disk for caching and Range support
-    # Ensure trailing separator for correct fast_download path concatenation
-    downloads_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'downloads')) + os.sep
-    os.makedirs(downloads_dir, exist_ok=True)
     extension = doc.get('file_type') or 'bin'
-    local_filename = f"{doc_id}.{extension}"
-    local_path = os.path.join(downloads_dir, local_filename)
-    if not os.path.isfile(local_path):
-        # Evict old cache files if total exceeds 100MB
-        max_cache_size = 100 * 1024 * 1024  # 100MB
-        total_size = sum(os.path.getsize(os.path.join(downloads_dir, f)) for f in os.listdir(downloads_dir))
-        if total_size > max_cache_size:
-            files = sorted(os.listdir(downloads_dir), key=lambda f: os.path.getmtime(os.path.join(downloads_dir, f)))
-            for fname in files:
-                fpath = os.path.join(downloads_dir, fname)
-                size_f = os.path.getsize(fpath)
-                os.remove(fpath)
-                total_size -= size_f
-                app.logger.debug(f"[api_media] evicted cache file: {fpath}")
-                if total_size <= max_cache_size:
-                    break
+    # Named by file identity, so documents of the same file share one cached copy
+    key = document_key(doc) or doc_id
+    local_path = media_cache.path(key, extension)
+    if not await asyncio.to_thread(media_cache.lookup, local_path):
         app.logger.debug(f"[api_media] downloading media to disk: {local_path}")
         # Use tqdm to display download progress
         pbar = None
@@ -152,48 +233,164 @@ def api_media(doc_id):
             # Update bar by delta bytes
             pbar.update(downloaded - pbar.n)
             return None
-        if doc.get('mime_type', '').startswith('image/'):
-            tele_client.download_media(message, file=local_path, progress_callback=progress_callback)
-            app.logger.debug(f"[api_media] tele_client.download_media complete, file at: {local_path}")
-        else:
-            downloaded_path = loop.run_until_complete(
-                fast_download(
-                    tele_client,
-                    message,
-                    reply = "Starting download...",
-                    download_folder=downloads_dir,
-                    progress_bar_function = progress_callback
-                )
+        # Start straight from the stored file location, no get_messages round trip
+        location = doc.get('location')
+        if not (is_fresh(location) and location.get('account') == ACCOUNT):
+            location, error = await current_location(chat_id, message_id)
+            if error:
+                return error
+        # Written to a .part file and renamed when complete; requests for the same file
+        # (here, in the bot or in another worker) wait for the one download
+        await rate_limiter.acquire('download')
+        try:
+            await media_downloads.fetch(
+                key, local_path, lambda part: download_location(tele_client, location, part, progress_callback)
+            )
+        except FileReferenceExpiredError:
+            app.logger.debug(f"[api_media] stored file reference expired, refreshing")
+            metrics.incr("downloads.reference_expired")
+            location, error = await current_location(chat_id, message_id)
+            if error:
+                return error
+            await rate_limiter.acquire('download')
+            await media_downloads.fetch(
+                key, local_path, lambda part: download_location(tele_client, location, part, progress_callback)
             )
-            # Move downloaded file to cache path named by doc_id
+        app.logger.debug(f"[api_media] download complete, file at: {local_path}")
+        # Released once the response holds the file open, so eviction can't race it
+        rv = send_ranges(local_path, doc.get('mime_type') or 'application/octet-stream', request.headers, Response)
+        media_downloads.release(local_path)
+        return rv
+    return send_ranges(local_path, doc.get('mime_type') or 'application/octet-stream', request.headers, Response)
+
+@app.route('/api/thumb/<doc_id>')
+async def api_thumb(doc_id):
+    # Small preview from Telegram's embedded thumbnail, never the whole file
+    try:
+        doc = await documents.find_one({'_id': ObjectId(doc_id)}, {'original_message': 1, 'location': 1})
+    except Exception:
+        return jsonify({'error': 'Invalid document ID'}), 400
+    if not doc:
+        return jsonify({'error': 'Document not found'}), 404
+    key = document_key(doc) or doc_id
+    etag = f'"thumb-{key}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag, 'Cache-Control': THUMB_CACHE_CONTROL})
+    found, data = await asyncio.to_thread(thumb_store.get, key)
+    if not found:
+        orig = doc.get('original_message', {})
+        chat_id = orig.get('chat_id')
+        message_id = orig.get('message_id')
+        if not chat_id or not message_id:
+            return jsonify({'error': 'Original message missing'}), 400
+        location = doc.get('location')
+        # Locations stored before thumbnails were recorded have no 'thumb' entry
+        if not (is_fresh(location) and location.get('account') == ACCOUNT and 'thumb' in location):
+            location, error = await current_location(chat_id, message_id)
+            if error:
+                return error
+        await rate_limiter.acquire('download')
+        try:
             try:
-                os.replace(downloaded_path, local_path)
-                app.logger.debug(f"[api_media] moved downloaded file to cache: {local_path}")
-            except Exception as e:
-                app.logger.error(f"[api_media] could not rename downloaded file: {e}")
-                # Fallback to original downloaded path
-                local_path = downloaded_path
-            app.logger.debug(f"[api_media] fast_download complete, file at: {local_path}")
-    return send_file(local_path, mimetype=doc.get('mime_type') or 'application/octet-stream', conditional=True)
+                data = await fetch_thumb(tele_client, location)
+            except FileReferenceExpiredError:
+                metrics.incr("downloads.reference_expired")
+                location, error = await current_location(chat_id, message_id)
+                if error:
+                    return error
+                data = await fetch_thumb(tele_client, location)
+        except Exception as e:
+            app.logger.error(f"[api_thumb] could not fetch thumbnail of {doc_id}: {e}")
+            return jsonify({'error': f'Failed to fetch thumbnail: {e}'}), 502
+        await asyncio.to_thread(thumb_store.put, key, data)
+    if not data:
+        # The card falls back to its file type icon; asked again after a day at most
+        return Response(status=404, headers={'Cache-Control': 'public, max-age=86400'})
+    return Response(data, 200, headers={
+        'Content-Type': image_type(data),
+        'Cache-Control': THUMB_CACHE_CONTROL,
+        'ETag': etag
+    })
+
+@app.route('/api/stream/<doc_id>')
+async def api_stream(doc_id):
+    # Serve a Range request straight from Telegram's chunks, without waiting for the whole file
+    try:
+        doc = await documents.find_one({'_id': ObjectId(doc_id)})
+    except Exception:
+        return jsonify({'error': 'Invalid document ID'}), 400
+    if not doc:
+        return jsonify({'error': 'Document not found'}), 404
+    if doc.get('deleted'):
+        return jsonify({'error': 'Document was deleted from its source'}), 410
+    orig = doc.get('original_message', {})
+    chat_id = orig.get('chat_id')
+    message_id = orig.get('message_id')
+    if not chat_id or not message_id:
+        return jsonify({'error': 'Original message missing'}), 400
+    mime_type = doc.get('mime_type') or 'application/octet-stream'
+    # Same cache path as api_media, so a complete copy from either is reused
+    local_path = media_cache.path(document_key(doc) or doc_id, doc.get('file_type') or 'bin')
+    if await asyncio.to_thread(media_cache.lookup, local_path):
+        return send_ranges(local_path, mime_type, request.headers, Response)
+    location = doc.get('location')
+    if not (is_fresh(location) and location.get('account') == ACCOUNT):
+        location, error = await current_location(chat_id, message_id)
+        if error:
+            return error
+    size = location['size']
+    try:
+        start, end = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+    await rate_limiter.acquire('download')
+    cache = open_sparse(local_path, size, STREAM_CHUNK_SIZE, media_cache)
+    body = None
+    # Fetch the first chunk before answering, so an expired file reference can still be refreshed
+    try:
+        chunks = iter_range(tele_client, location, cache, start, end)
+        try:
+            first = await chunks.__anext__()
+        except FileReferenceExpiredError:
+            metrics.incr("downloads.reference_expired")
+            await chunks.aclose()
+            location, error = await current_location(chat_id, message_id)
+            if error:
+                return error
+            chunks = iter_range(tele_client, location, cache, start, end)
+            first = await chunks.__anext__()
+        body = SparseStreamBody(first, chunks, cache)
+    except Exception as e:
+        app.logger.error(f"[api_stream] could not start streaming {doc_id}: {e}")
+        return jsonify({'error': f'Failed to stream media: {e}'}), 502
+    finally:
+        # Error responses, and a client that went away while the first chunk was fetched
+        if body is None:
+            cache.close()
+    rv = Response(body, 206, mimetype=mime_type)
+    rv.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    rv.headers['Accept-Ranges'] = 'bytes'
+    rv.headers['Content-Length'] = str(end - start + 1)
+    return rv
 
 @app.route('/api/search')
-def api_search():
+async def api_search():
     q = request.args.get('q', '')
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('page_size', 10))
     if not q:
         return jsonify({'error': "Missing 'q' parameter"}), 400
     regex = re.compile(re.escape(q), re.IGNORECASE)
-    query = {'$or': [
+    query = {'deleted': {'$ne': True}, '$or': [
         {'text': regex},
         {'file_name': regex},
         {'file_type': regex}
     ]}
-    total_count = collection.count_documents(query)
+    total_count = await documents.count_documents(query)
     total_pages = -(-total_count // page_size)
-    cursor = collection.find(query).sort('date', -1).skip((page-1)*page_size).limit(page_size)
+    cursor = documents.find(query).sort('date', -1).skip((page-1)*page_size).limit(page_size)
     results = []
-    for doc in cursor:
+    async for doc in cursor:
         results.append({
             '_id': str(doc.get('_id')),
             'file_name': doc.get('file_name'),
@@ -210,15 +407,15 @@ def api_search():
     return jsonify({'results': results, 'total_count': total_count, 'total_pages': total_pages, 'page': page})
 
 @app.route('/api/source/<source_name>')
-def api_source(source_name):
+async def api_source(source_name):
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('page_size', 10))
-    query = {'source_name': source_name}
-    total_count = collection.count_documents(query)
+    query = {'source_name': source_name, 'deleted': {'$ne': True}}
+    total_count = await documents.count_documents(query)
     total_pages = -(-total_count // page_size)
-    cursor = collection.find(query).sort('date', -1).skip((page-1)*page_size).limit(page_size)
+    cursor = documents.find(query).sort('date', -1).skip((page-1)*page_size).limit(page_size)
     source_results = []
-    for doc in cursor:
+    async for doc in cursor:
         source_results.append({
             '_id': str(doc.get('_id')),
             'file_name': doc.get('file_name'),
@@ -235,9 +432,9 @@ def api_source(source_name):
     return jsonify({'results': source_results, 'total_count': total_count, 'total_pages': total_pages, 'page': page})
 
 @app.route('/api/document/<doc_id>')
-def api_document(doc_id):
+async def api_document(doc_id):
     try:
-        doc = collection.find_one({'_id': ObjectId(doc_id)})
+        doc = await documents.find_one({'_id': ObjectId(doc_id)})
     except Exception:
         return jsonify({'error': 'Invalid document ID'}), 400
     if not doc:
@@ -253,36 +450,38 @@ def api_document(doc_id):
         'source_name': doc.get('source_name'),
         'chat_id': doc.get('original_message', {}).get('chat_id'),
         'message_id': doc.get('original_message', {}).get('message_id'),
-        'media_url': f"/api/media/{doc.get('_id')}"
+        'media_url': f"/api/media/{doc.get('_id')}",
+        'stream_url': f"/api/stream/{doc.get('_id')}"
     })
 
 @app.route('/api/sources')
-def api_sources():
+async def api_sources():
     # Aggregate top groups by number of documents
     try:
         limit = int(request.args.get('limit', 6))
     except:
         limit = 6
     pipeline = [
+        {"$match": {"deleted": {"$ne": True}}},
         {"$group": {"_id": "$source_name", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$limit": limit}
     ]
     sources = []
-    for item in collection.aggregate(pipeline):
+    async for item in documents.aggregate(pipeline):
         sources.append({"source_name": item["_id"], "count": item["count"]})
     return jsonify(sources)
 
 @app.route('/api/recent')
-def api_recent():
+async def api_recent():
     # Return most recent documents
     try:
         limit = int(request.args.get('limit', 6))
     except:
         limit = 6
-    cursor = collection.find({}).sort('date', -1).limit(limit)
+    cursor = documents.find({'deleted': {'$ne': True}}).sort('date', -1).limit(limit)
     recent = []
-    for doc in cursor:
+    async for doc in cursor:
         recent.append({
             '_id': str(doc.get('_id')),
             'file_name': doc.get('file_name'),
@@ -298,22 +497,28 @@ def api_recent():
         })
     return jsonify({'results': recent})
 
+@app.route('/api/stats')
+async def api_stats():
+    # Runtime metrics of this process (rate limiter delays, cache usage)
+    return jsonify(metrics.snapshot())
+
 @app.route('/download/<doc_id>')
-def download_file(doc_id):
+async def download_file(doc_id):
     try:
-        doc = collection.find_one({'_id': ObjectId(doc_id)})
+        doc = await documents.find_one({'_id': ObjectId(doc_id)})
     except:
         return jsonify({'error': 'Invalid document ID'}), 400
     if not doc:
         return jsonify({'error': 'Document not found'}), 404
-    file_id = doc.get('file_id')
+    file_id, _ = await asyncio.to_thread(file_id_cache.get, doc)
     if not file_id:
         return jsonify({'error': 'No file to download'}), 404
     # Load bot token from TELEGRAM_BOT_TOKEN or fallback to BOT_TOKEN
     bot_token = os.getenv('TELEGRAM_BOT_TOKEN') or os.getenv('BOT_TOKEN')
     if not bot_token:
         return jsonify({'error': 'Missing bot token (TELEGRAM_BOT_TOKEN or BOT_TOKEN)'}), 500
-    info_resp = requests.get(f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}")
+    # Bot API calls run in worker threads so they don't hold up the event loop
+    info_resp = await asyncio.to_thread(requests.get, f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}")
     if not info_resp.ok:
         return jsonify({'error': 'Failed to fetch file info'}), 500
     result = info_resp.json().get('result', {})
@@ -325,18 +530,19 @@ def download_file(doc_id):
     range_header = request.headers.get('Range')
     if range_header:
         headers['Range'] = range_header
-    tg_resp = requests.get(tg_file_url, headers=headers, stream=True)
+    tg_resp = await asyncio.to_thread(requests.get, tg_file_url, headers=headers, stream=True)
     def generate():
+        # A sync generator, iterated by Quart in a worker thread
         for chunk in tg_resp.iter_content(chunk_size=8192):
             yield chunk
     filename = doc.get('file_name', file_id)
-    flask_resp = Response(stream_with_context(generate()), status=tg_resp.status_code, mimetype=tg_resp.headers.get('Content-Type'))
-    flask_resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    rv = Response(generate(), status=tg_resp.status_code, mimetype=tg_resp.headers.get('Content-Type'))
+    rv.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
     for h in ['Content-Range', 'Accept-Ranges', 'Content-Length']:
         if h in tg_resp.headers:
-            flask_resp.headers[h] = tg_resp.headers[h]
-    return flask_resp
+            rv.headers[h] = tg_resp.headers[h]
+    return rv
 
 if __name__ == '__main__':
-    # Run Flask app in single-threaded mode to maintain a consistent asyncio loop
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=False, use_reloader=False)
+    # Served by Hypercorn; Telethon, motor and every request share its event loop
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
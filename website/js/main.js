@@ -149,6 +149,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 const container = document.getElementById('recent-results');
                 container.innerHTML = data.results.map(item => `
                     <div class="result-card" data-id="${item._id}">
+                        ${resultThumb(item)}
                         <div class="result-date">${new Date(item.date).toLocaleDateString()}</div>
                         <h4>${item.file_name}</h4>
                         <p>${item.text.length > 100 ? item.text.slice(0, 100) + '...' : item.text}</p>
@@ -172,6 +173,11 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 // Utility functions
+function resultThumb(item) {
+    // Telegram's small embedded thumbnail; cards of files without one keep just their text
+    return `<img class="result-thumb" src="/api/thumb/${item._id}" loading="lazy" alt="" onerror="this.remove()" />`;
+}
+
 function loadSearchResults(page) {
     // hide trending results
     document.getElementById('trending-results').style.display = 'none';
@@ -214,6 +220,7 @@ function renderResults(results) {
     countElem.textContent = `${results.length} results`;
     resultsContainer.innerHTML = results.map(item => `
         <div class="result-card" data-id="${item._id}">
+            ${resultThumb(item)}
             <div class="result-date">${new Date(item.date).toLocaleDateString()}</div>
             <h4>${item.file_name}</h4>
             <p>${item.text.length>100 ? item.text.slice(0,100)+'...' : item.text}</p>
@@ -265,6 +272,7 @@ function renderTrendingResults(results) {
     const resultsContainer = document.getElementById('trending-results');
     resultsContainer.innerHTML = results.map(item => `
         <div class="result-card" data-id="${item._id}">
+            ${resultThumb(item)}
             <div class="result-date">${new Date(item.date).toLocaleDateString()}</div>
             <h4>${item.file_name}</h4>
             <p>${item.text.length>100 ? item.text.slice(0,100)+'...' : item.text}</p>
@@ -330,11 +338,11 @@ function openDocument(docId) {
             let content = '';
             if (doc.media_url) {
                 if (doc.mime_type.startsWith('video/')) {
-                    content += `<video controls preload="auto" style="width:100%; max-height:400px; margin-bottom:1em;"></video>`;
+                    content += `<video controls preload="metadata" src="${doc.stream_url}" style="width:100%; max-height:400px; margin-bottom:1em;"></video>`;
                 } else if (doc.mime_type.startsWith('image/')) {
                     content += `<img src="${doc.media_url}" style="width:100%; margin-bottom:1em;" onload="this.previousSibling.remove()" />`;
                 } else if (doc.mime_type.startsWith('audio/')) {
-                    content += `<audio controls src="${doc.media_url}" style="width:100%; margin-bottom:1em;" onloadedmetadata="this.previousSibling.remove()"></audio>`;
+                    content += `<audio controls src="${doc.stream_url}" style="width:100%; margin-bottom:1em;" onloadedmetadata="this.previousSibling.remove()"></audio>`;
                 } else if (doc.mime_type === 'application/pdf') {
                     content += `<iframe src="${doc.media_url}#view=fitH" type="application/pdf" width="100%" height="600px" style="margin-bottom:1em; border:none;"></iframe>`;
                 }
@@ -399,40 +407,20 @@ function openDocument(docId) {
             });
             // Skip buffering setup when not a media file
             if (!hasMedia) return;
-            // Setup video buffering progress using XHR
+            // Video streams through Range requests, so playback starts with the first chunks
             const bufferContainer = modalBody.querySelector('.buffer-container');
-            const bufferBar = bufferContainer.querySelector('.buffer-bar');
             const bufferText = modalBody.querySelector('.buffer-text');
             const videoEl = modalBody.querySelector('video');
             if (videoEl) {
-                // Use XHR to fetch media with progress events
-                const url = doc.media_url;
-                const xhr = new XMLHttpRequest();
-                xhr.open('GET', url, true);
-                xhr.responseType = 'blob';
-                xhr.onprogress = event => {
-                    if (event.lengthComputable) {
-                        const percent = Math.floor(event.loaded / event.total * 100);
-                        bufferBar.style.width = percent + '%';
-                        bufferText.textContent = 'Loading: ' + percent + '%';
-                    }
-                };
-                xhr.onload = () => {
+                videoEl.addEventListener('loadeddata', () => {
                     bufferContainer.remove();
                     bufferText.remove();
-                    videoEl.src = URL.createObjectURL(xhr.response);
-                };
-                xhr.onerror = () => {
-                    bufferContainer.remove();
-                    bufferText.remove();
-                    videoEl.src = url;
-                };
-                xhr.send();
+                });
             }
             // Fallback removal for images and audio
             const fallbackMedia = modalBody.querySelector('img, audio');
             if (fallbackMedia) {
-                const eventName = fallbackMedia.tagName === 'IMG' ? 'load' : 'canplaythrough';
+                const eventName = fallbackMedia.tagName === 'IMG' ? 'load' : 'canplay';
                 fallbackMedia.addEventListener(eventName, () => {
                     bufferContainer.remove();
                     bufferText.remove();